@@ -0,0 +1,117 @@
+import asyncio
+import json
+import random
+from aiohttp import web
+
+# Ответ на запросы с response_format=json_object: подходит и анализу звонка (целиком и по частям),
+# и извлечению фраз для скрипта
+_JSON_REPLY = {
+    "call_quality": "хороший",
+    "analysis": "Менеджер поприветствовал клиента, выявил бюджет и предложил тест-драйв.",
+    "recommendations": ["Уточнять сроки покупки", "Чаще предлагать апсейл", "Фиксировать следующий шаг"],
+    "stages": {"приветствие": "по скрипту"},
+    "strengths": ["Выявление потребностей"],
+    "weaknesses": ["Закрытие"],
+    "notes": "Тестовый ответ",
+    "greeting": ["Добрый день! Меня зовут Анна, салон премиальных автомобилей."],
+    "needs_discovery": ["Какой бюджет вы рассматриваете?"],
+    "presentation": ["Bentley Continental GT - идеальный баланс скорости и комфорта."],
+    "objections": ["Понимаю, давайте сравним стоимость владения."],
+    "closing": ["Записать вас на тест-драйв в субботу?"],
+}
+_TEXT_REPLY = (
+    "Отличный выбор! Рекомендую обратить внимание на Bentley Continental GT: "
+    "626 л.с., разгон до 100 км/ч за 3,6 секунды и салон ручной работы. "
+    "Могу записать вас на тест-драйв и подготовить индивидуальное предложение по trade-in."
+)
+
+
+class FakeOpenRouter:
+    """Локальная замена OpenRouter: /chat/completions с настраиваемой задержкой, SSE и ошибками 429.
+
+    Задержка до первого токена - логнормальная с медианой latency и разбросом sigma,
+    далее token_delay на каждое слово ответа.
+    """
+
+    def __init__(self, latency=0.3, sigma=0.5, token_delay=0.01, error_rate=0.0, retry_after=0.2, seed=None):
+        self.latency = latency
+        self.sigma = sigma
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "streams": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def _first_token_delay(self):
+        return self.latency * self.random.lognormvariate(0, self.sigma)
+
+    async def handle_completion(self, request):
+        payload = await request.json()
+        self.stats["requests"] += 1
+        if self.random.random() < self.error_rate:
+            self.stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"code": 429, "message": "Rate limit exceeded"}},
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps(_JSON_REPLY, ensure_ascii=False)
+        else:
+            content = _TEXT_REPLY
+        words = content.split(" ")
+        prompt_tokens = sum(len(m.get("content", "")) for m in payload.get("messages", [])) // 3
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "cost": 0.0,
+        }
+
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            await asyncio.sleep(self._first_token_delay())
+            if payload.get("stream"):
+                self.stats["streams"] += 1
+                return await self._stream(request, payload, words, usage)
+            await asyncio.sleep(self.token_delay * len(words))
+            return web.json_response({
+                "id": f"gen-{self.stats['requests']}",
+                "model": payload.get("model"),
+                "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def _stream(self, request, payload, words, usage):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for i, word in enumerate(words):
+            delta = word if i == 0 else " " + word
+            chunk = {"model": payload.get("model"), "choices": [{"delta": {"content": delta}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.token_delay)
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/chat/completions", self.handle_completion)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8950):
+        """Запускает сервер в текущем event loop; возвращает runner для остановки"""
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.fake_openrouter - отдельный сервер для ручных проверок
+    web.run_app(FakeOpenRouter().make_app(), host="127.0.0.1", port=8950)
@@ -0,0 +1,114 @@
+import asyncio
+import itertools
+
+_message_ids = itertools.count(1)
+
+
+class FakeTelegramStats:
+    def __init__(self):
+        self.sent = 0
+        self.edited = 0
+        self.deleted = 0
+        self.actions = 0
+
+
+class FakeUser:
+    def __init__(self, user_id, language_code="ru", first_name="Тест"):
+        self.id = user_id
+        self.language_code = language_code
+        self.first_name = first_name
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeMessage:
+    """Сообщение с методами, которые вызывают обработчики; каждый вызов "API" занимает latency секунд"""
+
+    def __init__(self, chat, text, latency, stats):
+        self.message_id = next(_message_ids)
+        self.chat = chat
+        self.text = text
+        self.latency = latency
+        self.stats = stats
+
+    async def _api_call(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def reply_text(self, text, **kwargs):
+        await self._api_call()
+        self.stats.sent += 1
+        return FakeMessage(self.chat, text, self.latency, self.stats)
+
+    async def edit_text(self, text, **kwargs):
+        await self._api_call()
+        self.stats.edited += 1
+        self.text = text
+        return self
+
+    async def delete(self):
+        await self._api_call()
+        self.stats.deleted += 1
+        return True
+
+    async def reply_chat_action(self, action, **kwargs):
+        await self._api_call()
+        self.stats.actions += 1
+        return True
+
+
+class FakeUpdate:
+    """Минимальный Update: только атрибуты, с которыми работают обработчики бота"""
+
+    def __init__(self, update_id, user, chat, message):
+        self.update_id = update_id
+        self.effective_user = user
+        self.effective_chat = chat
+        self.message = message
+
+
+class FakeBot:
+    """Bot для фоновых задач: send_message в чат; wait_for(chat_id) ждет первого сообщения в чат"""
+
+    def __init__(self, stats, latency=0.0):
+        self.stats = stats
+        self.latency = latency
+        self._delivered = set()
+        self._waiters = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.stats.sent += 1
+        self._delivered.add(chat_id)
+        waiter = self._waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(True)
+        return FakeMessage(FakeChat(chat_id), text, self.latency, self.stats)
+
+    async def wait_for(self, chat_id):
+        if chat_id in self._delivered:
+            return
+        waiter = self._waiters.setdefault(chat_id, asyncio.get_running_loop().create_future())
+        await waiter
+
+
+class FakeContext:
+    bot_data = {}
+    user_data = {}
+    chat_data = {}
+
+
+def make_update(update_id, text, stats, user_id=None, language_code="ru", latency=0.0):
+    """Входящее текстовое сообщение от пользователя user_id (по умолчанию - свой чат на каждое обновление)"""
+    user_id = user_id or 10_000_000 + update_id
+    chat = FakeChat(user_id)
+    return FakeUpdate(
+        update_id,
+        FakeUser(user_id, language_code),
+        chat,
+        FakeMessage(chat, text, latency, stats),
+    )
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from config import Config
+from benchmarks.fake_openrouter import FakeOpenRouter
+from benchmarks.fake_telegram import FakeBot, FakeContext, FakeTelegramStats, make_update
+
+MODES = ("sales", "analysis", "script", "message")
+
+_CALL_TURNS = [
+    "Менеджер: Добрый день! Салон премиальных автомобилей, меня зовут Анна.",
+    "Клиент: Здравствуйте, интересует Bentley Continental GT.",
+    "Менеджер: Отличный выбор! Подскажите, какой бюджет вы рассматриваете?",
+    "Клиент: Около 350 тысяч долларов, но хочу понять комплектации.",
+    "Менеджер: В этот бюджет входит версия V8 с пакетом Mulliner. Предлагаю тест-драйв в субботу.",
+    "Клиент: Дороговато, у конкурентов дешевле.",
+    "Менеджер: Понимаю. Давайте сравним стоимость владения и условия trade-in.",
+]
+
+
+def _prepare_config(args, data_dir):
+    """Все файлы бота - во временной папке, OpenRouter - локальный, лимиты не мешают замеру"""
+    Config.OPENROUTER_BASE_URL = f"http://127.0.0.1:{args.port}"
+    Config.OPENROUTER_HTTP2 = False
+    Config.SALES_STREAMING = args.streaming
+    Config.CRM_DB_FILE = data_dir / "crm.sqlite3"
+    Config.RESPONSE_CACHE_DB = data_dir / "responses.sqlite3"
+    Config.SCRIPTS_DIR = data_dir / "scripts"
+    Config.PRODUCT_INDEX_DIR = data_dir / "index"
+    Config.ANALYSIS_RESULTS_DB = data_dir / "analysis.sqlite3"
+    Config.TASK_QUEUE_DB = data_dir / "jobs.sqlite3"
+    Config.MEMORY_DB = data_dir / "memory.sqlite3"
+    Config.TASK_QUEUE_WORKERS = args.queue_workers
+    if not args.repeat_queries:
+        # Похожие уникальные вопросы не должны отдаваться из семантического кэша
+        Config.RESPONSE_CACHE_SIMILARITY = 1.01
+    if not args.rate_limits:
+        Config.MODEL_RATE_LIMITS = {"default": {"rpm": 10 ** 9, "tpm": 10 ** 12}}
+
+
+def _query(mode, index, args):
+    if mode == "analysis":
+        return "\n".join(_CALL_TURNS * args.call_repeats)
+    if mode == "script":
+        return "скрипт"
+    if args.repeat_queries:
+        # Небольшой набор повторяющихся вопросов - проверка работы кэша ответов
+        return ("Хочу Bentley", "Что посоветуете до $300k?", "Нужен семейный люкс")[index % 3]
+    # Уникальный вопрос на каждый запрос - замер пути без кэша
+    return f"Что посоветуете в бюджете ${200 + index}k?"
+
+
+def _memory_mb():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _run_one(main_handler, bot, mode, index, args, stats):
+    update = make_update(index, _query(mode, index, args), stats, latency=args.telegram_latency)
+    context = FakeContext()
+    started = time.perf_counter()
+    if mode == "sales":
+        main_handler.user_states[update.effective_user.id] = "sales"
+        await main_handler.handle_sales(update, context)
+    elif mode in ("analysis", "script"):
+        if mode == "analysis":
+            await main_handler.handle_analysis(update, context)
+        else:
+            await main_handler.handle_script_gen(update, context)
+        # Задача ушла в очередь - замеряем до отправки результата воркером
+        if await main_handler.task_queue.recent_for_user(update.effective_user.id, limit=1):
+            await bot.wait_for(update.effective_chat.id)
+    else:
+        # Полный путь: переключение режимов, склейка в ChatScheduler, обработчик режима
+        await main_handler.handle_message(update, context)
+        state = main_handler.chat_scheduler._chats.get(update.effective_chat.id)
+        if state is not None and state.task is not None:
+            await asyncio.gather(state.task, return_exceptions=True)
+    return time.perf_counter() - started
+
+
+async def run_level(main_handler, bot, mode, concurrency, args, offset):
+    """Прогон args.requests запросов одного режима при заданном числе одновременных пользователей"""
+    stats = FakeTelegramStats()
+    # Сообщения воркеров очереди считаются в статистике текущего уровня
+    bot.stats = stats
+    semaphore = asyncio.Semaphore(concurrency)
+    gc.collect()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    async def limited(index):
+        async with semaphore:
+            return await _run_one(main_handler, bot, mode, offset + index, args, stats)
+
+    started = time.perf_counter()
+    latencies = np.array(await asyncio.gather(*(limited(i) for i in range(args.requests))))
+    wall = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "throughput_rps": args.requests / wall,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "memory_mb": _memory_mb(),
+        "telegram_calls": stats.sent + stats.edited + stats.deleted + stats.actions,
+    }
+
+
+def _print_table(results):
+    header = f"{'mode':<9}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mem MB':>9}{'tg calls':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['mode']:<9}{r['concurrency']:>6}{r['throughput_rps']:>10.1f}{r['p50_ms']:>10.0f}"
+            f"{r['p95_ms']:>10.0f}{r['p99_ms']:>10.0f}{r['memory_mb']:>9.1f}{r['telegram_calls']:>10}"
+        )
+
+
+async def main(args):
+    fake = FakeOpenRouter(
+        latency=args.latency_ms / 1000, sigma=args.latency_sigma, token_delay=args.token_delay_ms / 1000,
+        error_rate=args.error_rate, retry_after=args.retry_after, seed=args.seed,
+    )
+    runner = await fake.start(port=args.port)
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as tmp:
+        _prepare_config(args, Path(tmp))
+        # Сервисы бота создаются при импорте - уже с подмененной конфигурацией
+        from bot.handlers import main_handler
+        from bot.services.openrouter_client import openrouter_client
+
+        if args.trace_memory:
+            tracemalloc.start()
+        main_handler.rag_service.start()
+        openrouter_client.start()
+        bot = FakeBot(FakeTelegramStats(), latency=args.telegram_latency)
+        main_handler.task_queue.start(bot)
+        results = []
+        offset = 0
+        try:
+            for mode in args.modes:
+                for concurrency in args.concurrency:
+                    results.append(await run_level(main_handler, bot, mode, concurrency, args, offset))
+                    offset += args.requests
+                    if args.verbose:
+                        _print_table(results[-1:])
+        finally:
+            await main_handler.task_queue.stop()
+            await openrouter_client.close()
+            main_handler.rag_service.crm.close()
+            await runner.cleanup()
+
+    print()
+    _print_table(results)
+    print(f"\nFake OpenRouter: {fake.stats}")
+    if args.output:
+        args.output.write_text(json.dumps({"results": results, "upstream": fake.stats}, indent=2), encoding="utf-8")
+    return results
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный замер обработчиков бота на локальных заглушках")
+    parser.add_argument("--modes", type=lambda v: [m for m in v.split(",") if m], default=list(MODES),
+                        help="sales,analysis,script,message")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=64, help="запросов на каждый уровень конкурентности")
+    parser.add_argument("--latency-ms", type=float, default=300, help="медиана задержки до первого токена")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="разброс логнормальной задержки")
+    parser.add_argument("--token-delay-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="задержка одного вызова Bot API, с")
+    parser.add_argument("--call-repeats", type=int, default=4, help="длина звонка для анализа (повторы диалога)")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false")
+    parser.add_argument("--repeat-queries", action="store_true")
+    parser.add_argument("--queue-workers", type=int, default=Config.TASK_QUEUE_WORKERS,
+                        help="воркеров очереди фоновых задач (analysis, script)")
+    parser.add_argument("--rate-limits", action="store_true", help="не отключать MODEL_RATE_LIMITS")
+    parser.add_argument("--trace-memory", action="store_true", help="пик памяти по tracemalloc (медленнее)")
+    parser.add_argument("--port", type=int, default=8950)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", type=Path, default=None, help="JSON с результатами")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"неизвестные режимы: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.run --modes sales,analysis --concurrency 1,16,64 --error-rate 0.05
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    asyncio.run(main(parse_args()))
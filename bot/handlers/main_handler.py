@@ -1,24 +1,45 @@
+import asyncio
 import logging
+import time
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
 from bot.services.rag_service import RAGService
 from bot.services.call_analyzer import CallAnalyzer
 from bot.services.script_generator import ScriptGenerator
+from bot.services.script_store import ScriptStore
+from bot.services.chat_scheduler import ChatScheduler
+from bot.services.state_store import TTLStateStore
+from bot.services.task_queue import TaskQueue
+from bot.services.transcription import SAMPLE_RATE, Transcriber, decode_audio, format_timestamp
+from bot.services.metrics import HANDLER_ERRORS, HANDLER_SECONDS, span
 from config import Config
 
 # Инициализируем сервисы один раз
 rag_service = RAGService()
 call_analyzer = CallAnalyzer()
 script_generator = ScriptGenerator()
+script_store = ScriptStore(script_generator)
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+# Состояния пользователей (ограничены по размеру и времени жизни)
+user_states = TTLStateStore()
+
+# Склейка быстрых сообщений и отмена устаревших генераций по чатам
+chat_scheduler = ChatScheduler()
+
+# Долгие задачи (анализ звонков, генерация скриптов) - в фоновой очереди
+task_queue = TaskQueue()
+
+# Распознавание голосовых сообщений и записей звонков (пул процессов создается при старте бота, on_startup)
+transcriber = Transcriber()
+
+# Максимальная длина сообщения Telegram (4096) с запасом
+TELEGRAM_MESSAGE_LIMIT = 4000
 
 def add_test_user_to_crm(user_id, first_name):
     """Добавляет тестового пользователя в CRM для демонстрации"""
     test_user = {
-        "client_id": 999,
         "telegram_user_id": user_id,
         "name": first_name or "Тестовый клиент",
         "previous_purchase": "Bentley Continental GT (2022)",
@@ -32,11 +53,12 @@ def add_test_user_to_crm(user_id, first_name):
     }
     
     # Добавляем пользователя в память (в реальном проекте - в базу данных)
-    rag_service.clients.append(test_user)
-    return test_user
+    return rag_service.crm.upsert(test_user)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_states[update.effective_user.id] = "sales"
+    # /start - новая консультация, прошлый диалог не подмешивается в промпт
+    rag_service.memory.clear(update.effective_user.id)
     
     # Определяем язык для приветствия
     if update.effective_user.language_code and update.effective_user.language_code.startswith('ru'):
@@ -72,10 +94,11 @@ How can I help you?"""
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    text = update.message.text.lower()
 
-    # Логика переключения режимов
-    if "анализ звонка" in text or "call analysis" in text:
+    # Логика переключения режимов: команда - короткое сообщение целиком, а не подстрока
+    # (вопрос со словом "sales" внутри режим не сбрасывает)
+    mode = rag_service.intent_router.mode_switch(update.message.text)
+    if mode == "analysis":
         user_states[user_id] = "analysis"
         if update.effective_user.language_code and update.effective_user.language_code.startswith('ru'):
             msg = """🔍 **Режим анализа звонков активирован**
@@ -98,7 +121,7 @@ Waiting for conversation text..."""
         await update.message.reply_text(msg, parse_mode='Markdown')
         return
         
-    elif "генерация скрипта" in text or "script generation" in text:
+    elif mode == "script_gen":
         user_states[user_id] = "script_gen"
         if update.effective_user.language_code and update.effective_user.language_code.startswith('ru'):
             msg = """📝 **Режим генерации скрипта активирован**
@@ -125,7 +148,7 @@ Script will include:
         await update.message.reply_text(msg, parse_mode='Markdown')
         return
         
-    elif "продажи" in text or "sales" in text:
+    elif mode == "sales":
         user_states[user_id] = "sales"
         if update.effective_user.language_code and update.effective_user.language_code.startswith('ru'):
             msg = """💼 **Режим продаж активирован**
@@ -150,72 +173,194 @@ Example queries:
         await update.message.reply_text(msg, parse_mode='Markdown')
         return
 
-    # Обработка в зависимости от режима
-    mode = user_states.get(user_id, "sales")
-    
-    if mode == "sales":
-        await handle_sales(update, context)
-    elif mode == "analysis":
-        await handle_analysis(update, context)
-    elif mode == "script_gen":
-        await handle_script_gen(update, context)
-
-async def handle_sales(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик режима продаж с использованием CRM данных"""
-    await update.message.reply_chat_action("typing")
+    # Вопрос о цене или каталоге отвечаем сразу из базы знаний - без LLM и без паузы debounce
+    if user_states.get(user_id, "sales") == "sales" and Config.INTENT_FAST_PATH:
+        if await _quick_reply(update):
+            return
+
+    # Обработка в зависимости от режима - через планировщик чата. Анализ и генерация скрипта
+    # ставят задачу в очередь: их не отменяем, иначе склеенный текст попадет в очередь повторно
+    chat_scheduler.submit(
+        update.effective_chat.id,
+        update.message.text,
+        lambda combined_text: _dispatch(update, context, combined_text),
+        interruptible=user_states.get(user_id, "sales") == "sales"
+    )
+
+async def _dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    """Передает (склеенный) текст обработчику текущего режима пользователя"""
+    mode = user_states.get(update.effective_user.id, "sales")
+    started = time.monotonic()
     
     try:
-        user_language_code = update.effective_user.language_code
-        user_id = update.effective_user.id
-        
-        # Получаем информацию о клиенте из CRM
-        client_info = rag_service.get_client_info(user_id)
-        
-        # Если клиента нет в CRM, добавляем его как тестового для демонстрации
-        if not client_info:
-            client_info = add_test_user_to_crm(user_id, update.effective_user.first_name)
-            
-        # Генерируем персонализированный ответ
-        suggestion = await rag_service.get_ai_suggestion(
-            update.message.text, 
-            client_info, 
-            user_language_code
-        )
-        
-        # Определяем язык для отображения CRM информации
-        is_russian = user_language_code and user_language_code.startswith('ru')
-        
-        if is_russian:
-            crm_info = f"""📊 **Данные клиента из CRM:**
+        if mode == "sales":
+            await handle_sales(update, context, text)
+        elif mode == "analysis":
+            await handle_analysis(update, context, text)
+        elif mode == "script_gen":
+            await handle_script_gen(update, context, text)
+    finally:
+        HANDLER_SECONDS.observe(time.monotonic() - started, mode=mode)
+
+def _format_crm_header(client_info, is_russian):
+    """Шапка с данными клиента из CRM (отправляется до ответа ИИ)"""
+    if is_russian:
+        return f"""📊 **Данные клиента из CRM:**
 • **Имя:** {client_info['name']}
 • **Статус:** {client_info['deal_status']}
 • **Предыдущая покупка:** {client_info.get('previous_purchase', 'Нет')}
 • **Бюджет:** {client_info['budget']}
 • **Предпочтения:** {client_info.get('preferences', 'Не указаны')}
 
----
-
-{suggestion}"""
-        else:
-            crm_info = f"""📊 **Client CRM Data:**
+---"""
+    return f"""📊 **Client CRM Data:**
 • **Name:** {client_info['name']}
 • **Status:** {client_info['deal_status']}
 • **Previous Purchase:** {client_info.get('previous_purchase', 'None')}
 • **Budget:** {client_info['budget']}
 • **Preferences:** {client_info.get('preferences', 'Not specified')}
 
----
+---"""
 
-{suggestion}"""
+async def _edit_text(message, text, parse_mode=None):
+    """Редактирует сообщение, не падая на "message is not modified" и ошибках Markdown"""
+    try:
+        await message.edit_text(text, parse_mode=parse_mode, disable_web_page_preview=True)
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+        if parse_mode is None:
+            raise
+        # Частичный Markdown от модели может не разобраться - отправляем как есть
+        await message.edit_text(text, disable_web_page_preview=True)
+
+async def _stream_reply(update: Update, chunks, sent):
+    """Постепенно выводит ответ в одно сообщение, редактируя его не чаще STREAM_EDIT_INTERVAL.
+
+    Отправленные сообщения добавляются в sent - при отмене их удаляет handle_sales.
+    """
+    message = await update.message.reply_text("⏳")
+    sent.append(message)
+    text = ""
+    shown_len = 0
+    last_edit = 0.0
+
+    async for delta in chunks:
+        text += delta
+        # Ответ не помещается в одно сообщение - фиксируем текущее и начинаем новое
+        if len(text) > TELEGRAM_MESSAGE_LIMIT:
+            await _edit_text(message, text[:TELEGRAM_MESSAGE_LIMIT])
+            text = text[TELEGRAM_MESSAGE_LIMIT:]
+            message = await update.message.reply_text(text or "⏳")
+            sent.append(message)
+            shown_len = len(text)
+            last_edit = time.monotonic()
+            continue
+
+        now = time.monotonic()
+        if (now - last_edit >= Config.STREAM_EDIT_INTERVAL
+                and len(text) - shown_len >= Config.STREAM_MIN_DELTA_CHARS):
+            await _edit_text(message, text + " ▌")
+            shown_len = len(text)
+            last_edit = now
+
+    # Финальная версия с разметкой
+    await _edit_text(message, text or "…", parse_mode='Markdown')
+    return text
+
+def _client_info(update: Update):
+    """Данные клиента из CRM; нового пользователя добавляем как тестового для демонстрации"""
+    with span("crm_lookup"):
+        client_info = rag_service.get_client_info(update.effective_user.id)
+        if not client_info:
+            client_info = add_test_user_to_crm(update.effective_user.id, update.effective_user.first_name)
+    return client_info
+
+async def _quick_reply(update: Update):
+    """Ответ из каталога на вопрос о цене, наличии или составе каталога; False - нужен LLM"""
+    started = time.monotonic()
+    user_language_code = update.effective_user.language_code
+    try:
+        answer = rag_service.quick_answer(update.message.text, user_language_code, update.effective_user.id)
+        if answer is None:
+            return False
+        is_russian = user_language_code and user_language_code.startswith('ru')
+        crm_header = _format_crm_header(_client_info(update), is_russian)
+        with span("telegram_send"):
+            await update.message.reply_text(
+                f"{crm_header}\n\n{answer}",
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+    except Exception as e:
+        # Ответит обычный путь через LLM
+        logging.error(f"Ошибка быстрого ответа из каталога: {e}")
+        HANDLER_ERRORS.inc(mode="sales")
+        return False
+    finally:
+        HANDLER_SECONDS.observe(time.monotonic() - started, mode="sales")
+    return True
+
+async def handle_sales(update: Update, context: ContextTypes.DEFAULT_TYPE, text=None):
+    """Обработчик режима продаж с использованием CRM данных"""
+    text = text or update.message.text
+    await update.message.reply_chat_action("typing")
+    # Уже отправленные части ответа: при отмене генерации (пришло новое сообщение) их удаляем
+    sent = []
+    
+    try:
+        user_language_code = update.effective_user.language_code
+        user_id = update.effective_user.id
+        
+        # Получаем информацию о клиенте из CRM
+        client_info = _client_info(update)
         
-        await update.message.reply_text(
-            crm_info, 
-            parse_mode='Markdown',
-            disable_web_page_preview=True
+        # Определяем язык для отображения CRM информации
+        is_russian = user_language_code and user_language_code.startswith('ru')
+        crm_header = _format_crm_header(client_info, is_russian)
+
+        if Config.SALES_STREAMING:
+            # Шапку CRM отправляем сразу, ответ ИИ дописываем по мере генерации
+            with span("telegram_send"):
+                sent.append(await update.message.reply_text(
+                    crm_header,
+                    parse_mode='Markdown',
+                    disable_web_page_preview=True
+                ))
+            await _stream_reply(
+                update,
+                rag_service.stream_ai_suggestion(text, client_info, user_language_code, user_id=user_id),
+                sent
+            )
+            return
+            
+        # Генерируем персонализированный ответ
+        suggestion = await rag_service.get_ai_suggestion(
+            text, 
+            client_info, 
+            user_language_code,
+            user_id=user_id
         )
         
+        with span("telegram_send"):
+            await update.message.reply_text(
+                f"{crm_header}\n\n{suggestion}", 
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        
+    except asyncio.CancelledError:
+        # Ответ устарел: ChatScheduler ответит на объединенный текст заново - убираем шапку
+        # и недописанный ответ, чтобы они не остались в чате
+        for message in sent:
+            try:
+                await message.delete()
+            except Exception as e:
+                logging.warning(f"Не удалось удалить устаревший ответ: {e}")
+        raise
     except Exception as e:
         logging.error(f"Ошибка в режиме продаж: {e}")
+        HANDLER_ERRORS.inc(mode="sales")
         
         # Определяем язык для сообщения об ошибке
         if update.effective_user.language_code and update.effective_user.language_code.startswith('ru'):
@@ -225,26 +370,12 @@ async def handle_sales(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         await update.message.reply_text(error_msg)
 
-async def handle_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик режима анализа звонков"""
-    await update.message.reply_chat_action("typing")
-    
-    # Определяем язык пользователя
-    is_russian = update.effective_user.language_code and update.effective_user.language_code.startswith('ru')
-    
+def _format_analysis(analysis, is_russian):
+    recommendations = "\n\n".join(
+        f"{number} {item}" for number, item in zip(("1️⃣", "2️⃣", "3️⃣"), analysis['recommendations'])
+    )
     if is_russian:
-        processing_msg = "🔍 **Анализирую звонок...** \n\nЭто может занять до минуты. Пожалуйста, подождите."
-    else:
-        processing_msg = "🔍 **Analyzing call...** \n\nThis may take up to a minute. Please wait."
-    
-    status_message = await update.message.reply_text(processing_msg, parse_mode='Markdown')
-    
-    try:
-        # Анализируем звонок с помощью ИИ
-        analysis = await call_analyzer.analyze(update.message.text)
-        
-        if is_russian:
-            response_text = f"""📊 **Результат анализа звонка**
+        return f"""📊 **Результат анализа звонка**
 
 🎯 **Качество звонка:** {analysis['call_quality']}
 
@@ -252,16 +383,11 @@ async def handle_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
 {analysis['analysis']}
 
 💡 **Рекомендации по улучшению:**
-1️⃣ {analysis['recommendations'][0]}
-
-2️⃣ {analysis['recommendations'][1]}
-
-3️⃣ {analysis['recommendations'][2]}
+{recommendations}
 
 ---
 💬 Для анализа нового звонка просто пришлите другой текст разговора."""
-        else:
-            response_text = f"""📊 **Call Analysis Results**
+    return f"""📊 **Call Analysis Results**
 
 🎯 **Call Quality:** {analysis['call_quality']}
 
@@ -269,101 +395,249 @@ async def handle_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
 {analysis['analysis']}
 
 💡 **Improvement Recommendations:**
-1️⃣ {analysis['recommendations'][0]}
-
-2️⃣ {analysis['recommendations'][1]}
-
-3️⃣ {analysis['recommendations'][2]}
+{recommendations}
 
 ---
 💬 To analyze another call, simply send another conversation text."""
-        
-        # Удаляем сообщение о процессе и отправляем результат
-        await status_message.delete()
-        await update.message.reply_text(response_text, parse_mode='Markdown')
-        
-    except Exception as e:
-        logging.error(f"Ошибка в режиме анализа: {e}")
-        
-        await status_message.delete()
-        
-        if is_russian:
-            error_msg = "❌ Не удалось проанализировать звонок. Убедитесь, что текст содержит диалог между менеджером и клиентом."
-        else:
-            error_msg = "❌ Failed to analyze the call. Make sure the text contains a dialogue between manager and client."
-            
-        await update.message.reply_text(error_msg)
 
-async def handle_script_gen(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик режима генерации скриптов продаж"""
-    # Определяем язык пользователя
-    is_russian = update.effective_user.language_code and update.effective_user.language_code.startswith('ru')
-    
+def _format_script(script, is_russian):
     if is_russian:
-        processing_msg = "📝 **Создаю профессиональный скрипт продаж...** \n\nЭто может занять до 90 секунд. Анализирую лучшие практики."
-    else:
-        processing_msg = "📝 **Creating professional sales script...** \n\nThis may take up to 90 seconds. Analyzing best practices."
-    
-    status_message = await update.message.reply_text(processing_msg, parse_mode='Markdown')
-    await update.message.reply_chat_action("typing")
-    
-    try:
-        # Загружаем пример успешного звонка
-        with open(Config.CALLS_DIR / "example_call_good.txt", 'r', encoding='utf-8') as f:
-            good_call_1 = f.read()
-        
-        # Генерируем скрипт на основе успешных звонков
-        script = await script_generator.generate([good_call_1])
-        
-        # Удаляем сообщение о процессе
-        await status_message.delete()
-        
-        if is_russian:
-            header = """📋 **Профессиональный скрипт продаж создан!**
+        header = """📋 **Профессиональный скрипт продаж создан!**
 
 Основан на анализе успешных звонков и лучших практик продаж.
 
 ---
 
 """
-            footer = """
+        footer = """
 
 ---
 💡 **Совет:** Адаптируйте скрипт под вашу специфику и стиль общения.
 📝 Для создания нового скрипта отправьте любое сообщение."""
-        else:
-            header = """📋 **Professional Sales Script Created!**
+    else:
+        header = """📋 **Professional Sales Script Created!**
 
 Based on analysis of successful calls and sales best practices.
 
 ---
 
 """
-            footer = """
+        footer = """
 
 ---
 💡 **Tip:** Adapt the script to your specifics and communication style.
 📝 To create a new script, send any message."""
+    return header + script + footer
+
+def _split_message(text):
+    """Разбивает длинный текст на части, помещающиеся в сообщение Telegram"""
+    return [text[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)] or [text]
+
+async def _send_parts(bot, chat_id, text, job=None):
+    """Отправляет текст частями; для задачи очереди пропускает части, отправленные прошлой попыткой"""
+    parts = _split_message(text)
+    start = job.delivered if job is not None else 0
+    for number, part in enumerate(parts[start:], start + 1):
+        try:
+            await bot.send_message(chat_id, part, parse_mode='Markdown', disable_web_page_preview=True)
+        except BadRequest:
+            # Разметка от модели могла не разобраться - отправляем как есть
+            await bot.send_message(chat_id, part, disable_web_page_preview=True)
+        if job is not None:
+            await task_queue.mark_delivered(job, number)
+
+async def _queued_message(job_id, created, is_russian):
+    """Подтверждение постановки задачи в очередь"""
+    position = await task_queue.position(job_id)
+    if is_russian:
+        status = "Задача поставлена в очередь" if created else "Такая задача уже в очереди"
+        wait = f"Перед ней задач: {position}. " if position else ""
+        return f"{status} (№{job_id}). {wait}Пришлю результат, как только он будет готов. Статус: /status"
+    status = "Task queued" if created else "This task is already queued"
+    wait = f"Tasks ahead: {position}. " if position else ""
+    return f"{status} (#{job_id}). {wait}I'll send the result as soon as it's ready. Status: /status"
+
+# --- Фоновые задачи: выполняются воркерами очереди, результат отправляется в чат ---
+
+def _normalize_analysis(analysis):
+    """Проверяет ответ модели до сохранения: некорректный результат - ошибка этапа run (повтор анализа),
+    а не падение форматирования при каждой доставке"""
+    if not isinstance(analysis, dict):
+        raise ValueError(f"Анализ звонка: ожидался JSON-объект, получено {type(analysis).__name__}")
+    recommendations = analysis.get("recommendations")
+    if isinstance(recommendations, str):
+        recommendations = [recommendations]
+    if not isinstance(recommendations, list):
+        recommendations = []
+    recommendations = [str(item).strip() for item in recommendations if str(item).strip()][:3]
+    call_quality = str(analysis.get("call_quality") or "").strip()
+    text = str(analysis.get("analysis") or "").strip()
+    if not call_quality or not text or not recommendations:
+        raise ValueError(f"Анализ звонка: неполный ответ модели (поля: {', '.join(sorted(analysis))})")
+    return {"call_quality": call_quality, "analysis": text, "recommendations": recommendations}
+
+async def _run_analysis(job):
+    return _normalize_analysis(await call_analyzer.analyze(job.payload["text"], user_id=job.user_id))
+
+async def _deliver_analysis(bot, job, analysis):
+    await _send_parts(bot, job.chat_id, _format_analysis(analysis, job.payload["is_russian"]), job)
+
+async def _fail_analysis(bot, job, error):
+    HANDLER_ERRORS.inc(mode="analysis")
+    if job.payload["is_russian"]:
+        error_msg = "❌ Не удалось проанализировать звонок. Убедитесь, что текст содержит диалог между менеджером и клиентом."
+    else:
+        error_msg = "❌ Failed to analyze the call. Make sure the text contains a dialogue between manager and client."
+    await bot.send_message(job.chat_id, error_msg)
+
+async def _run_script(job):
+    return await script_store.get_or_generate()
+
+async def _deliver_script(bot, job, script):
+    await _send_parts(bot, job.chat_id, _format_script(script, job.payload["is_russian"]), job)
+
+async def _fail_script(bot, job, error):
+    HANDLER_ERRORS.inc(mode="script_gen")
+    if job.payload["is_russian"]:
+        error_msg = "❌ Не удалось создать скрипт. Попробуйте еще раз через несколько секунд."
+    else:
+        error_msg = "❌ Failed to create script. Please try again in a few seconds."
+    await bot.send_message(job.chat_id, error_msg)
+
+task_queue.register("analysis", _run_analysis, _deliver_analysis, _fail_analysis)
+task_queue.register("script", _run_script, _deliver_script, _fail_script)
+
+async def handle_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE, text=None):
+    """Обработчик режима анализа звонков: ставит анализ в очередь и сразу отвечает"""
+    text = text or update.message.text
+    
+    # Определяем язык пользователя
+    is_russian = bool(update.effective_user.language_code and update.effective_user.language_code.startswith('ru'))
+    
+    job_id, created = await task_queue.enqueue(
+        "analysis",
+        {"text": text, "is_russian": is_russian},
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id
+    )
+    await update.message.reply_text(await _queued_message(job_id, created, is_russian))
+
+async def handle_script_gen(update: Update, context: ContextTypes.DEFAULT_TYPE, text=None):
+    """Обработчик режима генерации скриптов продаж"""
+    # Определяем язык пользователя
+    is_russian = bool(update.effective_user.language_code and update.effective_user.language_code.startswith('ru'))
+    
+    # Готовый скрипт по текущему набору успешных звонков отдаем сразу
+    script = await script_store.get_cached()
+    if script is not None:
+        await _send_parts(context.bot, update.effective_chat.id, _format_script(script, is_russian))
+        return
+    
+    # Генерация долгая - выполняется воркером очереди
+    job_id, created = await task_queue.enqueue(
+        "script",
+        {"is_russian": is_russian},
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id
+    )
+    await update.message.reply_text(await _queued_message(job_id, created, is_russian))
+
+def _transcript_progress(lines, done, total, is_russian):
+    """Промежуточный вывод распознавания: счетчик сегментов и конец уже распознанного текста"""
+    header = f"🎙 Распознано сегментов: {done}/{total}" if is_russian else f"🎙 Transcribed segments: {done}/{total}"
+    text = "\n".join(lines)
+    limit = TELEGRAM_MESSAGE_LIMIT - len(header) - 4
+    if len(text) > limit:
+        text = "…" + text[-limit:]
+    return f"{header}\n\n{text}" if text else header
+
+async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Голосовое сообщение или аудиофайл с записью звонка: распознавание с промежуточным выводом,
+    затем анализ звонка в фоновой очереди"""
+    is_russian = bool(update.effective_user.language_code and update.effective_user.language_code.startswith('ru'))
+    media = update.message.voice or update.message.audio
+    started = time.monotonic()
+    
+    if media.file_size and media.file_size > Config.AUDIO_MAX_BYTES:
+        if is_russian:
+            error_msg = f"❌ Файл слишком большой: Telegram позволяет боту скачать не больше {Config.AUDIO_MAX_BYTES // 2 ** 20} МБ."
+        else:
+            error_msg = f"❌ The file is too large: Telegram lets bots download up to {Config.AUDIO_MAX_BYTES // 2 ** 20} MB."
+        await update.message.reply_text(error_msg)
+        return
+    
+    status_message = await update.message.reply_text("🎙 Распознаю запись..." if is_russian else "🎙 Transcribing...")
+    
+    try:
+        with span("audio_download"):
+            audio_file = await media.get_file()
+            data = await audio_file.download_as_bytearray()
+        with span("audio_decode"):
+            samples = await decode_audio(data)
         
-        full_response = header + script + footer
+        # Сегменты приходят по порядку; сообщение обновляется не чаще STREAM_EDIT_INTERVAL
+        lines = []
+        last_edit = time.monotonic()
+        with span("transcription"):
+            async for index, total, start, text in transcriber.transcribe(samples):
+                if text:
+                    lines.append(f"[{format_timestamp(start)}] {text}")
+                now = time.monotonic()
+                if now - last_edit >= Config.STREAM_EDIT_INTERVAL and index + 1 < total:
+                    await _edit_text(status_message, _transcript_progress(lines, index + 1, total, is_russian))
+                    last_edit = now
         
-        # Отправляем скрипт частями если он слишком длинный
-        if len(full_response) > 4000:
-            # Разбиваем на части
-            parts = [full_response[i:i+4000] for i in range(0, len(full_response), 4000)]
-            for part in parts:
-                await update.message.reply_text(part, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(full_response, parse_mode='Markdown')
-            
-    except Exception as e:
-        logging.error(f"Ошибка в режиме генерации скрипта: {e}")
+        transcript = "\n".join(lines)
+        if not transcript:
+            await _edit_text(
+                status_message,
+                "❌ В записи не найдено речи." if is_russian else "❌ No speech found in the recording."
+            )
+            return
         
-        await status_message.delete()
+        await _edit_text(
+            status_message,
+            f"🎙 Запись распознана ({format_timestamp(len(samples) / SAMPLE_RATE)}):" if is_russian
+            else f"🎙 Recording transcribed ({format_timestamp(len(samples) / SAMPLE_RATE)}):"
+        )
+        for part in _split_message(transcript):
+            await update.message.reply_text(part)
+        
+        # Транскрипт - на анализ звонка, как текст, присланный в режиме анализа
+        job_id, created = await task_queue.enqueue(
+            "analysis",
+            {"text": transcript, "is_russian": is_russian},
+            chat_id=update.effective_chat.id,
+            user_id=update.effective_user.id
+        )
+        await update.message.reply_text(await _queued_message(job_id, created, is_russian))
+        
+    except Exception as e:
+        logging.error(f"Ошибка распознавания записи: {e}")
+        HANDLER_ERRORS.inc(mode="audio")
         
         if is_russian:
-            error_msg = "❌ Не удалось создать скрипт. Попробуйте еще раз через несколько секунд."
+            error_msg = "❌ Не удалось распознать запись. Попробуйте другой формат или пришлите текст звонка."
         else:
-            error_msg = "❌ Failed to create script. Please try again in a few seconds."
-            
-        await update.message.reply_text(error_msg)
+            error_msg = "❌ Failed to transcribe the recording. Try another format or send the call text."
+        await _edit_text(status_message, error_msg)
+    finally:
+        HANDLER_SECONDS.observe(time.monotonic() - started, mode="audio")
+
+_STATUS_TITLES = {
+    "ru": {"queued": "в очереди", "running": "выполняется", "done": "готово", "failed": "ошибка",
+           "analysis": "анализ звонка", "script": "скрипт продаж"},
+    "en": {"queued": "queued", "running": "running", "done": "done", "failed": "failed",
+           "analysis": "call analysis", "script": "sales script"},
+}
+
+async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /status: последние фоновые задачи пользователя"""
+    is_russian = bool(update.effective_user.language_code and update.effective_user.language_code.startswith('ru'))
+    titles = _STATUS_TITLES["ru" if is_russian else "en"]
+    jobs = await task_queue.recent_for_user(update.effective_user.id)
+    if not jobs:
+        await update.message.reply_text("Фоновых задач нет." if is_russian else "No background tasks.")
+        return
+    lines = [f"№{job.id} {titles.get(job.kind, job.kind)}: {titles.get(job.status, job.status)}" for job in jobs]
+    await update.message.reply_text("\n".join(lines))
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+import pandas as pd
+from config import Config
+from bot.services.call_analyzer import CallAnalyzer
+from bot.services.openrouter_client import openrouter_client
+
+GOOD_QUALITY = {"хороший", "good"}
+
+
+class AnalysisResultStore:
+    """Результаты анализа звонков в SQLite, ключ - хеш содержимого транскрипта"""
+
+    def __init__(self, db_path=None):
+        db_path = db_path or Config.ANALYSIS_RESULTS_DB
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS call_analysis (
+                content_hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                manager TEXT NOT NULL,
+                call_quality TEXT,
+                result TEXT,
+                error TEXT,
+                analyzed_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def is_done(self, content_hash):
+        row = self.conn.execute(
+            "SELECT 1 FROM call_analysis WHERE content_hash = ? AND error IS NULL", (content_hash,)
+        ).fetchone()
+        return row is not None
+
+    def save(self, content_hash, path, manager, result=None, error=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO call_analysis VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                content_hash, str(path), manager,
+                (result or {}).get("call_quality"),
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error, time.time(),
+            )
+        )
+        self.conn.commit()
+
+    def load(self, content_hashes):
+        """Результаты для заданных хешей в виде DataFrame"""
+        rows = []
+        hashes = list(content_hashes)
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            rows.extend(self.conn.execute(
+                "SELECT content_hash, path, manager, call_quality, result, error FROM call_analysis "
+                f"WHERE content_hash IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall())
+        return pd.DataFrame(
+            rows, columns=["content_hash", "path", "manager", "call_quality", "result", "error"]
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_transcripts(calls_dir):
+    """Потоково перебирает транскрипты; менеджер - имя подпапки (calls/<менеджер>/*.txt)"""
+    for path in sorted(calls_dir.rglob("*.txt")):
+        relative = path.relative_to(calls_dir)
+        manager = relative.parts[0] if len(relative.parts) > 1 else "unknown"
+        yield path, manager
+
+
+def content_hash(text):
+    """Хеш транскрипта; для bytes - хеш содержимого файла (совпадает с хешем текста в UTF-8)"""
+    data = text if isinstance(text, bytes) else text.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+async def run_batch(calls_dir=None, workers=None, store=None, analyzer=None):
+    """Анализирует все новые/измененные транскрипты пулом воркеров; возвращает хеши всех звонков"""
+    calls_dir = calls_dir or Config.CALLS_DIR
+    workers = workers or Config.BATCH_ANALYSIS_WORKERS
+    store = store or AnalysisResultStore()
+    analyzer = analyzer or CallAnalyzer()
+    queue = asyncio.Queue(maxsize=workers * 2)
+    seen_hashes = []
+    seen = set()
+    stats = {"analyzed": 0, "skipped": 0, "duplicates": 0, "failed": 0}
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            digest, path, manager, text = item
+            try:
+                # Все пакетные запросы - один "пользователь", чтобы не вытеснять интерактивных
+                result = await analyzer.analyze(text, user_id="batch")
+                store.save(digest, path, manager, result=result)
+                stats["analyzed"] += 1
+            except Exception as e:
+                # Ошибку сохраняем, звонок будет повторно проанализирован при следующем запуске
+                logging.error(f"Ошибка анализа {path}: {e}")
+                store.save(digest, path, manager, error=str(e))
+                stats["failed"] += 1
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    for path, manager in iter_transcripts(calls_dir):
+        raw = path.read_bytes()
+        digest = content_hash(raw)
+        if digest in seen:
+            # Копия уже поставленного звонка (тот же транскрипт в другой папке) - анализируем один раз
+            stats["duplicates"] += 1
+            continue
+        seen.add(digest)
+        seen_hashes.append(digest)
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # Один файл в другой кодировке не должен останавливать весь пакет
+            logging.error(f"Транскрипт {path} не в UTF-8: {e}")
+            store.save(digest, path, manager, error=f"Не UTF-8: {e}")
+            stats["failed"] += 1
+            continue
+        if store.is_done(digest):
+            stats["skipped"] += 1
+            continue
+        # Очередь ограничена - файлы читаются не быстрее, чем анализируются
+        await queue.put((digest, path, manager, text))
+
+    for _ in tasks:
+        await queue.put(None)
+    await asyncio.gather(*tasks)
+    logging.info("Пакетный анализ звонков: %s", stats)
+    return seen_hashes
+
+
+def build_report(results, report_dir=None):
+    """Сводный отчет: доля хороших звонков по менеджерам и частые рекомендации"""
+    report_dir = report_dir or Config.REPORTS_DIR
+    report_dir.mkdir(parents=True, exist_ok=True)
+    ok = results[results["error"].isna()].copy()
+    ok["is_good"] = ok["call_quality"].fillna("").str.lower().isin(GOOD_QUALITY)
+
+    by_manager = (
+        ok.groupby("manager")
+        .agg(calls=("content_hash", "count"), good_calls=("is_good", "sum"), quality_rate=("is_good", "mean"))
+        .sort_values("quality_rate")
+    )
+    by_manager.to_csv(report_dir / "quality_by_manager.csv", encoding="utf-8")
+
+    # Частые проблемы - повторяющиеся рекомендации в плохих звонках
+    recommendations = (
+        ok.loc[~ok["is_good"], "result"]
+        .map(lambda raw: json.loads(raw).get("recommendations", []))
+        .explode()
+        .dropna()
+        .str.strip()
+        .str.lower()
+    )
+    failures = recommendations.value_counts().head(Config.REPORT_TOP_FAILURES).rename("count")
+    failures.to_csv(report_dir / "common_failures.csv", encoding="utf-8")
+    return by_manager, failures
+
+
+async def main(calls_dir=None, workers=None):
+    store = AnalysisResultStore()
+    try:
+        hashes = await run_batch(calls_dir, workers, store)
+        by_manager, failures = build_report(store.load(hashes))
+        print(by_manager.to_string())
+        print(f"Отчеты сохранены в {Config.REPORTS_DIR}")
+    finally:
+        store.close()
+        await openrouter_client.close()
+
+
+if __name__ == "__main__":
+    # python -m bot.services.batch_analyzer [--calls-dir DIR] [--workers N]
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Пакетный анализ звонков из CALLS_DIR")
+    parser.add_argument("--calls-dir", type=Path, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls_dir, args.workers))
@@ -0,0 +1,144 @@
+import re
+from config import Config
+
+# Сумма: "$1.2M", "300k", "1 200 000", "250.000", "1,5 млн", "1.2м", "400000 USD", "600000+ USD"
+_AMOUNT_RE = re.compile(
+    r"(?P<cur1>\$|usd)?\s*(?<![\w.,])"
+    r"(?P<num>\d{1,3}(?P<sep>[ ,.])\d{3}(?:(?P=sep)\d{3})*(?![\d.,])|\d+(?:[.,]\d+)?)\s*"
+    r"(?P<mult>k|к|тыс\w*|mln|m|млн\w*|million\w*|миллион\w*|м)?(?!\w)(?:(?<=[^\W\d])\.)?\s*"
+    r"(?P<plus>\+)?\s*"
+    r"(?P<cur2>\$|usd\b|долл\w*|dollars?\b)?"
+)
+_MULTIPLIERS = (
+    ("тыс", 1_000), ("k", 1_000), ("к", 1_000),
+    ("млн", 1_000_000), ("миллион", 1_000_000), ("million", 1_000_000), ("mln", 1_000_000), ("m", 1_000_000),
+    ("м", 1_000_000),
+)
+_RANGE_SEPARATORS = {"-", "–", "—", "до", "to", "..", "..."}
+# "между 300 и 400k", "between 300k and 400k"
+_BETWEEN_RE = re.compile(r"(?:^|\W)(?:между|between)$")
+_AND_SEPARATORS = {"и", "and"}
+# Число без валюты и множителя вида 19xx/20xx - год ("Continental 2022 года"), а не сумма
+_YEAR_RE = re.compile(r"(?:19|20)\d\d")
+# Слова перед суммой, задающие только нижнюю или только верхнюю границу
+_LOWER_BOUND_RE = re.compile(r"(?:^|\W)(?:от|from|over|above|более|больше|свыше|не менее|at least|min)$")
+_UPPER_BOUND_RE = re.compile(r"(?:^|\W)(?:до|up to|under|below|не более|меньше|максимум|max|в пределах)$")
+# Слова, после которых число без валюты в сообщении пользователя считается суммой
+_BUDGET_WORD_RE = re.compile(r"(?:^|\W)(?:бюджет\w*|budget|за|for|около|примерно|around|about)$")
+_PREFIX_WINDOW = 12
+
+
+class _Amount:
+    __slots__ = ("start", "end", "value", "multiplier", "marked", "plus", "year")
+
+    def __init__(self, match):
+        self.start, self.end = match.span()
+        number = match.group("num")
+        mult = match.group("mult")
+        separator = match.group("sep")
+        # "250.000" - разряды через точку; одна точка с множителем - десятичная ("1.250 млн")
+        if separator and (separator != "." or not mult or number.count(".") > 1):
+            self.value = float(number.replace(separator, ""))
+        else:
+            self.value = float(number.replace(",", "."))
+        self.multiplier = 1
+        if mult:
+            self.multiplier = next(factor for prefix, factor in _MULTIPLIERS if mult.startswith(prefix))
+        self.marked = bool(mult or match.group("cur1") or match.group("cur2"))
+        self.plus = bool(match.group("plus"))
+        self.year = not self.marked and bool(_YEAR_RE.fullmatch(number))
+
+
+def _amounts(lower):
+    return [amount for amount in map(_Amount, _AMOUNT_RE.finditer(lower)) if not amount.year]
+
+
+def parse_amounts(lower_text):
+    """Денежные суммы из текста в нижнем регистре (с валютой или множителем, либо от 1000, кроме годов)"""
+    return [
+        int(a.value * a.multiplier) for a in _amounts(lower_text)
+        if a.marked or a.value * a.multiplier >= 1000
+    ]
+
+
+def parse_budget(text, strict=False):
+    """Бюджет из свободного текста как диапазон (min, max); None - граница не задана.
+
+    "400000 USD" -> (400000, 400000), "300-400k" -> (300000, 400000),
+    "600000+ USD" -> (600000, None), "до $1.2M" -> (None, 1200000),
+    "between 300k and 400k" -> (300000, 400000), "2 машины за 300к" -> (300000, 300000),
+    "200к-1.2м" -> (200000, 1200000), "250.000 USD" -> (250000, 250000).
+    Числа вида 19xx/20xx без валюты - годы, а не суммы. Если в тексте есть сумма с валютой
+    или множителем, числа без них (количество, номер) пропускаются.
+    strict - для сообщений пользователя: число без валюты и множителя считается суммой, только если
+    оно от 1000 и перед ним стоит граница или слово о бюджете ("до 400000", "бюджет 400000").
+    Возвращает None, если суммы в тексте нет.
+    """
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return (float(text), float(text))
+    lower = str(text).lower()
+    amounts = _amounts(lower)
+    has_marked = any(amount.marked for amount in amounts)
+    for i, first in enumerate(amounts):
+        second = amounts[i + 1] if i + 1 < len(amounts) else None
+        prefix = lower[max(0, first.start - _PREFIX_WINDOW):first.start].rstrip(" $")
+        separator = lower[first.end:second.start].strip() if second is not None else None
+        is_range = second is not None and (
+            separator in _RANGE_SEPARATORS or (separator in _AND_SEPARATORS and _BETWEEN_RE.search(prefix))
+        )
+        if is_range:
+            # "300-400k": множитель второго числа относится и к первому
+            multiplier = first.multiplier
+            if first.multiplier == 1 and second.multiplier > 1:
+                multiplier = second.multiplier
+            low, high = first.value * multiplier, second.value * second.multiplier
+            # "300k-2" - не диапазон (минимум больше максимума после множителей)
+            is_range = low <= high
+        if not (first.marked or (is_range and second.marked)):
+            if has_marked:
+                continue
+            if strict and not (
+                first.value * first.multiplier >= 1000
+                and (_BUDGET_WORD_RE.search(prefix) or _LOWER_BOUND_RE.search(prefix)
+                     or _UPPER_BOUND_RE.search(prefix))
+            ):
+                continue
+
+        if is_range:
+            return (low, high)
+
+        value = first.value * first.multiplier
+        if first.plus:
+            return (value, None)
+        if _LOWER_BOUND_RE.search(prefix):
+            return (value, None)
+        if _UPPER_BOUND_RE.search(prefix):
+            return (None, value)
+        return (value, value)
+    return None
+
+
+def price_bounds(budget, tolerance=None):
+    """Границы цены для поиска по каталогу: бюджет ±tolerance (по умолчанию BUDGET_TOLERANCE)"""
+    if budget is None:
+        return None, None
+    tolerance = Config.BUDGET_TOLERANCE if tolerance is None else tolerance
+    low, high = budget
+    return (
+        low * (1 - tolerance) if low is not None else None,
+        high * (1 + tolerance) if high is not None else None,
+    )
+
+
+def with_budget_range(client, refresh=False):
+    """Добавляет к записи клиента разобранный бюджет budget_range ([min, max]).
+
+    refresh=True - пересчитать (при записи клиента, бюджет мог измениться),
+    иначе только для записей, сохраненных до появления поля.
+    """
+    if refresh or "budget_range" not in client:
+        budget = parse_budget(client.get("budget"))
+        client["budget_range"] = list(budget) if budget is not None else None
+    return client
@@ -1,12 +1,83 @@
-import httpx
+import asyncio
+import re
 from config import Config
+from bot.services.openrouter_gateway import openrouter_gateway
+from bot.services.tokens import estimate_tokens
 import json
 
+# Начало реплики: "Менеджер: ...", "Клиент: ...", "Speaker 1: ..."
+_TURN_RE = re.compile(r"^\s*[\w][\w .\-]{0,30}:")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_turns(call_text):
+    """Разбивает транскрипт на реплики; строки без метки спикера продолжают предыдущую реплику"""
+    turns = []
+    for line in call_text.splitlines():
+        if not line.strip():
+            continue
+        if _TURN_RE.match(line) or not turns:
+            turns.append(line.strip())
+        else:
+            turns[-1] += "\n" + line.strip()
+    return turns
+
+
+def _split_long_turn(turn, max_tokens):
+    """Режет слишком длинную реплику по предложениям"""
+    parts, current = [], ""
+    for sentence in _SENTENCE_RE.split(turn):
+        if current and estimate_tokens(current + " " + sentence) > max_tokens:
+            parts.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        parts.append(current)
+    # Предложение длиннее бюджета режем по символам
+    max_chars = max_tokens * Config.CHARS_PER_TOKEN
+    return [p[i:i + max_chars] for p in parts for i in range(0, len(p), max_chars)]
+
+
+def chunk_transcript(call_text, max_tokens=None):
+    """Группирует реплики в части, каждая не больше max_tokens; реплики не разрываются без нужды"""
+    max_tokens = max_tokens or Config.ANALYSIS_CHUNK_TOKENS
+    chunks, current, current_tokens = [], [], 0
+    for turn in split_turns(call_text):
+        pieces = [turn] if estimate_tokens(turn) <= max_tokens else _split_long_turn(turn, max_tokens)
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
 class CallAnalyzer:
-    async def analyze(self, call_text):
+    async def analyze(self, call_text, user_id=None):
+        """user_id - для честной очереди запросов к LLM между пользователями"""
+        chunks = chunk_transcript(call_text)
+        if len(chunks) <= 1:
+            return await self._analyze_single(call_text, user_id)
+
+        # Длинный звонок: анализ частей параллельно (map), затем сводный вывод (reduce)
+        semaphore = asyncio.Semaphore(Config.ANALYSIS_MAX_PARALLEL)
+
+        async def analyze_chunk(index, chunk):
+            async with semaphore:
+                return await self._analyze_chunk(chunk, index + 1, len(chunks), user_id)
+
+        partials = await asyncio.gather(*(analyze_chunk(i, c) for i, c in enumerate(chunks)))
+        return await self._reduce(partials, user_id)
+
+    async def _analyze_single(self, call_text, user_id=None):
         system_prompt = """
         Ты - опытный руководитель отдела продаж. Твоя задача - проанализировать транскрипцию звонка.
-        
+
         Проанализируй звонок по следующим критериям:
         1.  **Качество звонка:** Хороший или плохой?
         2.  **Обоснование:** Почему ты так считаешь? Что сработало, а что нет? (Приветствие, выявление потребностей, презентация, работа с возражениями, закрытие).
@@ -23,21 +94,57 @@ class CallAnalyzer:
             ]
         }
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=Config.OPENROUTER_HEADERS,
-                json={
-                    "model": Config.ADVANCED_MODEL, # Используем более мощную модель для анализа
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Проанализируй этот звонок:\n\n{call_text}"},
-                    ],
-                    "response_format": {"type": "json_object"}
-                },
-                timeout=60
-            )
-        response.raise_for_status()
+        return await self._request_json(system_prompt, f"Проанализируй этот звонок:\n\n{call_text}", user_id)
+
+    async def _analyze_chunk(self, chunk, number, total, user_id=None):
+        system_prompt = f"""
+        Ты - опытный руководитель отдела продаж. Перед тобой часть {number} из {total} транскрипции длинного звонка.
+        Оцени только эту часть. Отметь, какие этапы продажи в ней встречаются
+        (приветствие, выявление потребностей, презентация, работа с возражениями, закрытие) и как менеджер их провел.
+
+        Ответ дай СТРОГО в формате JSON:
+        {{
+            "stages": {{"этап": "как проведен"}},
+            "strengths": ["Что сработало"],
+            "weaknesses": ["Что не сработало"],
+            "notes": "Краткие наблюдения по части"
+        }}
+        """
+        return await self._request_json(system_prompt, f"Часть {number} из {total}:\n\n{chunk}", user_id)
+
+    async def _reduce(self, partials, user_id=None):
+        system_prompt = """
+        Ты - опытный руководитель отдела продаж. Тебе даны результаты анализа последовательных частей
+        одного длинного звонка. Сведи их в итоговую оценку всего звонка.
+
+        Ответ дай СТРОГО в формате JSON:
+        {
+            "call_quality": "хороший" | "плохой",
+            "analysis": "Твой детальный анализ всего звонка по этапам...",
+            "recommendations": [
+                "Рекомендация 1",
+                "Рекомендация 2",
+                "Рекомендация 3"
+            ]
+        }
+        """
+        findings = "\n\n".join(
+            f"Часть {i + 1}:\n{json.dumps(partial, ensure_ascii=False)}" for i, partial in enumerate(partials)
+        )
+        return await self._request_json(system_prompt, f"Результаты анализа частей звонка:\n\n{findings}", user_id)
+
+    async def _request_json(self, system_prompt, user_content, user_id=None):
+        data = await openrouter_gateway.complete(
+            "analysis",
+            {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_content},
+                ],
+                "response_format": {"type": "json_object"}
+            },
+            user_id=user_id
+        )
         # Извлекаем JSON-строку из ответа и парсим ее
-        analysis_data = json.loads(response.json()["choices"][0]["message"]["content"])
+        analysis_data = json.loads(data["choices"][0]["message"]["content"])
         return analysis_data
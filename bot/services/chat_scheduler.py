@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from config import Config
+
+
+class _ChatState:
+    __slots__ = ("pending", "in_flight", "task", "started", "interruptible", "busy")
+
+    def __init__(self):
+        self.pending = []     # тексты, ожидающие обработки
+        self.in_flight = []   # тексты, которые обрабатываются сейчас
+        self.task = None
+        self.started = False       # task уже вызвал callback
+        self.interruptible = True  # callback task можно отменить
+        self.busy = None      # начатая неотменяемая обработка, после которой выполняется task
+
+
+class ChatScheduler:
+    """Планировщик запросов по чатам.
+
+    Одиночное сообщение обрабатывается сразу. Если предыдущее сообщение чата пришло
+    меньше чем за debounce секунд, обработка ждет окно debounce, и сообщения серии
+    склеиваются в один запрос. Новое сообщение отменяет еще не завершенную генерацию
+    для этого чата, и ее текст попадает в следующий (объединенный) запрос. Разные чаты
+    обрабатываются параллельно.
+
+    Неотменяемая обработка (interruptible=False - постановка анализа в очередь задач)
+    всегда ждет окно debounce, чтобы длинный текст, разбитый Telegram на несколько
+    сообщений, стал одной задачей. Начавшись, она не отменяется: сообщения, пришедшие
+    позже, обрабатываются следующим запросом после нее.
+    """
+
+    def __init__(self, debounce=None):
+        self.debounce = Config.CHAT_DEBOUNCE_SECONDS if debounce is None else debounce
+        self._chats = {}
+        self._last_message = OrderedDict()  # chat_id -> время последнего сообщения (только свежие)
+
+    def _in_burst(self, chat_id):
+        """Пришло ли предыдущее сообщение чата в пределах окна debounce"""
+        now = time.monotonic()
+        previous = self._last_message.pop(chat_id, None)
+        self._last_message[chat_id] = now
+        # Старые отметки больше не нужны - словарь не растет с числом чатов
+        while self._last_message:
+            if now - next(iter(self._last_message.values())) < self.debounce:
+                break
+            self._last_message.popitem(last=False)
+        return previous is not None and now - previous < self.debounce
+
+    def submit(self, chat_id, text, callback, interruptible=True):
+        """Ставит текст в очередь чата; callback(text) - корутина обработки склеенного текста"""
+        in_burst = self._in_burst(chat_id)
+        delay = self.debounce if self.debounce and (in_burst or not interruptible) else 0
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState()
+        state.pending.append(text)
+
+        if state.task is not None and not state.task.done():
+            if state.started and not state.interruptible:
+                # Задача уже поставлена - не отменяем, новый текст обработаем после нее
+                state.busy = state.task
+            else:
+                # Предыдущая генерация устарела - отменяем, ее текст обработаем вместе с новым
+                state.task.cancel()
+                if state.started:
+                    state.pending[:0] = state.in_flight
+                    state.in_flight = []
+        state.started, state.interruptible = False, interruptible
+        state.task = asyncio.create_task(self._run(chat_id, state, callback, delay))
+        return state.task
+
+    async def _run(self, chat_id, state, callback, delay):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            if state.busy is not None:
+                # asyncio.wait, а не await: отмена этого запроса не должна отменять начатую обработку
+                await asyncio.wait({state.busy})
+                state.busy = None
+            state.in_flight, state.pending = state.pending, []
+            state.started = True
+            await callback("\n".join(state.in_flight))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка обработки сообщений чата {chat_id}: {e}")
+        finally:
+            current = asyncio.current_task()
+            if state.task is current:
+                state.in_flight = []
+                if not state.pending:
+                    self._chats.pop(chat_id, None)
+
+    async def drain(self):
+        """Дожидается обработки всех принятых сообщений (при остановке бота)"""
+        while self._chats:
+            tasks = [state.task for state in self._chats.values() if state.task is not None]
+            if not tasks:
+                break
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __len__(self):
+        return len(self._chats)
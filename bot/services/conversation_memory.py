@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from bot.services.openrouter_gateway import openrouter_gateway
+from bot.services.tokens import estimate_tokens
+
+_SUMMARY_PROMPT = {
+    "ru": """Ты ведешь заметки ИИ-продавца премиальных автомобилей. Обнови краткое резюме разговора с клиентом:
+факты о клиенте, интересующие модели, бюджет, возражения и договоренности. Без приветствий и оценок,
+не длиннее {words} слов. Отвечай только текстом резюме.""",
+    "en": """You keep notes for an AI sales consultant for premium cars. Update the short summary of the conversation:
+client facts, models of interest, budget, objections and agreements. No greetings or opinions,
+at most {words} words. Reply with the summary text only.""",
+}
+_ROLE_LABELS = {
+    "ru": {"user": "Клиент", "assistant": "Продавец", "summary": "Резюме до этого", "turns": "Новые реплики"},
+    "en": {"user": "Client", "assistant": "Consultant", "summary": "Summary so far", "turns": "New turns"},
+}
+
+
+class _Conversation:
+    __slots__ = ("summary", "turns", "overflow", "language", "updated_at")
+
+    def __init__(self, summary="", turns=(), overflow=(), language="ru", updated_at=0.0):
+        self.summary = summary
+        self.turns = list(turns)        # [(role, content)] - последние реплики дословно
+        self.overflow = list(overflow)  # вытесненные реплики, еще не вошедшие в резюме
+        self.language = language
+        self.updated_at = updated_at
+
+
+class ConversationMemory:
+    """Память диалога с каждым пользователем в пределах бюджета токенов.
+
+    Последние реплики хранятся дословно (MEMORY_HISTORY_TOKENS), более старые сжимаются
+    в резюме (MEMORY_SUMMARY_TOKENS) фоновым запросом к LLM - не на пути ответа клиенту.
+    Размер промпта поэтому не растет с длиной разговора. Диалоги лежат в LRU в памяти
+    и в SQLite на диске, неактивные дольше MEMORY_TTL удаляются.
+    """
+
+    def __init__(self, db_path=None, summarize=None):
+        self.db_path = db_path if db_path is not None else Config.MEMORY_DB
+        self.ttl = Config.MEMORY_TTL
+        self.max_users = Config.MEMORY_MAX_USERS
+        # summarize(messages) -> текст резюме; по умолчанию - запрос к LLM через шлюз
+        self._summarize = summarize or self._summarize_llm
+        self._memory = OrderedDict()  # user_id -> _Conversation
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes_since_evict = 0
+        self._tasks = set()
+        # user_id -> диалог, для которого идет обновление резюме
+        self._summarizing = {}
+
+    @property
+    def conn(self):
+        if self._conn is None and self.db_path:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_at);
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def _get(self, user_id):
+        """Диалог пользователя из памяти или с диска; None - нет или истек"""
+        now = time.time()
+        conversation = self._memory.get(user_id)
+        if conversation is None and user_id in self._summarizing:
+            # Вытеснен из LRU, пока обновлялось резюме - берем тот же объект, а не копию с диска
+            conversation = self._summarizing[user_id]
+            self._remember(user_id, conversation)
+        if conversation is None and self.conn is not None:
+            row = self.conn.execute(
+                "SELECT data, updated_at FROM conversations WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is not None:
+                data = json.loads(row[0])
+                conversation = _Conversation(
+                    data["summary"], map(tuple, data["turns"]), map(tuple, data["overflow"]),
+                    data.get("language", "ru"), row[1]
+                )
+                self._remember(user_id, conversation)
+        if conversation is None:
+            return None
+        if conversation.updated_at + self.ttl <= now:
+            self.clear(user_id)
+            return None
+        self._memory.move_to_end(user_id)
+        return conversation
+
+    def _remember(self, user_id, conversation):
+        self._memory[user_id] = conversation
+        self._memory.move_to_end(user_id)
+        while len(self._memory) > self.max_users:
+            # Вытесненный из памяти диалог остается на диске
+            self._memory.popitem(last=False)
+
+    def _save(self, user_id, conversation):
+        if self.conn is None:
+            return
+        data = json.dumps({
+            "summary": conversation.summary,
+            "turns": conversation.turns,
+            "overflow": conversation.overflow,
+            "language": conversation.language,
+        }, ensure_ascii=False)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO conversations (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, data, conversation.updated_at)
+            )
+            self.conn.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 1000:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Удаляет неактивные дольше TTL и самые старые сверх MEMORY_DISK_MAX_USERS"""
+        self._writes_since_evict = 0
+        self.conn.execute("DELETE FROM conversations WHERE updated_at <= ?", (time.time() - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM conversations WHERE user_id IN ("
+            "SELECT user_id FROM conversations ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (Config.MEMORY_DISK_MAX_USERS,)
+        )
+        self.conn.commit()
+
+    def context(self, user_id):
+        """(резюме, последние реплики [(role, content)]) для промпта"""
+        if user_id is None:
+            return "", []
+        conversation = self._get(user_id)
+        if conversation is None:
+            return "", []
+        return conversation.summary, list(conversation.turns)
+
+    def append(self, user_id, user_text, assistant_text, language="ru"):
+        """Добавляет обмен репликами; реплики сверх бюджета уходят на фоновое сжатие в резюме"""
+        if user_id is None:
+            return
+        conversation = self._get(user_id)
+        if conversation is None:
+            conversation = _Conversation()
+            self._remember(user_id, conversation)
+        conversation.language = language
+        conversation.updated_at = time.time()
+        conversation.turns.extend((("user", user_text), ("assistant", assistant_text)))
+
+        used = sum(estimate_tokens(content) for _, content in conversation.turns)
+        while used > Config.MEMORY_HISTORY_TOKENS and len(conversation.turns) > 2:
+            role, content = conversation.turns.pop(0)
+            used -= estimate_tokens(content)
+            conversation.overflow.append((role, content))
+        self._save(user_id, conversation)
+
+        if conversation.overflow and user_id not in self._summarizing:
+            self._schedule_summary(user_id, conversation)
+
+    def clear(self, user_id):
+        self._memory.pop(user_id, None)
+        # Идущее обновление резюме увидит, что диалог удален, и не запишет его обратно
+        self._summarizing.pop(user_id, None)
+        if self.conn is not None:
+            with self._lock:
+                self.conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+                self.conn.commit()
+
+    def _schedule_summary(self, user_id, conversation):
+        try:
+            task = asyncio.get_running_loop().create_task(self._update_summary(user_id, conversation))
+        except RuntimeError:
+            # Вне event loop (офлайн-скрипты) резюме обновится при следующей реплике
+            return
+        self._summarizing[user_id] = conversation
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _update_summary(self, user_id, conversation):
+        try:
+            while conversation.overflow:
+                batch = list(conversation.overflow)
+                messages = self._summary_messages(conversation.summary, batch, conversation.language)
+                summary = await self._summarize(messages)
+                if self._summarizing.get(user_id) is not conversation:
+                    # Диалог удален (/start, истек TTL), пока шел запрос
+                    return
+                # Пока шел запрос, могли вытесниться новые реплики - убираем только учтенные
+                del conversation.overflow[:len(batch)]
+                conversation.summary = summary.strip()
+                self._save(user_id, conversation)
+        except Exception as e:
+            logging.warning(f"Не удалось обновить резюме диалога {user_id}: {e}")
+            # Несжатые реплики ждут следующей попытки, но не больше бюджета истории
+            while sum(estimate_tokens(c) for _, c in conversation.overflow) > Config.MEMORY_HISTORY_TOKENS:
+                conversation.overflow.pop(0)
+        finally:
+            if self._summarizing.get(user_id) is conversation:
+                del self._summarizing[user_id]
+
+    @staticmethod
+    def _summary_messages(summary, turns, language):
+        language = language if language in _SUMMARY_PROMPT else "en"
+        labels = _ROLE_LABELS[language]
+        words = Config.MEMORY_SUMMARY_TOKENS // 2
+        lines = [f"{labels[role]}: {content}" for role, content in turns]
+        user_content = f"{labels['turns']}:\n" + "\n".join(lines)
+        if summary:
+            user_content = f"{labels['summary']}:\n{summary}\n\n{user_content}"
+        return [
+            {"role": "system", "content": _SUMMARY_PROMPT[language].format(words=words)},
+            {"role": "user", "content": user_content},
+        ]
+
+    @staticmethod
+    async def _summarize_llm(messages):
+        data = await openrouter_gateway.complete("summary", {
+            "messages": messages,
+            "max_tokens": Config.MEMORY_SUMMARY_TOKENS,
+            "temperature": 0.2,
+        })
+        return data["choices"][0]["message"]["content"]
+
+    async def drain(self):
+        """Дожидается фоновых обновлений резюме (при остановке бота)"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
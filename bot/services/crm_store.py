@@ -0,0 +1,369 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from config import Config
+from bot.services.budget import with_budget_range
+
+# Порядок полей компактной записи клиента
+CLIENT_FIELDS = (
+    "client_id",
+    "telegram_user_id",
+    "name",
+    "previous_purchase",
+    "budget",
+    "deal_status",
+    "preferences",
+    "notes",
+    "purchase_history",
+)
+# Поля с небольшим числом повторяющихся значений - храним одну копию строки
+_INTERNED_FIELDS = {"previous_purchase", "budget", "deal_status", "preferences"}
+_EXTRA = len(CLIENT_FIELDS)
+
+
+class CRMStore(ABC):
+    """Интерфейс хранилища клиентов CRM"""
+
+    @abstractmethod
+    def get_by_telegram_id(self, telegram_user_id):
+        ...
+
+    @abstractmethod
+    def get_by_client_id(self, client_id):
+        ...
+
+    @abstractmethod
+    def upsert(self, client):
+        ...
+
+    def upsert_many(self, clients):
+        for client in clients:
+            self.upsert(client)
+
+    @abstractmethod
+    def iter_clients(self):
+        ...
+
+    def flush(self):
+        """Сбрасывает накопленные изменения в хранилище"""
+
+    def close(self):
+        self.flush()
+
+
+class InMemoryCRMStore(CRMStore):
+    """Хранилище клиентов CRM в памяти с хеш-индексами по telegram_user_id и client_id.
+
+    Каждая запись хранится как кортеж значений в порядке CLIENT_FIELDS
+    (без словаря на запись), повторяющиеся строки интернируются, а история
+    покупок сворачивается в кортежи. Наружу записи отдаются обычными dict.
+    """
+
+    def __init__(self, clients=()):
+        self._records = {}       # client_id -> компактная запись
+        self._by_telegram = {}   # telegram_user_id -> client_id
+        self._next_client_id = 1
+        for client in clients:
+            self.upsert(client)
+
+    def __len__(self):
+        return len(self._records)
+
+    def get_by_telegram_id(self, telegram_user_id):
+        client_id = self._by_telegram.get(telegram_user_id)
+        if client_id is None:
+            return None
+        return self._unpack(self._records[client_id])
+
+    def get_by_client_id(self, client_id):
+        record = self._records.get(client_id)
+        return self._unpack(record) if record is not None else None
+
+    def upsert(self, client):
+        """Добавляет клиента или обновляет существующего (по telegram_user_id, затем client_id).
+
+        Возвращает сохраненную запись; client_id назначается автоматически, если не указан.
+        """
+        # Бюджет разбирается один раз при записи, а не на каждом запросе
+        client = with_budget_range(dict(client), refresh=True)
+        telegram_user_id = client.get("telegram_user_id")
+
+        existing_id = self._by_telegram.get(telegram_user_id) if telegram_user_id is not None else None
+        if existing_id is not None:
+            # Клиент с этим Telegram ID уже есть - обновляем его запись, client_id сохраняем
+            client["client_id"] = existing_id
+        elif client.get("client_id") is None:
+            client["client_id"] = self._next_client_id
+
+        client_id = client["client_id"]
+        previous = self._records.get(client_id)
+        if previous is not None:
+            old_telegram_id = previous[1]
+            if old_telegram_id is not None and old_telegram_id != telegram_user_id:
+                self._by_telegram.pop(old_telegram_id, None)
+
+        self._records[client_id] = self._pack(client)
+        if telegram_user_id is not None:
+            self._by_telegram[telegram_user_id] = client_id
+        if isinstance(client_id, int) and client_id >= self._next_client_id:
+            self._next_client_id = client_id + 1
+        return self._unpack(self._records[client_id])
+
+    def iter_clients(self):
+        # Копия списка: обход может идти в фоновом потоке параллельно с upsert
+        for record in list(self._records.values()):
+            yield self._unpack(record)
+
+    @staticmethod
+    def _pack(client):
+        values = []
+        for field in CLIENT_FIELDS:
+            value = client.get(field)
+            if field in _INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            elif field == "purchase_history":
+                value = tuple(
+                    (sys.intern(item.get("car", "")), item.get("year"), item.get("price"))
+                    for item in (value or ())
+                )
+            values.append(value)
+        # Нестандартные поля (если есть) сохраняем как есть, чтобы не потерять данные
+        extra = {k: v for k, v in client.items() if k not in CLIENT_FIELDS}
+        values.append(extra or None)
+        return tuple(values)
+
+    @staticmethod
+    def _unpack(record):
+        client = dict(zip(CLIENT_FIELDS, record))
+        client["purchase_history"] = [
+            {"car": car, "year": year, "price": price}
+            for car, year, price in record[CLIENT_FIELDS.index("purchase_history")]
+        ]
+        if record[_EXTRA]:
+            client.update(record[_EXTRA])
+        return client
+
+
+class SQLiteCRMStore(CRMStore):
+    """CRM в SQLite (режим WAL): строки читаются по запросу, записи копятся и пишутся пачками.
+
+    Одну базу могут одновременно использовать несколько процессов бота.
+    Клиент, добавленный без client_id, получает его при сбросе пачки в базу.
+    Пачка сбрасывается при заполнении или не позже чем через CRM_FLUSH_INTERVAL секунд
+    после первой записи (таймер), чтобы изменения не терялись при падении процесса.
+    """
+
+    def __init__(self, db_path, seed_json=None):
+        self.db_path = db_path
+        self.seed_json = seed_json
+        self._conn = None
+        self._lock = threading.RLock()
+        self._pending = {}  # telegram_user_id (или client_id) -> запись, ожидающая записи
+        self._last_flush = time.monotonic()
+        self._flush_timer = None
+
+    @property
+    def conn(self):
+        # Ленивое подключение: при импорте модулей база не открывается
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS clients (
+                client_id INTEGER PRIMARY KEY,
+                telegram_user_id INTEGER UNIQUE,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        conn.commit()
+        if self.seed_json is not None:
+            self._seed_once(conn)
+        return conn
+
+    def _seed_once(self, conn):
+        """Однократный импорт clients.json в пустую базу"""
+        seeded = conn.execute("SELECT value FROM meta WHERE key = 'seeded_from'").fetchone()
+        if seeded or not self.seed_json.exists():
+            return
+        with open(self.seed_json, 'r', encoding='utf-8') as f:
+            clients = json.load(f)
+        self._write(conn, clients)
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded_from', ?)",
+            (str(self.seed_json),)
+        )
+        conn.commit()
+        logging.info("CRM: импортировано %d клиентов из %s", len(clients), self.seed_json)
+
+    def __len__(self):
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+
+    def get_by_telegram_id(self, telegram_user_id):
+        with self._lock:
+            pending = self._pending.get(("tg", telegram_user_id))
+            if pending is not None:
+                return dict(pending)
+            row = self.conn.execute(
+                "SELECT client_id, data FROM clients WHERE telegram_user_id = ?",
+                (telegram_user_id,)
+            ).fetchone()
+        return self._decode(row)
+
+    def get_by_client_id(self, client_id):
+        with self._lock:
+            pending = self._pending.get(("id", client_id))
+            if pending is not None:
+                return dict(pending)
+            row = self.conn.execute(
+                "SELECT client_id, data FROM clients WHERE client_id = ?",
+                (client_id,)
+            ).fetchone()
+        return self._decode(row)
+
+    def upsert(self, client):
+        client = with_budget_range(dict(client), refresh=True)
+        with self._lock:
+            if client.get("client_id") is None and client.get("telegram_user_id") is not None:
+                existing = self.get_by_telegram_id(client["telegram_user_id"])
+                if existing is not None:
+                    client["client_id"] = existing.get("client_id")
+            if client.get("client_id") is not None:
+                self._pending[("id", client["client_id"])] = client
+            if client.get("telegram_user_id") is not None:
+                self._pending[("tg", client["telegram_user_id"])] = client
+            elif client.get("client_id") is None:
+                self._pending[("obj", id(client))] = client
+            if (len(self._pending) >= Config.CRM_WRITE_BATCH_SIZE
+                    or time.monotonic() - self._last_flush >= Config.CRM_FLUSH_INTERVAL):
+                self.flush()
+            elif self._flush_timer is None:
+                # Одиночная запись (например, тестовый клиент) не ждет следующего upsert
+                self._flush_timer = threading.Timer(Config.CRM_FLUSH_INTERVAL, self._timed_flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        return dict(client)
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logging.error(f"CRM: не удалось записать изменения: {e}")
+
+    def upsert_many(self, clients, batch_size=1000):
+        """Массовая запись (импорт выгрузки) пачками: между пачками блокировка отпускается,
+        и чтение клиентов обработчиками не ждет импорта целиком"""
+        self.flush()
+        clients = list(clients)
+        for i in range(0, len(clients), batch_size):
+            with self._lock:
+                self._write(self.conn, clients[i:i + batch_size], batch_size)
+                self.conn.commit()
+
+    def iter_clients(self):
+        self.flush()
+        # Отдельный курсор, чтобы не держать всю таблицу в памяти
+        cursor = self.conn.execute("SELECT client_id, data FROM clients ORDER BY client_id")
+        for row in cursor:
+            yield self._decode(row)
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return
+            # Одна и та же запись может лежать под двумя ключами
+            clients = list({id(c): c for c in self._pending.values()}.values())
+            self._pending.clear()
+            self._write(self.conn, clients)
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def _write(conn, clients, batch_size=1000):
+        """Пишет клиентов пачками через executemany"""
+        with_id, without_id = [], []
+        for client in clients:
+            data = json.dumps(
+                {k: v for k, v in with_budget_range(dict(client), refresh=True).items() if k != "client_id"},
+                ensure_ascii=False
+            )
+            if client.get("client_id") is not None:
+                with_id.append((client["client_id"], client.get("telegram_user_id"), data))
+            else:
+                without_id.append((client.get("telegram_user_id"), data))
+        for i in range(0, len(with_id), batch_size):
+            conn.executemany(
+                "INSERT OR REPLACE INTO clients (client_id, telegram_user_id, data) VALUES (?, ?, ?)",
+                with_id[i:i + batch_size]
+            )
+        for i in range(0, len(without_id), batch_size):
+            conn.executemany(
+                "INSERT INTO clients (telegram_user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(telegram_user_id) DO UPDATE SET data = excluded.data",
+                without_id[i:i + batch_size]
+            )
+
+    @staticmethod
+    def _decode(row):
+        if row is None:
+            return None
+        client = {"client_id": row[0]}
+        client.update(json.loads(row[1]))
+        # Записи, сохраненные до появления budget_range
+        return with_budget_range(client)
+
+
+def import_clients_json(store, json_path):
+    """Импортирует клиентов из JSON-выгрузки CRM в хранилище"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        clients = json.load(f)
+    store.upsert_many(clients)
+    store.flush()
+    return len(clients)
+
+
+def create_crm_store(backend=None):
+    """Создает хранилище CRM согласно Config.CRM_BACKEND ("sqlite" или "memory")"""
+    backend = backend or Config.CRM_BACKEND
+    if backend == "sqlite":
+        return SQLiteCRMStore(Config.CRM_DB_FILE, seed_json=Config.CRM_FILE)
+    if backend == "memory":
+        with open(Config.CRM_FILE, 'r', encoding='utf-8') as f:
+            return InMemoryCRMStore(json.load(f))
+    raise ValueError(f"Неизвестный CRM_BACKEND: {backend}")
+
+
+if __name__ == "__main__":
+    # python -m bot.services.crm_store [clients.json] - импорт выгрузки CRM в SQLite
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else Config.CRM_FILE
+    crm = SQLiteCRMStore(Config.CRM_DB_FILE)
+    count = import_clients_json(crm, source)
+    crm.close()
+    print(f"Импортировано клиентов: {count} -> {Config.CRM_DB_FILE}")
@@ -0,0 +1,83 @@
+import logging
+import re
+import zlib
+import numpy as np
+from config import Config
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """TF-IDF эмбеддинги на хешировании слов и символьных триграмм (только NumPy, CPU).
+
+    Триграммы сглаживают русскую морфологию ("машина"/"машину"), хеширование
+    дает фиксированную размерность без словаря. IDF подбирается по корпусу в fit().
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim or Config.EMBEDDING_DIM
+        self.idf = np.ones(self.dim, dtype=np.float32)
+        self.name = f"hashing-tfidf-{self.dim}"
+
+    def _features(self, text):
+        features = []
+        for word in _WORD_RE.findall(text.lower()):
+            features.append(word)
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def _bucket(self, feature):
+        # crc32 стабилен между процессами (в отличие от hash())
+        return zlib.crc32(feature.encode("utf-8")) % self.dim
+
+    def _term_counts(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = [self._bucket(f) for f in self._features(text)]
+            if buckets:
+                np.add.at(matrix[row], buckets, 1.0)
+        return matrix
+
+    def fit(self, texts):
+        """Считает IDF по корпусу документов"""
+        counts = self._term_counts(texts)
+        doc_freq = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + doc_freq)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, texts):
+        """Возвращает L2-нормированную матрицу (len(texts), dim)"""
+        matrix = np.log1p(self._term_counts(texts)) * self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class LocalModelEmbedder:
+    """Эмбеддинги локальной моделью sentence-transformers (CPU)"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.idf = None
+        self.name = f"st:{model_name}"
+
+    def fit(self, texts):
+        return self
+
+    def embed(self, texts):
+        return self.model.encode(
+            list(texts), normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def create_embedder():
+    """Локальная модель из Config.EMBEDDING_MODEL, если доступна, иначе хеширующий TF-IDF"""
+    if Config.EMBEDDING_MODEL:
+        try:
+            return LocalModelEmbedder(Config.EMBEDDING_MODEL)
+        except ImportError:
+            logging.warning("sentence-transformers не установлен, используется TF-IDF")
+    return HashingEmbedder()
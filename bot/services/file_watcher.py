@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import os
+from config import Config
+
+
+def _stamp(path):
+    """Отметка версии файла: (mtime_ns, размер); None - файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Опрашивает mtime/размер файлов и вызывает callback(changed_paths) в рабочем потоке.
+
+    Изменение применяется, когда отметка файла не менялась между двумя опросами:
+    файл, который еще дописывается, не будет прочитан наполовину. Надежнее всего
+    обновлять файлы атомарно (запись во временный файл + rename).
+    """
+
+    def __init__(self, paths, callback, interval=None):
+        self.paths = list(paths)
+        self.callback = callback
+        self.interval = interval or Config.HOT_RELOAD_INTERVAL
+        self._applied = {path: _stamp(path) for path in self.paths}
+        self._seen = dict(self._applied)
+        self._task = None
+
+    def poll(self):
+        """Файлы, изменившиеся с прошлого применения и уже не меняющиеся"""
+        changed = []
+        for path in self.paths:
+            stamp = _stamp(path)
+            previous, self._seen[path] = self._seen[path], stamp
+            if stamp is not None and stamp == previous and stamp != self._applied[path]:
+                changed.append(path)
+        return changed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            changed = self.poll()
+            if not changed:
+                continue
+            # Отметки фиксируем до вызова: битый файл не перечитывается до следующего изменения
+            for path in changed:
+                self._applied[path] = self._seen[path]
+            try:
+                await asyncio.to_thread(self.callback, changed)
+            except Exception as e:
+                logging.error(f"Не удалось применить изменения {', '.join(map(str, changed))}: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
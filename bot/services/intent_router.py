@@ -0,0 +1,269 @@
+import json
+import logging
+import numpy as np
+from config import Config
+from bot.services.metrics import registry
+from bot.services.text_preprocessing import scan
+from bot.services.upsell import BODY_TYPE_WORDS, body_type
+
+INTENTS = registry.counter(
+    "intent_routes_total", "Сообщения режима продаж по намерению и маршруту (fast - ответ из каталога, llm)",
+    ["intent", "route"])
+
+# Команды переключения режима: распознаются, только если сообщение целиком - команда
+# (плюс слова вежливости), а не как подстрока ("I work in sales" режим не меняет)
+MODE_PHRASES = {
+    "analysis": ("анализ звонка", "анализ звонков", "режим анализа", "call analysis", "analysis mode"),
+    "script_gen": ("генерация скрипта", "генерация скриптов", "режим скриптов", "script generation", "script mode"),
+    "sales": ("продажи", "режим продаж", "sales", "sales mode"),
+}
+
+# Ключевые фразы намерений режима продаж
+INTENT_KEYWORDS = {
+    "price": (
+        "сколько стоит", "сколько стоят", "сколько будет стоить", "цена", "цену", "цены", "стоимость",
+        "почем", "почём", "в наличии", "есть ли", "how much", "price", "cost", "in stock", "available",
+    ),
+    "catalog": (
+        "какие машины", "какие автомобили", "какие модели", "что есть", "что у вас есть", "каталог",
+        "ассортимент", "список", "what cars", "which cars", "what models", "which models", "catalog",
+        "catalogue", "lineup",
+    ),
+    # Просьба сравнить или посоветовать - всегда к LLM, даже если спрашивают цену
+    "open": (
+        "посоветуйте", "посоветуй", "порекомендуйте", "порекомендуй", "рекомендуете", "лучше", "сравни",
+        "сравните", "сравнить", "разница", "отличается", "выбрать", "или", "recommend", "suggest",
+        "better", "compare", "difference", "vs", "versus", "choose", "or",
+    ),
+}
+
+# Слова, допустимые в команде режима помимо самой команды
+_POLITENESS = {"пожалуйста", "please", "pls", "давай", "давайте", "включи", "включите", "switch", "to"}
+
+# Служебные слова вопроса о цене. Вопрос о цене отвечается из каталога, только если кроме
+# ключевой фразы, марки и модели в нем нет других значимых слов: "цена страховки на Cullinan",
+# "How much is the Phantom lease" - уже не о цене автомобиля
+_PRICE_FILLER = {
+    "а", "и", "у", "на", "в", "за", "ли", "же", "вас", "мне", "мой", "какая", "какой", "какова", "каков",
+    "сколько", "стоит", "будет", "сейчас", "подскажите", "скажите", "узнать", "хочу", "пожалуйста",
+    "the", "a", "an", "is", "are", "of", "for", "on", "does", "do", "you", "have", "what", "s", "it",
+    "tell", "me", "i", "want", "to", "know", "your", "please", "now", "currently",
+}
+
+# Служебные слова запроса каталога (вопрос, фильтр по бюджету). Как и с ценой, шаблонный список
+# моделей - только если кроме них в запросе лишь марки, типы кузова и суммы: "какие машины есть
+# для семьи" - просьба подобрать, ее отвечает LLM
+_CATALOG_FILLER = _PRICE_FILLER | {
+    "какие", "что", "есть", "покажите", "покажи", "все", "ваши", "ваш", "наличии", "машины", "машин",
+    "автомобили", "автомобилей", "модели", "моделей", "от", "до", "под", "между", "с", "бюджет",
+    "бюджетом", "дешевле", "дороже", "тыс", "тысяч", "млн", "миллиона", "миллионов", "долларов", "руб",
+    "show", "all", "which", "cars", "models", "available", "from", "under", "below", "up", "within",
+    "between", "and", "budget", "cheaper", "than", "k", "m", "mln", "usd", "dollars", "list",
+}
+
+# Одиночные слова типов кузова ("внедорожники", "sedans" - по началу слова)
+_BODY_WORDS = tuple(word for words in BODY_TYPE_WORDS.values() for word in words if " " not in word)
+
+# Признаки классификатора: начало слова (грубая замена стемминга для русских окончаний)
+_STEM_LENGTH = 5
+
+
+def _price_word(token):
+    return token in _PRICE_FILLER
+
+
+def _catalog_word(token):
+    """Каталог отфильтруется по марке, типу кузова и бюджету - суммы и типы кузова не лишние слова"""
+    return token in _CATALOG_FILLER or any(ch.isdigit() for ch in token) or token.startswith(_BODY_WORDS)
+
+
+def _stem(token):
+    return token[:_STEM_LENGTH]
+
+
+class KeywordAutomaton:
+    """Поиск фраз из нескольких слов по списку токенов: префиксное дерево по словам,
+    один проход по сообщению"""
+
+    def __init__(self, phrases):
+        self._root = {}
+        for label, variants in phrases.items():
+            for phrase in variants:
+                node = self._root
+                for word in phrase.lower().split():
+                    node = node.setdefault(word, {})
+                # Ключ None - конец фразы
+                node.setdefault(None, label)
+
+    def matches(self, tokens):
+        """Найденные фразы [(метка, начало, конец)] в порядке появления (самая длинная с каждой позиции)"""
+        result = []
+        for start in range(len(tokens)):
+            node, found = self._root, None
+            for end, token in enumerate(tokens[start:], start + 1):
+                node = node.get(token)
+                if node is None:
+                    break
+                if None in node:
+                    found = (node[None], start, end)
+            if found is not None:
+                result.append(found)
+        return result
+
+    def find(self, tokens):
+        """Метки найденных фраз в порядке появления"""
+        return [label for label, _, _ in self.matches(tokens)]
+
+
+class NaiveBayesIntentClassifier:
+    """Мультиномиальный наивный байес по основам слов (NumPy): обучение и предсказание - миллисекунды"""
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.labels = []
+        self._vocabulary = {}
+        self._log_prior = None
+        self._log_likelihood = None
+
+    def fit(self, token_lists, labels):
+        self.labels = sorted(set(labels))
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        for tokens in token_lists:
+            for token in tokens:
+                self._vocabulary.setdefault(_stem(token), len(self._vocabulary))
+        counts = np.zeros((len(self.labels), len(self._vocabulary)), dtype=np.float64)
+        for tokens, label in zip(token_lists, labels):
+            columns = [self._vocabulary[_stem(token)] for token in tokens]
+            np.add.at(counts[label_index[label]], columns, 1)
+        priors = np.bincount([label_index[label] for label in labels], minlength=len(self.labels))
+        self._log_prior = np.log(priors / priors.sum())
+        smoothed = counts + self.alpha
+        self._log_likelihood = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        return self
+
+    def predict(self, tokens):
+        """(метка, вероятность); слова вне словаря не учитываются"""
+        if self._log_prior is None:
+            return "open", 0.0
+        columns = [self._vocabulary[stem] for stem in map(_stem, tokens) if stem in self._vocabulary]
+        scores = self._log_prior + self._log_likelihood[:, columns].sum(axis=1)
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+
+class IntentRouter:
+    """Локальное определение намерения: команды режимов, вопросы о цене и наличии, запросы
+    каталога - без обращения к LLM. Классификатор обучается при старте на INTENT_TRAIN_FILE
+    (строки JSONL {"text", "intent"}, например размеченные сообщения из логов)."""
+
+    def __init__(self, train_file=None):
+        self.modes = {
+            tuple(phrase.split()): mode for mode, phrases in MODE_PHRASES.items() for phrase in phrases
+        }
+        self.keywords = KeywordAutomaton(INTENT_KEYWORDS)
+        self.classifier = NaiveBayesIntentClassifier()
+        train_file = train_file or Config.INTENT_TRAIN_FILE
+        if train_file.exists():
+            with open(train_file, 'r', encoding='utf-8') as f:
+                examples = [json.loads(line) for line in f if line.strip()]
+            self.classifier.fit([self.tokens(e["text"]) for e in examples], [e["intent"] for e in examples])
+            logging.info("Классификатор намерений: %d примеров, %s", len(examples), self.classifier.labels)
+        else:
+            logging.warning("Нет обучающих примеров намерений %s: работают только ключевые фразы", train_file)
+
+    def tokens(self, text):
+        return scan(text.lower())[0]
+
+    def mode_switch(self, text):
+        """Режим, если сообщение - команда переключения ("продажи", "call analysis"), иначе None"""
+        tokens = tuple(token for token in self.tokens(text) if token not in _POLITENESS)
+        return self.modes.get(tokens)
+
+    def classify(self, tokens, vocabulary=frozenset()):
+        """Намерение сообщения режима продаж: "price", "catalog" или "open" (нужен LLM).
+
+        vocabulary - слова названий марок и моделей каталога (TextPreprocessor.vocabulary).
+        """
+        if len(tokens) > Config.INTENT_FAST_PATH_MAX_TOKENS:
+            return "open", 1.0
+        matches = self.keywords.matches(tokens)
+        found = [label for label, _, _ in matches]
+        if "open" in found:
+            return "open", 1.0
+        if vocabulary and not any(token in vocabulary for token in tokens):
+            # "В наличии" без модели ("What SUVs are available?") - вопрос о каталоге, а не о цене
+            found = [label for label in found if label != "price"]
+        intent, confidence = next(((i, 1.0) for i in ("price", "catalog") if i in found), (None, 0.0))
+        if intent is None:
+            intent, confidence = self.classifier.predict(tokens)
+            if confidence < Config.INTENT_MIN_CONFIDENCE:
+                return "open", confidence
+        allowed = _price_word if intent == "price" else _catalog_word
+        keyword_positions = {i for label, start, end in matches if label == intent for i in range(start, end)}
+        extra = [
+            token for i, token in enumerate(tokens)
+            if i not in keyword_positions and token not in vocabulary and not allowed(token)
+        ]
+        if extra:
+            return "open", confidence
+        return intent, confidence
+
+
+def _format_price(product):
+    price = product.get("price_usd")
+    return f"${price:,}" if price is not None else "—"
+
+
+def _requested_body_types(tokens):
+    """Типы кузова из вопроса ("внедорожники", "sedans") - по началу слова"""
+    return {
+        body for body, words in BODY_TYPE_WORDS.items()
+        if any(token.startswith(word) for token in tokens for word in words if word in _BODY_WORDS)
+    }
+
+
+def catalog_answer(intent, text, products):
+    """Ответ из каталога для намерения price/catalog; None - ответить шаблоном нельзя.
+
+    text - PreprocessedText: модели и марки из сообщения, бюджет, язык.
+    """
+    is_russian = text.language == "ru"
+    if intent == "price":
+        matched = [p for p in products if p["name"] in text.models]
+        if not matched and text.brands:
+            matched = [p for p in products if p["name"].split(" ", 1)[0] in text.brands]
+        if not matched:
+            return None
+        lines = [f"• **{p['name']}** — {_format_price(p)}\n  {p.get('description', '')}".rstrip() for p in matched]
+        if is_russian:
+            return "💰 **Цены в нашем каталоге:**\n" + "\n".join(lines) + \
+                "\n\nХотите узнать подробнее или записаться на тест-драйв?"
+        return "💰 **Prices in our catalog:**\n" + "\n".join(lines) + \
+            "\n\nWould you like more details or to book a test drive?"
+
+    if intent == "catalog":
+        matched = products
+        if text.brands:
+            matched = [p for p in matched if p["name"].split(" ", 1)[0] in text.brands]
+        body_types = _requested_body_types(text.tokens)
+        if body_types:
+            matched = [p for p in matched if body_type(p) in body_types]
+        if text.budget is not None:
+            low, high = text.budget
+            if low == high:
+                # "до $300k" в вопросе о каталоге - верхняя граница, а не точная цена
+                low = None
+            matched = [
+                p for p in matched if p.get("price_usd") is not None
+                and (low is None or p["price_usd"] >= low) and (high is None or p["price_usd"] <= high)
+            ]
+        if not matched:
+            return None
+        lines = [f"• **{p['name']}** — {_format_price(p)}" for p in
+                 sorted(matched, key=lambda p: p.get("price_usd") or 0)]
+        if is_russian:
+            return "🚗 **В нашем каталоге:**\n" + "\n".join(lines) + "\n\nКакая модель вас заинтересовала?"
+        return "🚗 **In our catalog:**\n" + "\n".join(lines) + "\n\nWhich model interests you?"
+    return None
@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from config import Config
+from bot.services.metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT_SECONDS
+
+
+class TokenBucket:
+    """Корзина токенов: rate единиц в минуту, не больше capacity в запасе"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Сколько секунд ждать, пока в корзине наберется amount (0 - можно сейчас)"""
+        self._refill()
+        # Запрос больше емкости корзины пропускаем при полной корзине, иначе он не пройдет никогда
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        # Допускаем "долг": фактический расход может оказаться больше оценки
+        self.tokens -= amount
+
+
+class _ModelLimits:
+    def __init__(self, model):
+        limits = Config.MODEL_RATE_LIMITS.get(model, Config.MODEL_RATE_LIMITS["default"])
+        self.requests = TokenBucket(limits["rpm"])
+        self.tokens = TokenBucket(limits["tpm"])
+
+    def wait_time(self, tokens):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def consume(self, tokens):
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+
+
+class LLMScheduler:
+    """Общий планировщик запросов к LLM.
+
+    Для каждой модели - корзины запросов/мин и токенов/мин. Ожидающие запросы
+    разбиты на классы приоритета (интерактивные продажи > анализ > генерация
+    скриптов > фоновые задачи); внутри класса пользователи обслуживаются по кругу,
+    чтобы один пользователь с пачкой запросов не занимал всю квоту.
+    """
+
+    def __init__(self):
+        self._queues = {}    # приоритет -> OrderedDict(пользователь -> deque ожидающих)
+        self._limits = {}    # модель -> _ModelLimits
+        self._wakeup = None
+        self._dispatcher = None
+        self._loop = None
+        self.stats = {"granted": 0, "wait_seconds_total": 0.0}
+
+    def _model_limits(self, model):
+        if model not in self._limits:
+            self._limits[model] = _ModelLimits(model)
+        return self._limits[model]
+
+    def queue_depth(self):
+        """Число ожидающих запросов по классам приоритета"""
+        return {
+            priority: sum(len(waiters) for waiters in users.values())
+            for priority, users in sorted(self._queues.items())
+        }
+
+    async def acquire(self, model, task, user_id=None, tokens=0):
+        """Ждет своей очереди и квоты модели; tokens - оценка токенов запроса"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый event loop (например, отдельный запуск пакетной задачи) - начинаем с чистого листа
+            self._loop, self._queues, self._dispatcher = loop, {}, None
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch_loop())
+
+        priority = Config.TASK_PRIORITIES.get(task, max(Config.TASK_PRIORITIES.values()) + 1)
+        enqueued_at = time.monotonic()
+        waiter = (loop.create_future(), model, tokens, enqueued_at)
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(user_id, deque()).append(waiter)
+        self._wakeup.set()
+        try:
+            await waiter[0]
+        except asyncio.CancelledError:
+            self._remove(priority, user_id, waiter)
+            raise
+        LLM_QUEUE_WAIT_SECONDS.observe(time.monotonic() - enqueued_at, task=task)
+
+    def record_usage(self, model, estimated_tokens, actual_tokens):
+        """Корректирует корзину токенов по фактическому usage из ответа"""
+        if actual_tokens is not None:
+            self._model_limits(model).tokens.consume(actual_tokens - estimated_tokens)
+
+    def _remove(self, priority, user_id, waiter):
+        users = self._queues.get(priority, {})
+        waiters = users.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del users[user_id]
+
+    def _dispatch_once(self):
+        """Выдает одно разрешение; возвращает (выдано ли, минимальное время до следующей попытки)"""
+        min_wait = None
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            for user_id in list(users):
+                waiters = users[user_id]
+                future, model, tokens, enqueued_at = waiters[0]
+                if future.done():
+                    waiters.popleft()
+                    if not waiters:
+                        del users[user_id]
+                    continue
+                limits = self._model_limits(model)
+                wait = limits.wait_time(tokens)
+                if wait > 0:
+                    # Квота этой модели исчерпана - пробуем запросы к другим моделям
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+                    continue
+                limits.consume(tokens)
+                waiters.popleft()
+                # Пользователь уходит в конец круга
+                del users[user_id]
+                if waiters:
+                    users[user_id] = waiters
+                future.set_result(None)
+                self.stats["granted"] += 1
+                self.stats["wait_seconds_total"] += time.monotonic() - enqueued_at
+                return True, 0.0
+        return False, min_wait
+
+    async def _dispatch_loop(self):
+        while True:
+            granted, min_wait = self._dispatch_once()
+            if granted:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min_wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Один планировщик на процесс
+llm_scheduler = LLMScheduler()
+LLM_QUEUE_DEPTH.set_function(lambda: {(priority,): depth for priority, depth in llm_scheduler.queue_depth().items()})
@@ -0,0 +1,226 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from config import Config
+
+try:
+    # Спаны OpenTelemetry - только если пакет установлен и настроен экспортер
+    from opentelemetry import trace as _otel_trace
+    _tracer = _otel_trace.get_tracer("ai_sales_bot")
+except ImportError:
+    _tracer = None
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._render_items(items))
+        return lines
+
+    def _render_items(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Текущее значение; можно задать функцию, которая вызывается при выгрузке"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """function() -> {значения меток (кортеж): значение}"""
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:
+                logging.error(f"Ошибка вычисления метрики {self.name}: {e}")
+                values = {}
+            with self._lock:
+                self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счетчики по корзинам (+Inf последней), сумма, количество
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Реестр процесса и метрики бота
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "bot_stage_seconds", "Длительность этапов обработки (CRM, поиск, промпт, отправка в Telegram)", ["stage"])
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds", "Полное время обработки сообщения по режимам", ["mode"])
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Ошибки обработчиков по режимам", ["mode"])
+LLM_REQUEST_SECONDS = registry.histogram(
+    "llm_request_seconds", "Задержка запроса к OpenRouter (для потока - до конца ответа)", ["task", "model"])
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "llm_first_token_seconds", "Время до первого фрагмента потокового ответа", ["task", "model"])
+LLM_REQUESTS = registry.counter(
+    "llm_requests_total", "Запросы к OpenRouter по исходу (success/retry/fallback/error)",
+    ["task", "model", "outcome"])
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Токены по usage из ответов OpenRouter", ["task", "model", "kind"])
+LLM_COST_USD = registry.counter(
+    "llm_cost_usd_total", "Стоимость запросов к OpenRouter, USD", ["task", "model"])
+LLM_QUEUE_WAIT_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Ожидание квоты в планировщике запросов к LLM", ["task"])
+LLM_QUEUE_DEPTH = registry.gauge(
+    "llm_queue_depth", "Запросы, ожидающие квоты, по классам приоритета", ["priority"])
+CACHE_LOOKUPS = registry.counter(
+    "response_cache_lookups_total", "Обращения к кэшу ответов (exact/semantic/disk/miss; bypass - ответ с историей диалога)", ["result"])
+
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+    """Замер этапа в bot_stage_seconds и, если доступен OpenTelemetry, спан с тем же именем"""
+    started = time.monotonic()
+    otel_span = _tracer.start_as_current_span(stage, attributes=attributes) if _tracer else None
+    try:
+        if otel_span is None:
+            yield
+        else:
+            with otel_span:
+                yield
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - started, stage=stage)
+
+
+def record_llm_usage(task, model, usage):
+    """Учет токенов и стоимости по полю usage ответа; возвращает стоимость в USD"""
+    if not usage:
+        return 0.0
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    LLM_TOKENS.inc(prompt, task=task, model=model, kind="prompt")
+    LLM_TOKENS.inc(completion, task=task, model=model, kind="completion")
+    # OpenRouter отдает стоимость сам, если она включена в usage; иначе считаем по прайсу
+    cost = usage.get("cost")
+    if cost is None:
+        prompt_price, completion_price = Config.MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (prompt * prompt_price + completion * completion_price) / 1_000_000
+    LLM_COST_USD.inc(cost, task=task, model=model)
+    logging.debug("LLM %s (%s): %d+%d токенов, $%.6f", model, task, prompt, completion, cost)
+    return cost
+
+
+async def handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host, port):
+    """Отдельный HTTP-сервер с /metrics; возвращает runner для остановки"""
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return runner
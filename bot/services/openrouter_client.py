@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import json
+import httpx
+from config import Config
+
+
+class StreamError(Exception):
+    """Ошибка, пришедшая внутри SSE-потока OpenRouter (после статуса 200)"""
+
+
+class OpenRouterClient:
+    """Общий HTTP-клиент OpenRouter с пулом соединений и keep-alive"""
+
+    def __init__(self):
+        self._client = None
+        # Глобальный лимит одновременных запросов к LLM на процесс
+        self._semaphore = asyncio.Semaphore(Config.LLM_MAX_CONCURRENCY)
+
+    def start(self):
+        """Создает пул соединений (вызывается при старте Application)"""
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=Config.OPENROUTER_BASE_URL,
+            headers=Config.OPENROUTER_HEADERS,
+            http2=Config.OPENROUTER_HTTP2,
+            limits=httpx.Limits(
+                max_connections=Config.OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.OPENROUTER_MAX_KEEPALIVE,
+                keepalive_expiry=Config.OPENROUTER_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                Config.OPENROUTER_TIMEOUTS["default"],
+                connect=Config.OPENROUTER_CONNECT_TIMEOUT,
+            ),
+        )
+        logging.info("OpenRouter клиент запущен (http2=%s)", Config.OPENROUTER_HTTP2)
+
+    async def close(self):
+        """Закрывает все соединения пула (вызывается при остановке Application)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self):
+        # Ленивый запуск для скриптов, которые работают без Application
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def timeout_for(self, endpoint):
+        """Таймаут чтения для конкретного сценария (sales/analysis/script)"""
+        return httpx.Timeout(
+            Config.OPENROUTER_TIMEOUTS.get(endpoint, Config.OPENROUTER_TIMEOUTS["default"]),
+            connect=Config.OPENROUTER_CONNECT_TIMEOUT,
+        )
+
+    async def chat_completion(self, payload, endpoint="default"):
+        """Отправляет запрос в /chat/completions и возвращает JSON-ответ"""
+        async with self._semaphore:
+            response = await self.client.post(
+                "/chat/completions",
+                json=payload,
+                timeout=self.timeout_for(endpoint),
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_chat_completion(self, payload, endpoint="default", on_usage=None):
+        """Потоково читает SSE-ответ и отдает текстовые фрагменты по мере генерации.
+
+        on_usage(usage) вызывается, если в потоке пришла статистика токенов (последний чанк).
+        """
+        payload = {**payload, "stream": True}
+        async with self._semaphore, self.client.stream(
+            "POST",
+            "/chat/completions",
+            json=payload,
+            timeout=self.timeout_for(endpoint),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # SSE: полезные строки начинаются с "data: ", остальное - комментарии/keep-alive
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if "error" in chunk:
+                    raise StreamError(f"OpenRouter stream error: {chunk['error']}")
+                if chunk.get("usage") and on_usage is not None:
+                    on_usage(chunk["usage"])
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+
+# Единый клиент на процесс, используется всеми сервисами
+openrouter_client = OpenRouterClient()
@@ -0,0 +1,259 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+import httpx
+from config import Config
+from bot.services.openrouter_client import StreamError, openrouter_client
+from bot.services.llm_scheduler import llm_scheduler
+from bot.services.metrics import LLM_FIRST_TOKEN_SECONDS, LLM_REQUEST_SECONDS, LLM_REQUESTS, record_llm_usage
+from bot.services.tokens import estimate_tokens
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Статусы, при которых повтор той же модели бесполезен, но другая модель может справиться
+FALLBACK_STATUSES = {400, 402, 404, 413, 422}
+
+
+class CircuitBreaker:
+    """Размыкатель для одной модели: после серии ошибок модель временно исключается из цепочки"""
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or Config.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or Config.CIRCUIT_RESET_TIMEOUT
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        # В half_open пропускаем пробный запрос
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Скользящее окно задержек для оценки p95"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if len(self.samples) < Config.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class UpstreamError(Exception):
+    """Все модели цепочки недоступны"""
+
+
+def _retry_after(error):
+    """Пауза из заголовка Retry-After (секунды или HTTP-дата), если он есть"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # Некорректный заголовок - обычная экспоненциальная пауза
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def _classify(error):
+    """retry - повторить ту же модель, fallback - перейти к следующей, raise - пробросить"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status in RETRYABLE_STATUSES:
+            return "retry"
+        if status in FALLBACK_STATUSES:
+            return "fallback"
+        return "raise"
+    if isinstance(error, (httpx.TransportError, StreamError)):
+        # Таймауты, обрывы соединения, ошибки внутри SSE-потока
+        return "retry"
+    return "raise"
+
+
+class OpenRouterGateway:
+    """Надежный доступ к OpenRouter: повторы с экспоненциальной паузой и учетом Retry-After,
+    цепочка резервных моделей для каждой задачи, размыкатель на модель и
+    дублирующие (hedged) запросы для чувствительных к задержке задач.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or openrouter_client
+        self.breakers = {}
+        self.latency = {}
+
+    def _breaker(self, model):
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+
+    def _models(self, task):
+        return Config.MODEL_FALLBACKS.get(task) or Config.MODEL_FALLBACKS["default"]
+
+    def _backoff(self, attempt, error):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        delay = Config.RETRY_BASE_DELAY * (2 ** attempt)
+        return min(Config.RETRY_MAX_DELAY, delay) * random.uniform(0.5, 1.0)
+
+    async def complete(self, task, payload, user_id=None):
+        """Запрос /chat/completions для задачи (sales/analysis/script/...) с повторами и резервом"""
+        last_error = None
+        for model in self._models(task):
+            breaker = self._breaker(model)
+            if not breaker.allow():
+                continue
+            # usage.include - OpenRouter добавляет в ответ стоимость запроса (в потоке - последним чанком)
+            request = {**payload, "model": model, "usage": {"include": True}}
+            for attempt in range(Config.RETRY_ATTEMPTS + 1):
+                try:
+                    if task in Config.HEDGED_TASKS:
+                        data = await self._hedged(task, request, user_id)
+                    else:
+                        data = await self._timed(task, request, user_id)
+                    breaker.record_success()
+                    LLM_REQUESTS.inc(task=task, model=model, outcome="success")
+                    return data
+                except Exception as e:
+                    action = _classify(e)
+                    LLM_REQUESTS.inc(task=task, model=model, outcome="error" if action == "raise" else action)
+                    if action == "raise":
+                        raise
+                    last_error = e
+                    breaker.record_failure()
+                    logging.warning("OpenRouter %s (%s), попытка %d: %s", model, task, attempt + 1, e)
+                    if action == "fallback" or not breaker.allow():
+                        break
+                    delay = self._backoff(attempt, e)
+                    if attempt == Config.RETRY_ATTEMPTS or delay > Config.RETRY_MAX_DELAY:
+                        # Долгое ожидание - сразу пробуем следующую модель
+                        break
+                    await asyncio.sleep(delay)
+        raise UpstreamError(f"Нет доступных моделей для задачи {task}") from last_error
+
+    async def stream(self, task, payload, user_id=None):
+        """Потоковый запрос; повтор и смена модели возможны только до первого фрагмента ответа"""
+        last_error = None
+        for model in self._models(task):
+            breaker = self._breaker(model)
+            if not breaker.allow():
+                continue
+            # usage.include - OpenRouter добавляет в ответ стоимость запроса (в потоке - последним чанком)
+            request = {**payload, "model": model, "usage": {"include": True}}
+            for attempt in range(Config.RETRY_ATTEMPTS + 1):
+                started = False
+                estimated = self._estimate_tokens(request)
+
+                def on_usage(usage, model=model, estimated=estimated):
+                    record_llm_usage(task, model, usage)
+                    llm_scheduler.record_usage(model, estimated, usage.get("total_tokens"))
+
+                try:
+                    await llm_scheduler.acquire(model, task, user_id, estimated)
+                    request_started = time.monotonic()
+                    async for delta in self.client.stream_chat_completion(request, endpoint=task, on_usage=on_usage):
+                        if not started:
+                            LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - request_started, task=task, model=model)
+                        started = True
+                        yield delta
+                    breaker.record_success()
+                    LLM_REQUEST_SECONDS.observe(time.monotonic() - request_started, task=task, model=model)
+                    LLM_REQUESTS.inc(task=task, model=model, outcome="success")
+                    return
+                except Exception as e:
+                    action = _classify(e)
+                    LLM_REQUESTS.inc(
+                        task=task, model=model, outcome="error" if started or action == "raise" else action
+                    )
+                    if started or action == "raise":
+                        raise
+                    last_error = e
+                    breaker.record_failure()
+                    logging.warning("OpenRouter stream %s (%s), попытка %d: %s", model, task, attempt + 1, e)
+                    if action == "fallback" or not breaker.allow():
+                        break
+                    delay = self._backoff(attempt, e)
+                    if attempt == Config.RETRY_ATTEMPTS or delay > Config.RETRY_MAX_DELAY:
+                        break
+                    await asyncio.sleep(delay)
+        raise UpstreamError(f"Нет доступных моделей для задачи {task}") from last_error
+
+    @staticmethod
+    def _estimate_tokens(request):
+        prompt = sum(estimate_tokens(m.get("content", "")) for m in request.get("messages", []))
+        return prompt + request.get("max_tokens", Config.DEFAULT_COMPLETION_TOKENS)
+
+    async def _timed(self, task, request, user_id=None):
+        # Ожидание квоты в очереди планировщика не входит в задержку модели
+        estimated = self._estimate_tokens(request)
+        await llm_scheduler.acquire(request["model"], task, user_id, estimated)
+        started = time.monotonic()
+        data = await self.client.chat_completion(request, endpoint=task)
+        elapsed = time.monotonic() - started
+        self.latency.setdefault(task, LatencyTracker()).add(elapsed)
+        LLM_REQUEST_SECONDS.observe(elapsed, task=task, model=request["model"])
+        usage = data.get("usage") or {}
+        record_llm_usage(task, request["model"], usage)
+        llm_scheduler.record_usage(request["model"], estimated, usage.get("total_tokens"))
+        return data
+
+    async def _hedged(self, task, request, user_id=None):
+        """Если ответа нет дольше p95, отправляем дубль запроса и берем первый успешный"""
+        hedge_after = self.latency.setdefault(task, LatencyTracker()).percentile(0.95)
+        if hedge_after is None:
+            return await self._timed(task, request, user_id)
+
+        pending = {asyncio.create_task(self._timed(task, request, user_id))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                logging.info("OpenRouter %s: дублирующий запрос после %.2fс", task, hedge_after)
+                pending.add(asyncio.create_task(self._timed(task, request, user_id)))
+            error = None
+            while True:
+                for finished in done:
+                    if finished.exception() is None:
+                        return finished.result()
+                    error = finished.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Проигравший (или все при отмене) запрос отменяем
+            for unfinished in pending:
+                unfinished.cancel()
+
+
+# Единый шлюз на процесс: состояние размыкателей и статистика задержек общие для всех сервисов
+openrouter_gateway = OpenRouterGateway()
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from config import Config
+from bot.services.embeddings import create_embedder
+
+
+def _product_text(product):
+    parts = [product.get("name", ""), product.get("description", "")]
+    parts.extend(str(product[key]) for key in ("trim", "options") if product.get(key))
+    return " ".join(parts)
+
+
+def _replace_file(path, write):
+    """Пишет файл во временный и подменяет его rename: индекс, уже отображенный в память
+    другим снимком каталога, продолжает читать старый файл"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ProductIndex:
+    """Векторный индекс каталога: матрица эмбеддингов + отсортированный индекс цен для фильтра по бюджету"""
+
+    def __init__(self, products, embeddings, prices, embedder):
+        self.products = products
+        self.embeddings = embeddings   # (n, dim) float32, строки L2-нормированы
+        self.prices = prices           # (n,) float64
+        self.embedder = embedder
+        # Хеш файла базы знаний, по которому построен индекс (версия каталога)
+        self.source_digest = None
+        # Позиции продуктов по возрастанию цены: диапазон цен - два searchsorted
+        self._price_order = np.argsort(prices, kind="stable")
+        self._sorted_prices = prices[self._price_order]
+
+    def in_price_range(self, min_price=None, max_price=None):
+        """Индексы продуктов с ценой в [min_price, max_price] (границы None - не ограничены)"""
+        start = 0 if min_price is None else np.searchsorted(self._sorted_prices, min_price, side="left")
+        end = len(self._sorted_prices) if max_price is None else \
+            np.searchsorted(self._sorted_prices, max_price, side="right")
+        return self._price_order[start:end]
+
+    @classmethod
+    def build(cls, products, embedder=None):
+        embedder = embedder or create_embedder()
+        texts = [_product_text(p) for p in products]
+        embedder.fit(texts)
+        embeddings = embedder.embed(texts) if texts else np.zeros((0, embedder.dim), dtype=np.float32)
+        prices = np.array([p.get("price_usd", np.inf) for p in products], dtype=np.float64)
+        return cls(products, embeddings.astype(np.float32), prices, embedder)
+
+    def save(self, index_dir, source_digest):
+        index_dir.mkdir(parents=True, exist_ok=True)
+        _replace_file(index_dir / "embeddings.npy", lambda f: np.save(f, self.embeddings))
+        _replace_file(index_dir / "prices.npy", lambda f: np.save(f, self.prices))
+        if self.embedder.idf is not None:
+            _replace_file(index_dir / "idf.npy", lambda f: np.save(f, self.embedder.idf))
+        # meta.json - последним: по нему проверяется, что индекс построен по текущему файлу
+        meta = json.dumps({
+            "source_digest": source_digest,
+            "embedder": self.embedder.name,
+            "products": self.products,
+        }, ensure_ascii=False)
+        _replace_file(index_dir / "meta.json", lambda f: f.write(meta.encode("utf-8")))
+
+    @classmethod
+    def load(cls, index_dir, embedder):
+        """Загружает индекс; матрица эмбеддингов отображается в память (mmap), а не читается целиком"""
+        with open(index_dir / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        embeddings = np.load(index_dir / "embeddings.npy", mmap_mode='r')
+        prices = np.load(index_dir / "prices.npy")
+        if embedder.idf is not None:
+            embedder.idf = np.load(index_dir / "idf.npy")
+        return cls(meta["products"], embeddings, prices, embedder)
+
+    @classmethod
+    def load_or_build(cls, kb_products, kb_file, index_dir=None):
+        """Берет готовый индекс с диска, если он построен по текущей версии базы знаний"""
+        index_dir = index_dir or Config.PRODUCT_INDEX_DIR
+        embedder = create_embedder()
+        digest = _file_digest(kb_file)
+        meta_file = index_dir / "meta.json"
+        if meta_file.exists():
+            try:
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get("source_digest") == digest and meta.get("embedder") == embedder.name:
+                    index = cls.load(index_dir, embedder)
+                    index.source_digest = digest
+                    return index
+            except (OSError, ValueError) as e:
+                logging.warning("Индекс каталога поврежден, перестраиваем: %s", e)
+
+        index = cls.build(kb_products, embedder)
+        index.source_digest = digest
+        try:
+            index.save(index_dir, digest)
+        except OSError as e:
+            logging.warning("Не удалось сохранить индекс каталога: %s", e)
+        return index
+
+    def search(self, query, k=3, max_price=None, min_score=None, min_price=None):
+        """Top-k продуктов по косинусной близости к запросу среди продуктов в диапазоне цен.
+
+        Если порог min_score не прошел ни один продукт (общий запрос без марок и моделей:
+        "хочу машину"), возвращаются top-k по близости без порога - LLM не должен отвечать
+        без ассортимента.
+        """
+        if not self.products:
+            return []
+        min_score = Config.RETRIEVAL_MIN_SCORE if min_score is None else min_score
+        candidates = None
+        if min_price is not None or max_price is not None:
+            # Строки по порядку - последовательное чтение из mmap
+            candidates = np.sort(self.in_price_range(min_price, max_price))
+            if len(candidates) == 0:
+                return []
+        query_vec = self.embedder.embed([query])[0]
+        # Один matmul по каталогу или только по строкам, подходящим по цене
+        if candidates is None:
+            scores = self.embeddings @ query_vec
+        else:
+            scores = self.embeddings[candidates] @ query_vec
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        # При равных оценках - порядок каталога
+        top = top[np.lexsort((top, -scores[top]))]
+        positions = top if candidates is None else candidates[top]
+        matched = [self.products[i] for i, score in zip(positions, scores[top]) if score > min_score]
+        return matched or [self.products[i] for i in positions]
+
+
+if __name__ == "__main__":
+    # python -m bot.services.product_index - офлайн-построение индекса каталога
+    with open(Config.KB_FILE, 'r', encoding='utf-8') as f:
+        products = json.load(f)["products"]
+    index = ProductIndex.build(products)
+    index.save(Config.PRODUCT_INDEX_DIR, _file_digest(Config.KB_FILE))
+    print(f"Индекс построен: {len(products)} продуктов -> {Config.PRODUCT_INDEX_DIR}")
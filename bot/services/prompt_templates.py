@@ -0,0 +1,180 @@
+from config import Config
+from bot.services.tokens import estimate_tokens
+
+# Меняется при любой правке текстов шаблонов - попадает в ключ кэша ответов
+PROMPT_VERSION = "sales-3"
+
+# Статическая часть системного промпта: одинакова для всех клиентов, поэтому
+# провайдер может кэшировать ее как общий префикс. Данные клиента идут после нее.
+_SALES_PREFIX = {
+    "ru": """Ты - элитный ИИ-продавец премиальных автомобилей. Твоя задача - дать персонализированный ответ клиенту.
+
+КРИТИЧЕСКИ ВАЖНО - ОБЯЗАТЕЛЬНО ИСПОЛЬЗУЙ ВСЮ ИНФОРМАЦИЮ О КЛИЕНТЕ ИЗ РАЗДЕЛОВ НИЖЕ.
+
+ПРАВИЛА ОТВЕТА:
+1. ОБЯЗАТЕЛЬНО обратись к клиенту по имени
+2. ОБЯЗАТЕЛЬНО упомяни его статус/предыдущие покупки
+3. Учти его бюджет при рекомендациях
+4. Предложи конкретный автомобиль из доступных
+5. Если есть апсейл - обоснуй его
+6. Ответ максимум 4 предложения
+7. Закончи призывом к действию
+
+Пример: "Аркадий, как наш VIP клиент с опытом владения Bentley Continental GT, рекомендую вам..."
+""",
+    "en": """You are an elite AI sales consultant for premium automobiles. Provide personalized response to the client.
+
+CRITICALLY IMPORTANT - MUST USE ALL CLIENT INFORMATION FROM THE SECTIONS BELOW.
+
+RESPONSE RULES:
+1. MUST address client by name
+2. MUST mention their status/previous purchases
+3. Consider their budget in recommendations
+4. Suggest specific car from available options
+5. If upsell available - justify it
+6. Maximum 4 sentences
+7. End with call to action
+
+Example: "Arkady, as our VIP client with Bentley Continental GT experience, I recommend..."
+""",
+}
+
+# Заголовки и подписи переменных разделов
+_LABELS = {
+    "ru": {
+        "client": "📋 ДАННЫЕ КЛИЕНТА ИЗ CRM:",
+        "products": "🚗 ДОСТУПНЫЕ АВТОМОБИЛИ:",
+        "upsell": "💎 РЕКОМЕНДАЦИИ ПО АПСЕЙЛУ:",
+        "summary": "🗒 РАНЕЕ В РАЗГОВОРЕ С КЛИЕНТОМ:",
+        "query": "Запрос клиента: ",
+        "fields": (
+            ("name", "Имя", "Не указано"),
+            ("deal_status", "Статус", "Не указан"),
+            ("previous_purchase", "Предыдущая покупка", "Нет"),
+            ("budget", "Бюджет", "Не указан"),
+            ("preferences", "Предпочтения", "Не указаны"),
+        ),
+    },
+    "en": {
+        "client": "📋 CLIENT CRM DATA:",
+        "products": "🚗 AVAILABLE CARS:",
+        "upsell": "💎 UPSELL RECOMMENDATIONS:",
+        "summary": "🗒 EARLIER IN THE CONVERSATION:",
+        "query": "Client request: ",
+        "fields": (
+            ("name", "Name", "Not specified"),
+            ("deal_status", "Status", "Not specified"),
+            ("previous_purchase", "Previous purchase", "None"),
+            ("budget", "Budget", "Not specified"),
+            ("preferences", "Preferences", "Not specified"),
+        ),
+    },
+}
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Обрезает текст по оценке токенов, стараясь не рвать слово"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens - 1) * Config.CHARS_PER_TOKEN
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def fit_lines(header, lines, max_tokens):
+    """Раздел из заголовка и строк в порядке важности; не влезающие в бюджет строки отбрасываются"""
+    if not lines:
+        return ""
+    used = estimate_tokens(header)
+    kept = [header]
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if used + tokens > max_tokens:
+            if len(kept) == 1:
+                # Даже первая строка не помещается - берем ее укороченной
+                kept.append(truncate_to_tokens(line, max_tokens - used))
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept)
+
+
+class SalesPromptTemplate:
+    """Скомпилированный шаблон промпта ИИ-продавца для одного языка.
+
+    Системное сообщение = статический префикс + разделы CRM, автомобилей и апсейла
+    в постоянном порядке; у каждого раздела свой бюджет токенов (PROMPT_SECTION_BUDGETS).
+    """
+
+    def __init__(self, language):
+        self.language = language
+        self.version = PROMPT_VERSION
+        self.prefix = _SALES_PREFIX[language].strip() + "\n\n"
+        self.prefix_tokens = estimate_tokens(self.prefix)
+        labels = _LABELS[language]
+        self._headers = {section: labels[section] for section in ("client", "products", "upsell", "summary")}
+        self._query_label = labels["query"]
+        # Подписи полей CRM разбираются один раз: (поле, "• Подпись: ", значение по умолчанию)
+        self._fields = tuple((field, f"• {title}: ", default) for field, title, default in labels["fields"])
+        self.budgets = Config.PROMPT_SECTION_BUDGETS
+
+    def _client_section(self, client_info):
+        field_budget = max(1, self.budgets["client"] // len(self._fields))
+        lines = []
+        for field, label, default in self._fields:
+            value = client_info.get(field)
+            value = default if value is None or value == "" else str(value)
+            lines.append(label + truncate_to_tokens(value, field_budget))
+        return fit_lines(self._headers["client"], lines, self.budgets["client"])
+
+    def _history_messages(self, history):
+        """Последние реплики диалога в бюджете "history": с конца, пока помещаются"""
+        budget = self.budgets["history"]
+        messages = []
+        for role, content in reversed(history):
+            if budget <= 0:
+                break
+            content = truncate_to_tokens(content, budget)
+            budget -= estimate_tokens(content)
+            messages.append({"role": role, "content": content})
+        # Диалог должен начинаться с реплики клиента
+        while messages and messages[-1]["role"] != "user":
+            messages.pop()
+        return messages[::-1]
+
+    def render_system(self, client_info, products, upsells, summary=""):
+        sections = [
+            self._client_section(client_info),
+            fit_lines(
+                self._headers["products"],
+                [f"• {p['name']}: ${p['price_usd']:,} - {p['description']}" for p in products],
+                self.budgets["products"],
+            ),
+            fit_lines(
+                self._headers["upsell"],
+                [f"• {rec['product']}: {rec['reason']}" for rec in upsells],
+                self.budgets["upsell"],
+            ),
+            fit_lines(self._headers["summary"], [summary] if summary else [], self.budgets["summary"]),
+        ]
+        return self.prefix + "\n\n".join(section for section in sections if section)
+
+    def render_messages(self, query, client_info, products, upsells, summary="", history=()):
+        """summary и history - память диалога: резюме идет последним разделом системного
+        сообщения (после статического префикса), реплики - между ним и текущим запросом"""
+        return [
+            {"role": "system", "content": self.render_system(client_info, products, upsells, summary)},
+            *self._history_messages(history),
+            {"role": "user", "content": self._query_label + truncate_to_tokens(query, self.budgets["query"])},
+        ]
+
+
+# Шаблоны компилируются один раз при импорте
+SALES_TEMPLATES = {language: SalesPromptTemplate(language) for language in _SALES_PREFIX}
+
+
+def sales_template(language):
+    return SALES_TEMPLATES.get(language) or SALES_TEMPLATES["en"]
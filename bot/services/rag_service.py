@@ -1,91 +1,227 @@
 import json
-import httpx
+import logging
+import threading
+import time
 from config import Config
+from bot.services.openrouter_gateway import openrouter_gateway
+from bot.services.crm_store import create_crm_store, import_clients_json
+from bot.services.product_index import ProductIndex
+from bot.services.response_cache import ResponseCache, make_context_key
+from bot.services.metrics import CACHE_LOOKUPS, registry, span
+from bot.services.prompt_templates import sales_template
+from bot.services.text_preprocessing import TextPreprocessor
+from bot.services.budget import price_bounds, with_budget_range
+from bot.services.upsell import UpsellEngine, purchase_history
+from bot.services.intent_router import INTENTS, IntentRouter, catalog_answer
+from bot.services.conversation_memory import ConversationMemory
+
+CATALOG_RELOADS = registry.counter(
+    "catalog_reloads_total", "Перезагрузки базы знаний и CRM (source: kb/crm, result: success/error)",
+    ["source", "result"])
+CATALOG_RELOAD_SECONDS = registry.histogram("catalog_reload_seconds", "Время пересборки снимка каталога")
+CATALOG_VERSION = registry.gauge(
+    "catalog_version", "Номер текущего снимка каталога в процессе (digest - хеш базы знаний)", ["digest"])
+
+
+class CatalogSnapshot:
+    """Индексы каталога и CRM одной версии. Снимок не меняется после сборки:
+    запрос берет его один раз и работает с согласованными данными"""
+
+    __slots__ = ("version", "digest", "products_kb", "product_index", "preprocessor", "upsell_engine")
+
+    def __init__(self, version, products_kb, product_index, preprocessor, upsell_engine):
+        self.version = version
+        self.digest = product_index.source_digest
+        self.products_kb = products_kb
+        self.product_index = product_index
+        self.preprocessor = preprocessor
+        self.upsell_engine = upsell_engine
+
+    def with_upsell(self, upsell_engine):
+        """Тот же снимок с другой таблицей апсейла"""
+        return CatalogSnapshot(self.version, self.products_kb, self.product_index, self.preprocessor, upsell_engine)
+
 
 class RAGService:
     def __init__(self):
-        self.clients = self._load_json(Config.CRM_FILE)
-        self.products_kb = self._load_json(Config.KB_FILE)
+        # CRM открывается лениво при первом запросе
+        self.crm = create_crm_store()
+        self._reload_lock = threading.Lock()
+        # История покупок всех клиентов для апсейла; до первого расчета - только правила и ступени цены
+        self._purchase_history = None
+        self.snapshot = self._build_snapshot(self._load_json(Config.KB_FILE), version=1)
+        self.response_cache = ResponseCache(embedder=self.product_index.embedder)
+        self.intent_router = IntentRouter()
+        # История диалога с каждым пользователем: последние реплики + резюме
+        self.memory = ConversationMemory()
+        CATALOG_VERSION.set_function(lambda: {((self.snapshot.digest or "")[:12],): self.snapshot.version})
+
+    # Данные текущего снимка
+    @property
+    def products_kb(self):
+        return self.snapshot.products_kb
+
+    @property
+    def product_index(self):
+        return self.snapshot.product_index
+
+    @property
+    def preprocessor(self):
+        return self.snapshot.preprocessor
+
+    @property
+    def upsell_engine(self):
+        return self.snapshot.upsell_engine
     
     def _load_json(self, file_path):
         with open(file_path, 'r', encoding='utf-8') as f:
             return json.load(f)
 
+    def _build_snapshot(self, products_kb, version):
+        products = products_kb['products']
+        product_index = ProductIndex.load_or_build(products, Config.KB_FILE)
+        return CatalogSnapshot(
+            version,
+            products_kb,
+            product_index,
+            TextPreprocessor(products),
+            # История покупок посчитана заранее (_refresh_upsell) - здесь CRM не читается
+            UpsellEngine(products, products_kb.get('upsell_options', []), self._purchase_history),
+        )
+
+    def start(self):
+        """Фоновые расчеты после старта бота: история покупок для апсейла.
+
+        Не в __init__: при импорте потоков быть не должно - пул распознавания речи
+        создается через fork при старте бота.
+        """
+        self._refresh_upsell()
+
+    def _refresh_upsell(self):
+        """Пересчитывает историю покупок по всей CRM в фоновом потоке и подменяет таблицу апсейла.
+
+        Полный проход по CRM не задерживает старт бота и перезагрузку каталога: до окончания
+        расчета апсейл работает по правилам базы знаний и ступеням цены.
+        """
+        def run():
+            started = time.monotonic()
+            try:
+                history = purchase_history(self.crm.iter_clients())
+                with self._reload_lock:
+                    self._purchase_history = history
+                    current = self.snapshot
+                    self.snapshot = current.with_upsell(UpsellEngine(
+                        current.products_kb['products'], current.products_kb.get('upsell_options', []), history
+                    ))
+            except Exception as e:
+                logging.error(f"Не удалось посчитать историю покупок для апсейла: {e}")
+                return
+            logging.info("Апсейл: история покупок %d записей, %.2fс", len(history), time.monotonic() - started)
+
+        threading.Thread(target=run, name="upsell-history", daemon=True).start()
+
+    def reload(self, changed_paths=()):
+        """Перечитывает измененные базу знаний и выгрузку CRM, пересобирает индексы и подменяет снимок.
+
+        Вызывается в рабочем потоке (FileWatcher): запросы до подмены обслуживает старый снимок,
+        после - новый. Выгрузка CRM импортируется в хранилище (новые и измененные клиенты);
+        если изменилась только она, индексы каталога не пересобираются - в фоне обновляется
+        только таблица апсейла. При ошибке остается прежний снимок.
+        """
+        changed = set(changed_paths)
+        kb_changed = Config.KB_FILE in changed or not changed
+        crm_changed = Config.CRM_FILE in changed
+        source = "kb" if kb_changed else "crm"
+        with self._reload_lock:
+            started = time.monotonic()
+            current = self.snapshot
+            try:
+                if crm_changed:
+                    count = import_clients_json(self.crm, Config.CRM_FILE)
+                    logging.info("CRM: импортировано %d клиентов из %s", count, Config.CRM_FILE)
+                snapshot = current
+                if kb_changed:
+                    snapshot = self._build_snapshot(self._load_json(Config.KB_FILE), current.version + 1)
+            except Exception:
+                CATALOG_RELOADS.inc(source=source, result="error")
+                raise
+            # Одно присваивание атрибута: читатели видят либо старый, либо новый снимок целиком
+            self.snapshot = snapshot
+        if crm_changed:
+            # История покупок изменилась - пересчитываем в фоне, пока работает прежняя таблица
+            self._refresh_upsell()
+        elapsed = time.monotonic() - started
+        CATALOG_RELOAD_SECONDS.observe(elapsed)
+        CATALOG_RELOADS.inc(source=source, result="success")
+        if kb_changed:
+            logging.info(
+                "Каталог обновлен: версия %d (%s), продуктов %d, %.2fс",
+                snapshot.version, (snapshot.digest or "")[:12], len(snapshot.products_kb['products']), elapsed
+            )
+        return snapshot
+
     def get_client_info(self, telegram_user_id):
         """Получает полную информацию о клиенте из CRM"""
-        for client in self.clients:
-            if client["telegram_user_id"] == telegram_user_id:
-                return client
-        return None
+        return self.crm.get_by_telegram_id(telegram_user_id)
+
+    def preprocess(self, query, user_language_code=None, snapshot=None):
+        """Язык, токены и сущности запроса - один раз на сообщение.
 
-    def _detect_language(self, query, user_language_code=None):
-        """Определяет язык запроса"""
+        Язык берется из настроек Telegram, если это ru/en, иначе определяется по тексту.
+        """
+        snapshot = snapshot or self.snapshot
+        language = None
         if user_language_code and user_language_code.startswith('ru'):
-            return 'ru'
+            language = 'ru'
         elif user_language_code and user_language_code.startswith('en'):
-            return 'en'
-        
-        russian_chars = sum(1 for char in query if 'а' <= char.lower() <= 'я' or char in 'ёЁ')
-        english_chars = sum(1 for char in query if 'a' <= char.lower() <= 'z')
-        
-        return 'ru' if russian_chars > english_chars else 'en'
+            language = 'en'
+        return snapshot.preprocessor.preprocess(query, language)
 
-    def _find_relevant_products(self, query, client_budget=None):
-        """Находит релевантные продукты с учетом бюджета клиента"""
-        relevant_products = []
-        query_lower = query.lower()
-        
-        # Извлекаем бюджет клиента для фильтрации
-        max_budget = None
-        if client_budget:
-            try:
-                # Извлекаем числа из строки бюджета
-                import re
-                numbers = re.findall(r'\d+', str(client_budget))
-                if numbers:
-                    max_budget = int(numbers[0]) * 1000 if 'k' in client_budget.lower() else int(numbers[0])
-            except:
-                pass
-        
-        for product in self.products_kb['products']:
-            # Проверяем релевантность по названию/бренду
-            is_relevant = any(word in query_lower for word in [
-                product['name'].lower(), 'bentley', 'rolls-royce', 'роллс', 'бентли',
-                'автомобиль', 'машина', 'car', 'luxury'
-            ])
-            
-            # Фильтруем по бюджету если указан
-            if is_relevant:
-                if max_budget is None or product['price_usd'] <= max_budget * 1.2:  # +20% гибкости
-                    relevant_products.append(product)
-        
-        return relevant_products[:3]  # Максимум 3 продукта
+    def quick_answer(self, query, user_language_code=None, user_id=None):
+        """Ответ из каталога без LLM на вопрос о цене, наличии или составе каталога; None - нужен LLM"""
+        snapshot = self.snapshot
+        text = self.preprocess(query, user_language_code, snapshot)
+        intent, _ = self.intent_router.classify(text.tokens, snapshot.preprocessor.vocabulary)
+        answer = None
+        if intent != "open":
+            answer = catalog_answer(intent, text, snapshot.products_kb['products'])
+        INTENTS.inc(intent=intent, route="fast" if answer is not None else "llm")
+        if answer is not None:
+            self.memory.append(user_id, query, answer, text.language)
+        return answer
 
-    def _get_upsell_recommendations(self, client_info, query):
-        """Генерирует рекомендации по апсейлу на основе истории клиента"""
-        if not client_info or not client_info.get('previous_purchase'):
-            return []
-        
-        upsell_options = []
-        previous_car = client_info['previous_purchase'].lower()
-        
-        # Логика апсейла на основе предыдущих покупок
-        if 'bentley' in previous_car and 'continental' in previous_car:
-            upsell_options.append({
-                'product': 'Rolls-Royce Phantom',
-                'reason': 'Следующий уровень роскоши после Bentley Continental'
-            })
-        elif 'ghost' in previous_car:
-            upsell_options.append({
-                'product': 'Rolls-Royce Cullinan',
-                'reason': 'Универсальность SUV с той же роскошью'
-            })
-        
-        return upsell_options
+    def _find_relevant_products(self, text, client_info, product_index):
+        """Находит релевантные продукты с учетом бюджета: названного в запросе, иначе из CRM"""
+        budget = text.budget
+        if budget is None:
+            budget_range = with_budget_range(client_info)["budget_range"]
+            budget = tuple(budget_range) if budget_range else None
+        # Диапазон цен с допуском BUDGET_TOLERANCE - запрос к отсортированному индексу цен
+        min_price, max_price = price_bounds(budget)
+        products = product_index.search(
+            text.text,
+            k=Config.RETRIEVAL_TOP_K,
+            min_price=min_price,
+            max_price=max_price
+        )
+        if not products and min_price is not None:
+            # В коридоре бюджета ничего нет - предлагаем лучшее из того, что дешевле
+            products = product_index.search(text.text, k=Config.RETRIEVAL_TOP_K, max_price=max_price)
+        return products
 
-    async def get_ai_suggestion(self, query, client_info, user_language_code=None):
-        """Генерирует персонализированный ответ ИИ-продавца с учетом CRM данных"""
-        language = self._detect_language(query, user_language_code)
+    def _get_upsell_recommendations(self, client_info, upsell_engine):
+        """Рекомендации по апсейлу на основе истории клиента - поиск по заранее посчитанной таблице"""
+        return upsell_engine.recommend(client_info)
+
+    def _build_request(self, text, client_info, snapshot=None, user_id=None):
+        """Собирает запрос к LLM для персонализированного ответа с учетом CRM данных и истории диалога.
+
+        text - результат preprocess(). Возвращает payload и ключ контекста для кэша ответов;
+        None - кэш не используется: ответ посреди разговора зависит от истории, и такой ответ
+        не подходит другим клиентам.
+        """
+        snapshot = snapshot or self.snapshot
+        query, language = text.text, text.language
         
         # Если клиент не найден в CRM, создаем базовую запись
         if not client_info:
@@ -98,94 +234,78 @@ class RAGService:
             }
         
         # Находим релевантные продукты с учетом бюджета
-        relevant_products = self._find_relevant_products(query, client_info.get('budget'))
+        with span("retrieval"):
+            relevant_products = self._find_relevant_products(text, client_info, snapshot.product_index)
         
         # Получаем рекомендации по апсейлу
-        upsell_recommendations = self._get_upsell_recommendations(client_info, query)
-        
-        # Формируем контекст для ИИ
-        context_parts = []
-        
-        if relevant_products:
-            context_parts.append("🚗 ДОСТУПНЫЕ АВТОМОБИЛИ:")
-            for product in relevant_products:
-                context_parts.append(f"• {product['name']}: ${product['price_usd']:,} - {product['description']}")
+        upsell_recommendations = self._get_upsell_recommendations(client_info, snapshot.upsell_engine)
         
-        if upsell_recommendations:
-            context_parts.append("\n💎 РЕКОМЕНДАЦИИ ПО АПСЕЙЛУ:")
-            for rec in upsell_recommendations:
-                context_parts.append(f"• {rec['product']}: {rec['reason']}")
+        # Статический префикс шаблона + разделы клиента/автомобилей/апсейла в постоянном порядке
+        template = sales_template(language)
         
-        context = "\n".join(context_parts)
+        # Память диалога ограничена бюджетом токенов - промпт не растет с каждой репликой
+        summary, history = self.memory.context(user_id)
         
-        # Системный промпт в зависимости от языка
-        if language == 'ru':
-            system_prompt = f"""
-Ты - элитный ИИ-продавец премиальных автомобилей. Твоя задача - дать персонализированный ответ клиенту.
-
-КРИТИЧЕСКИ ВАЖНО - ОБЯЗАТЕЛЬНО ИСПОЛЬЗУЙ ВСЮ ИНФОРМАЦИЮ О КЛИЕНТЕ:
-
-📋 ДАННЫЕ КЛИЕНТА ИЗ CRM:
-• Имя: {client_info.get('name', 'Не указано')}
-• Статус: {client_info.get('deal_status', 'Не указан')}
-• Предыдущая покупка: {client_info.get('previous_purchase', 'Нет')}
-• Бюджет: {client_info.get('budget', 'Не указан')}
-• Предпочтения: {client_info.get('preferences', 'Не указаны')}
-
-{context}
-
-ПРАВИЛА ОТВЕТА:
-1. ОБЯЗАТЕЛЬНО обратись к клиенту по имени
-2. ОБЯЗАТЕЛЬНО упомяни его статус/предыдущие покупки
-3. Учти его бюджет при рекомендациях
-4. Предложи конкретный автомобиль из доступных
-5. Если есть апсейл - обоснуй его
-6. Ответ максимум 4 предложения
-7. Закончи призывом к действию
-
-Пример: "Аркадий, как наш VIP клиент с опытом владения Bentley Continental GT, рекомендую вам..."
-"""
-        else:
-            system_prompt = f"""
-You are an elite AI sales consultant for premium automobiles. Provide personalized response to the client.
-
-CRITICALLY IMPORTANT - MUST USE ALL CLIENT INFORMATION:
-
-📋 CLIENT CRM DATA:
-• Name: {client_info.get('name', 'Not specified')}
-• Status: {client_info.get('deal_status', 'Not specified')}
-• Previous purchase: {client_info.get('previous_purchase', 'None')}
-• Budget: {client_info.get('budget', 'Not specified')}
-• Preferences: {client_info.get('preferences', 'Not specified')}
-
-{context}
-
-RESPONSE RULES:
-1. MUST address client by name
-2. MUST mention their status/previous purchases
-3. Consider their budget in recommendations
-4. Suggest specific car from available options
-5. If upsell available - justify it
-6. Maximum 4 sentences
-7. End with call to action
-
-Example: "Arkady, as our VIP client with Bentley Continental GT experience, I recommend..."
-"""
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=Config.OPENROUTER_HEADERS,
-                json={
-                    "model": Config.FREE_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Запрос клиента: {query}"},
-                    ],
-                    "max_tokens": 400,
-                    "temperature": 0.7
-                },
-                timeout=30
-            )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        payload = {
+            "messages": template.render_messages(
+                query, client_info, relevant_products, upsell_recommendations, summary, history
+            ),
+            "max_tokens": 400,
+            "temperature": 0.7
+        }
+        if summary or history:
+            return payload, None
+        return payload, make_context_key(
+            language, relevant_products, client_info, template.version, snapshot.digest
+        )
+
+    def _cache_get(self, query, context_key, normalized):
+        if context_key is None:
+            CACHE_LOOKUPS.inc(result="bypass")
+            return None
+        return self.response_cache.get(query, context_key, normalized)
+
+    async def get_ai_suggestion(self, query, client_info, user_language_code=None, user_id=None):
+        """Генерирует персонализированный ответ ИИ-продавца с учетом CRM данных"""
+        with span("prompt_build"):
+            # Один снимок каталога на весь запрос, даже если он подменится во время обработки
+            snapshot = self.snapshot
+            text = self.preprocess(query, user_language_code, snapshot)
+            payload, context_key = self._build_request(text, client_info, snapshot, user_id)
+        with span("cache_lookup"):
+            cached = self._cache_get(query, context_key, text.normalized)
+        if cached is not None:
+            self.memory.append(user_id, query, cached, text.language)
+            return cached
+
+        data = await openrouter_gateway.complete("sales", payload, user_id=user_id)
+        suggestion = data["choices"][0]["message"]["content"]
+        if context_key is not None:
+            self.response_cache.set(query, context_key, suggestion, text.normalized)
+        self.memory.append(user_id, query, suggestion, text.language)
+        return suggestion
+
+    async def stream_ai_suggestion(self, query, client_info, user_language_code=None, user_id=None):
+        """Потоковая версия get_ai_suggestion: отдает фрагменты ответа по мере генерации"""
+        with span("prompt_build"):
+            # Один снимок каталога на весь запрос, даже если он подменится во время обработки
+            snapshot = self.snapshot
+            text = self.preprocess(query, user_language_code, snapshot)
+            payload, context_key = self._build_request(text, client_info, snapshot, user_id)
+        with span("cache_lookup"):
+            cached = self._cache_get(query, context_key, text.normalized)
+        if cached is not None:
+            self.memory.append(user_id, query, cached, text.language)
+            yield cached
+            return
+
+        parts = []
+        async for delta in openrouter_gateway.stream("sales", payload, user_id=user_id):
+            parts.append(delta)
+            yield delta
+        # В кэш и историю диалога попадает только полностью полученный ответ
+        if parts:
+            suggestion = "".join(parts)
+            if context_key is not None:
+                self.response_cache.set(query, context_key, suggestion, text.normalized)
+            self.memory.append(user_id, query, suggestion, text.language)
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from bot.services.embeddings import HashingEmbedder
+from bot.services.metrics import CACHE_LOOKUPS
+
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+# Поля CRM, которые попадают в промпт и поэтому влияют на ответ
+CACHE_CLIENT_FIELDS = ("name", "deal_status", "previous_purchase", "budget", "preferences")
+
+
+def normalize_query(query):
+    """Нижний регистр, без пунктуации и лишних пробелов"""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", query.lower())).strip()
+
+
+def make_context_key(language, products, client_info, prompt_version=None, catalog_version=None):
+    """Ключ контекста: язык, версия шаблона промпта, версия каталога, набор найденных продуктов
+    и поля клиента из промпта"""
+    context = {
+        "language": language,
+        "prompt_version": prompt_version,
+        "catalog_version": catalog_version,
+        "products": sorted(p["name"] for p in products),
+        "client": {field: (client_info or {}).get(field) for field in CACHE_CLIENT_FIELDS},
+    }
+    raw = json.dumps(context, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Кэш ответов LLM: точное совпадение нормализованного запроса или близкий запрос
+    (косинус эмбеддингов) в том же контексте. Два уровня: LRU в памяти и SQLite на диске.
+    """
+
+    def __init__(self, embedder=None, db_path=None):
+        self.embedder = embedder or HashingEmbedder()
+        self.ttl = Config.RESPONSE_CACHE_TTL
+        self.max_entries = Config.RESPONSE_CACHE_MAX_ENTRIES
+        self.similarity = Config.RESPONSE_CACHE_SIMILARITY
+        self.db_path = db_path if db_path is not None else Config.RESPONSE_CACHE_DB
+        self._memory = OrderedDict()   # key -> (response, expires_at, context_key, vector)
+        self._by_context = {}          # context_key -> {key: vector}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._sets_since_evict = 0
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @property
+    def conn(self):
+        if self._conn is None and self.db_path:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    context_key TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_context ON responses (context_key);
+            """)
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _key(normalized, context_key):
+        return hashlib.sha256(f"{context_key}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, query, context_key, normalized=None):
+        """normalized - уже нормализованный запрос, если он посчитан при предобработке"""
+        normalized = normalized if normalized is not None else normalize_query(query)
+        key = self._key(normalized, context_key)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                CACHE_LOOKUPS.inc(result="exact")
+                return entry[0]
+
+            vector = self.embedder.embed([normalized])[0].astype(np.float32)
+            response = self._semantic_lookup(vector, context_key, now)
+            if response is not None:
+                self.stats["semantic_hits"] += 1
+                CACHE_LOOKUPS.inc(result="semantic")
+                return response
+
+            response = self._disk_lookup(key, vector, context_key, now)
+            if response is not None:
+                self.stats["disk_hits"] += 1
+                CACHE_LOOKUPS.inc(result="disk")
+                return response
+
+            self.stats["misses"] += 1
+            CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+    def set(self, query, context_key, response, normalized=None):
+        normalized = normalized if normalized is not None else normalize_query(query)
+        key = self._key(normalized, context_key)
+        vector = self.embedder.embed([normalized])[0].astype(np.float32)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, response, expires_at, context_key, vector)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, context_key, response, vector.tobytes(), expires_at, time.time())
+                )
+                self.conn.commit()
+                self._sets_since_evict += 1
+                if self._sets_since_evict >= 100:
+                    self._evict_disk()
+
+    def _remember(self, key, response, expires_at, context_key, vector):
+        self._memory[key] = (response, expires_at, context_key, vector)
+        self._memory.move_to_end(key)
+        self._by_context.setdefault(context_key, {})[key] = vector
+        while len(self._memory) > self.max_entries:
+            old_key, (_, _, old_context, _) = self._memory.popitem(last=False)
+            vectors = self._by_context.get(old_context)
+            if vectors is not None:
+                vectors.pop(old_key, None)
+                if not vectors:
+                    del self._by_context[old_context]
+
+    def _semantic_lookup(self, vector, context_key, now):
+        candidates = self._by_context.get(context_key)
+        if not candidates:
+            return None
+        keys = list(candidates)
+        scores = np.stack([candidates[k] for k in keys]) @ vector
+        for i in np.argsort(-scores):
+            if scores[i] < self.similarity:
+                break
+            entry = self._memory.get(keys[i])
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(keys[i])
+                return entry[0]
+        return None
+
+    def _disk_lookup(self, key, vector, context_key, now):
+        if self.conn is None:
+            return None
+        rows = self.conn.execute(
+            "SELECT key, response, vector, expires_at FROM responses "
+            "WHERE context_key = ? AND expires_at > ? ORDER BY accessed_at DESC LIMIT 200",
+            (context_key, now)
+        ).fetchall()
+        best = None
+        for row_key, response, blob, expires_at in rows:
+            row_vector = np.frombuffer(blob, dtype=np.float32)
+            if row_vector.shape != vector.shape:
+                continue
+            score = 1.0 if row_key == key else float(row_vector @ vector)
+            if score >= self.similarity and (best is None or score > best[0]):
+                best = (score, row_key, response, row_vector, expires_at)
+        if best is None:
+            return None
+        _, row_key, response, row_vector, expires_at = best
+        # Поднимаем запись в память, чтобы следующий запрос обошелся без диска
+        self._remember(row_key, response, expires_at, context_key, row_vector)
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, row_key))
+        self.conn.commit()
+        return response
+
+    def _evict_disk(self):
+        """Удаляет просроченные записи и самые старые по обращению сверх лимита"""
+        self._sets_since_evict = 0
+        self.conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self.conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (Config.RESPONSE_CACHE_DISK_MAX_ENTRIES,)
+        )
+        self.conn.commit()
+
+    def log_stats(self):
+        total = sum(self.stats.values())
+        hits = total - self.stats["misses"]
+        logging.info("Кэш ответов: %d/%d попаданий %s", hits, total, self.stats)
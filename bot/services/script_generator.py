@@ -1,10 +1,60 @@
-import httpx
+import asyncio
+import logging
+import numpy as np
 from config import Config
+from bot.services.openrouter_gateway import openrouter_gateway
+from bot.services.call_analyzer import chunk_transcript
+from bot.services.embeddings import HashingEmbedder
+from bot.services.tokens import estimate_tokens
 import json
 
+# Этапы скрипта, по которым размечаются фразы из звонков
+STAGES = {
+    "greeting": "Приветствие и установление контакта",
+    "needs_discovery": "Выявление потребностей",
+    "presentation": "Презентация решения",
+    "objections": "Работа с возражениями",
+    "closing": "Закрытие сделки",
+}
+
+
+def cluster_phrases(phrases, threshold=None, embedder=None):
+    """Группирует близкие по смыслу фразы; возвращает [(представитель, размер кластера)] по убыванию размера.
+
+    Матрица попарной косинусной близости считается одним matmul, кластеры строятся
+    жадно: фраза-лидер забирает все еще не распределенные фразы ближе порога.
+    Представитель кластера - фраза с наибольшей средней близостью к остальным.
+    """
+    if not phrases:
+        return []
+    threshold = Config.SCRIPT_PHRASE_SIMILARITY if threshold is None else threshold
+    embedder = embedder or HashingEmbedder()
+    vectors = embedder.embed(phrases)
+    similarity = vectors @ vectors.T
+
+    unassigned = np.ones(len(phrases), dtype=bool)
+    clusters = []
+    for leader in range(len(phrases)):
+        if not unassigned[leader]:
+            continue
+        members = np.flatnonzero(unassigned & (similarity[leader] >= threshold))
+        unassigned[members] = False
+        centrality = similarity[np.ix_(members, members)].mean(axis=1)
+        clusters.append((phrases[members[np.argmax(centrality)]], len(members)))
+    clusters.sort(key=lambda cluster: -cluster[1])
+    return clusters
+
+
 class ScriptGenerator:
+    # Версия промптов: при изменении промптов сохраненные скрипты считаются устаревшими
+    PROMPT_VERSION = "1"
+
     async def generate(self, successful_calls_texts: list):
         examples = "\n\n---\n\n".join(successful_calls_texts)
+        if estimate_tokens(examples) > Config.SCRIPT_DIRECT_MAX_TOKENS:
+            # Звонков слишком много для одного промпта - строим скрипт по выжимке фраз
+            stage_phrases = await self.extract_stage_phrases(successful_calls_texts)
+            return await self._synthesize(stage_phrases, len(successful_calls_texts))
         system_prompt = f"""
         Ты - методолог по продажам. Твоя задача - создать универсальный шаблон скрипта продаж на основе нескольких успешных звонков.
 
@@ -24,18 +74,152 @@ class ScriptGenerator:
 
         Ответ дай в формате Markdown.
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=Config.OPENROUTER_HEADERS,
-                json={
-                    "model": Config.ADVANCED_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": "Создай шаблон скрипта на основе предоставленных примеров."},
-                    ],
-                },
-                timeout=90
-            )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        data = await openrouter_gateway.complete(
+            "script",
+            {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": "Создай шаблон скрипта на основе предоставленных примеров."},
+                ],
+            }
+        )
+        return data["choices"][0]["message"]["content"]
+
+    async def update(self, current_script: str, new_calls_texts: list):
+        """Дополняет готовый скрипт лучшими фразами из новых успешных звонков"""
+        examples = "\n\n---\n\n".join(new_calls_texts)
+        if estimate_tokens(examples + current_script) > Config.SCRIPT_DIRECT_MAX_TOKENS:
+            # Вместо полных текстов новых звонков - выжимка лучших фраз по этапам
+            examples = self._format_stage_phrases(await self.extract_stage_phrases(new_calls_texts))
+        system_prompt = f"""
+        Ты - методолог по продажам. У тебя есть действующий шаблон скрипта продаж и несколько новых успешных звонков.
+
+        ДЕЙСТВУЮЩИЙ СКРИПТ:
+        {current_script}
+
+        НОВЫЕ УСПЕШНЫЕ ЗВОНКИ:
+        {examples}
+
+        ЗАДАЧА:
+        1. Выдели из новых звонков фразы и приемы, которых нет в скрипте и которые сработали лучше существующих.
+        2. Встрой их в соответствующие этапы скрипта, сохранив его структуру.
+        3. Не удаляй из скрипта работающие фразы без причины.
+
+        Верни полный обновленный скрипт в формате Markdown.
+        """
+        data = await openrouter_gateway.complete(
+            "script",
+            {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": "Обнови шаблон скрипта с учетом новых звонков."},
+                ],
+            }
+        )
+        return data["choices"][0]["message"]["content"]
+
+    async def extract_stage_phrases(self, calls_texts: list):
+        """Фразы по этапам из всех звонков: извлечение параллельно, затем локальная дедупликация"""
+        semaphore = asyncio.Semaphore(Config.SCRIPT_EXTRACT_PARALLEL)
+
+        async def extract(chunk):
+            async with semaphore:
+                try:
+                    return await self._extract_chunk(chunk)
+                except Exception as e:
+                    # Один неудачный звонок не должен ломать весь скрипт
+                    logging.error(f"Не удалось извлечь фразы из фрагмента звонка: {e}")
+                    return None
+
+        chunks = [chunk for text in calls_texts for chunk in chunk_transcript(text)]
+        extracted = [result for result in await asyncio.gather(*(extract(chunk) for chunk in chunks))
+                     if result is not None]
+        if chunks and not extracted:
+            # Скрипт по пустой выжимке сохранился бы в ScriptStore как готовый
+            raise RuntimeError(f"Не удалось извлечь фразы ни из одного из {len(chunks)} фрагментов звонков")
+
+        phrases = {stage: [] for stage in STAGES}
+        for result in extracted:
+            for stage in STAGES:
+                values = result.get(stage) or []
+                phrases[stage].extend(p.strip() for p in values if isinstance(p, str) and p.strip())
+
+        # Кластеризация - на CPU, вне event loop
+        return await asyncio.to_thread(
+            lambda: {
+                stage: cluster_phrases(stage_list)[:Config.SCRIPT_TOP_PHRASES]
+                for stage, stage_list in phrases.items()
+            }
+        )
+
+    async def _extract_chunk(self, chunk):
+        system_prompt = """
+        Ты - методолог по продажам. Выпиши из фрагмента успешного звонка дословные фразы менеджера,
+        которые лучше всего сработали, и распредели их по этапам продажи.
+
+        Ответ дай СТРОГО в формате JSON:
+        {
+            "greeting": ["фразы приветствия и установления контакта"],
+            "needs_discovery": ["квалифицирующие вопросы"],
+            "presentation": ["фразы презентации"],
+            "objections": ["ответы на возражения"],
+            "closing": ["фразы закрытия и следующего шага"]
+        }
+        Если этапа во фрагменте нет - верни пустой список.
+        """
+        data = await openrouter_gateway.complete(
+            "script",
+            {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": chunk},
+                ],
+                "response_format": {"type": "json_object"}
+            }
+        )
+        result = json.loads(data["choices"][0]["message"]["content"])
+        if not isinstance(result, dict):
+            raise ValueError(f"ожидался JSON-объект, получен {type(result).__name__}")
+        return result
+
+    @staticmethod
+    def _format_stage_phrases(stage_phrases):
+        lines = []
+        for stage, title in STAGES.items():
+            lines.append(f"{title}:")
+            for phrase, count in stage_phrases.get(stage, []):
+                lines.append(f"- {phrase} (встречается {count} раз)")
+        return "\n".join(lines)
+
+    async def _synthesize(self, stage_phrases, calls_count):
+        phrases = self._format_stage_phrases(stage_phrases)
+        system_prompt = f"""
+        Ты - методолог по продажам. Твоя задача - создать универсальный шаблон скрипта продаж.
+        Из {calls_count} успешных звонков уже выделены самые частые работающие фразы по этапам
+        (в скобках - сколько раз похожая фраза встречалась).
+
+        ЛУЧШИЕ ФРАЗЫ ИЗ УСПЕШНЫХ ЗВОНКОВ:
+        {phrases}
+
+        ЗАДАЧА:
+        1. Создай универсальный шаблон скрипта, разбитый на этапы:
+           - Приветствие и установление контакта
+           - Выявление потребностей (квалифицирующие вопросы)
+           - Презентация решения
+           - Работа с возражениями (предложи 2-3 варианта)
+           - Закрытие сделки (предложение следующего шага)
+        2. В каждом этапе используй приведенные фразы, в первую очередь самые частые.
+        3. Кратко объясни логику структуры: почему именно такие этапы и триггеры эффективны.
+
+        Ответ дай в формате Markdown.
+        """
+        data = await openrouter_gateway.complete(
+            "script",
+            {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": "Создай шаблон скрипта на основе выделенных фраз."},
+                ],
+            }
+        )
+        return data["choices"][0]["message"]["content"]
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from config import Config
+
+
+class ScriptStore:
+    """Хранилище сгенерированных скриптов продаж.
+
+    Скрипт сохраняется под отпечатком набора исходных звонков и версии промптов
+    и отдается мгновенно при повторных запросах. Если появились новые успешные
+    звонки, сразу отдается последний скрипт, а в фоне он дополняется только
+    новыми звонками.
+    """
+
+    def __init__(self, generator, calls_dir=None, store_dir=None):
+        self.generator = generator
+        self.calls_dir = calls_dir or Config.CALLS_DIR
+        self.store_dir = store_dir or Config.SCRIPTS_DIR
+        self._file_hashes = {}   # path -> (mtime_ns, size, digest)
+        self._artifacts = {}     # fingerprint -> артефакт (кэш чтения с диска)
+        self._generation = None  # текущая полная генерация (общая для всех ожидающих)
+        self._update_task = None
+        self._sources = None     # (monotonic, calls) - последний скан звонков-источников
+        self._update_failures = 0
+        self._update_retry_at = 0.0
+
+    def _source_calls(self):
+        """Успешные звонки: {digest: path}; файлы перечитываются только при изменении"""
+        calls = {}
+        for path in sorted(self.calls_dir.rglob(Config.SUCCESSFUL_CALLS_GLOB)):
+            stat = path.stat()
+            cached = self._file_hashes.get(path)
+            if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+                digest = hashlib.sha256(path.read_bytes()).hexdigest()
+                cached = self._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+            calls[cached[2]] = path
+        return calls
+
+    async def _current_calls(self):
+        """Звонки-источники; скан каталога (rglob + stat) идет вне event loop и не чаще SCRIPT_SOURCES_TTL"""
+        now = time.monotonic()
+        if self._sources is not None and now - self._sources[0] < Config.SCRIPT_SOURCES_TTL:
+            return self._sources[1]
+        calls = await asyncio.to_thread(self._source_calls)
+        self._sources = (now, calls)
+        return calls
+
+    def _fingerprint(self, call_hashes):
+        raw = self.generator.PROMPT_VERSION + "\n" + "\n".join(sorted(call_hashes))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load(self, name):
+        if name in self._artifacts:
+            return self._artifacts[name]
+        path = self.store_dir / f"{name}.json"
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            artifact = json.load(f)
+        self._artifacts[name] = artifact
+        return artifact
+
+    def _save(self, fingerprint, call_hashes, script):
+        artifact = {
+            "fingerprint": fingerprint,
+            "prompt_version": self.generator.PROMPT_VERSION,
+            "call_hashes": sorted(call_hashes),
+            "script": script,
+            "created_at": time.time(),
+        }
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        for name in (fingerprint, "latest"):
+            # Пишем во временный файл и переименовываем, чтобы не оставить битый JSON
+            tmp_path = self.store_dir / f"{name}.json.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(artifact, f, ensure_ascii=False)
+            tmp_path.replace(self.store_dir / f"{name}.json")
+        self._artifacts[fingerprint] = self._artifacts["latest"] = artifact
+        return artifact
+
+    async def get_cached(self):
+        """Скрипт без ожидания генерации или None, если подходящего скрипта еще нет"""
+        calls = await self._current_calls()
+        exact = self._load(self._fingerprint(calls))
+        if exact is not None:
+            return exact["script"]
+
+        latest = self._load("latest")
+        if latest is None or latest.get("prompt_version") != self.generator.PROMPT_VERSION:
+            return None
+        known = set(latest["call_hashes"])
+        if not known <= set(calls):
+            # Часть исходных звонков удалена/изменена - нужна полная перегенерация
+            return None
+        self._schedule_update(latest, calls)
+        return latest["script"]
+
+    async def get_or_generate(self):
+        """Скрипт из хранилища или полная генерация по всем успешным звонкам"""
+        script = await self.get_cached()
+        if script is not None:
+            return script
+        if self._generation is None or self._generation.done():
+            self._generation = asyncio.create_task(self._generate_full())
+        return await asyncio.shield(self._generation)
+
+    async def _generate_full(self):
+        calls = await asyncio.to_thread(self._source_calls)
+        self._sources = (time.monotonic(), calls)
+        texts = [path.read_text(encoding="utf-8") for path in calls.values()]
+        script = await self.generator.generate(texts)
+        self._save(self._fingerprint(calls), calls, script)
+        return script
+
+    def _schedule_update(self, latest, calls):
+        if self._update_task is not None and not self._update_task.done():
+            return
+        if time.monotonic() < self._update_retry_at:
+            # Прошлое дополнение завершилось ошибкой - платный запрос не повторяем на каждый вызов
+            return
+        new_hashes = [digest for digest in calls if digest not in set(latest["call_hashes"])]
+        self._update_task = asyncio.create_task(self._update_incremental(latest, calls, new_hashes))
+
+    async def _update_incremental(self, latest, calls, new_hashes):
+        try:
+            texts = [calls[digest].read_text(encoding="utf-8") for digest in new_hashes]
+            script = await self.generator.update(latest["script"], texts)
+            self._save(self._fingerprint(calls), calls, script)
+            self._update_failures = 0
+            logging.info("Скрипт продаж дополнен новыми звонками: %d", len(new_hashes))
+        except Exception as e:
+            delay = min(Config.SCRIPT_UPDATE_BACKOFF * 2 ** self._update_failures, Config.SCRIPT_UPDATE_BACKOFF_MAX)
+            self._update_failures += 1
+            self._update_retry_at = time.monotonic() + delay
+            logging.error(f"Ошибка фонового обновления скрипта (повтор через {delay:.0f} с): {e}")
@@ -0,0 +1,42 @@
+import time
+from collections import OrderedDict
+from config import Config
+
+
+class TTLStateStore:
+    """Ограниченное по размеру хранилище состояний с истечением по TTL (LRU-вытеснение)"""
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or Config.USER_STATE_MAX_SIZE
+        self.ttl = ttl or Config.USER_STATE_TTL
+        self._data = OrderedDict()  # key -> (value, expires_at)
+
+    def __setitem__(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
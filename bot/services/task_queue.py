@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from config import Config
+from bot.services.metrics import registry
+
+TASK_JOBS = registry.counter(
+    "task_queue_jobs_total", "Фоновые задачи по исходу (enqueued/deduplicated/done/retry/failed)", ["kind", "outcome"])
+TASK_SECONDS = registry.histogram(
+    "task_queue_job_seconds", "Время выполнения фоновой задачи", ["kind"])
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class Job:
+    __slots__ = ("id", "kind", "chat_id", "user_id", "payload", "status", "attempts", "result", "has_result",
+                 "error", "created_at", "delivered")
+
+    def __init__(self, row):
+        (self.id, self.kind, self.chat_id, self.user_id, payload, self.status,
+         self.attempts, result, self.error, self.created_at, self.delivered) = row
+        self.payload = json.loads(payload)
+        # Результат сохраняется до отправки в чат: при повторе после ошибки доставки run не вызывается
+        self.has_result = result is not None
+        self.result = json.loads(result) if result is not None else None
+
+
+_JOB_COLUMNS = "id, kind, chat_id, user_id, payload, status, attempts, result, error, created_at, delivered"
+
+
+class TaskQueue:
+    """Надежная очередь фоновых задач (анализ звонков, генерация скриптов) в SQLite.
+
+    Обработчик ставит задачу и сразу отвечает пользователю; пул воркеров выполняет
+    задачи с ограниченной параллельностью и отправляет результат в чат. Задачи
+    переживают перезапуск: пока задача выполняется, воркер продлевает аренду, а задача
+    упавшего процесса через TASK_QUEUE_LEASE секунд снова становится доступной. Задача
+    завершается только после доставки результата в чат; уже отправленные части результата
+    отмечаются (mark_delivered), и повтор доставки продолжает с первой неотправленной. Одинаковая задача, уже ожидающая
+    выполнения, не дублируется. Базу могут одновременно использовать несколько процессов бота.
+
+    Обращения к SQLite идут в рабочем потоке (asyncio.to_thread): ожидание блокировки
+    базы другим процессом не останавливает event loop.
+    """
+
+    def __init__(self, db_path=None, workers=None):
+        self.db_path = db_path or Config.TASK_QUEUE_DB
+        self.workers_count = workers or Config.TASK_QUEUE_WORKERS
+        self._conn = None
+        self._lock = threading.Lock()
+        self._kinds = {}       # kind -> (run, deliver, fail)
+        self._workers = []
+        self._wakeup = None
+        self._bot = None
+        self._running = set()  # id задач, выполняемых этим процессом
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None - транзакции открываем явно (BEGIN IMMEDIATE при захвате задачи)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    dedup_key TEXT NOT NULL,
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    delivered INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    available_at REAL NOT NULL,
+                    lease_until REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+                CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, status);
+                CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, id);
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "delivered" not in columns:
+                # База, созданная до учета отправленных частей
+                conn.execute("ALTER TABLE jobs ADD COLUMN delivered INTEGER NOT NULL DEFAULT 0")
+            self._conn = conn
+        return self._conn
+
+    def register(self, kind, run, deliver, fail=None):
+        """run(job) -> результат (JSON); deliver(bot, job, result) и fail(bot, job, error) - ответ в чат"""
+        self._kinds[kind] = (run, deliver, fail)
+
+    @staticmethod
+    def dedup_key(kind, chat_id, payload):
+        raw = json.dumps([kind, chat_id, payload], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def enqueue(self, kind, payload, chat_id=None, user_id=None):
+        """Ставит задачу; возвращает (id, создана ли новая) - повтор ожидающей задачи не дублируется"""
+        job_id, created = await asyncio.to_thread(self._enqueue, kind, payload, chat_id, user_id)
+        if created and self._wakeup is not None:
+            self._wakeup.set()
+        return job_id, created
+
+    def _enqueue(self, kind, payload, chat_id, user_id):
+        key = self.dedup_key(kind, chat_id, payload)
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id FROM jobs WHERE dedup_key = ? AND status IN (?, ?)", (key, QUEUED, RUNNING)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute("COMMIT")
+                    TASK_JOBS.inc(kind=kind, outcome="deduplicated")
+                    return row[0], False
+                cursor = self.conn.execute(
+                    "INSERT INTO jobs (kind, dedup_key, chat_id, user_id, payload, status, created_at, available_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (kind, key, chat_id, user_id, json.dumps(payload, ensure_ascii=False), QUEUED, now, now)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        TASK_JOBS.inc(kind=kind, outcome="enqueued")
+        return cursor.lastrowid, True
+
+    def _fetch(self, sql, params):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    async def get(self, job_id):
+        rows = await asyncio.to_thread(self._fetch, f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        return Job(rows[0]) if rows else None
+
+    async def recent_for_user(self, user_id, limit=5):
+        rows = await asyncio.to_thread(
+            self._fetch, f"SELECT {_JOB_COLUMNS} FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit)
+        )
+        return [Job(row) for row in rows]
+
+    async def position(self, job_id):
+        """Сколько задач в очереди перед этой"""
+        rows = await asyncio.to_thread(
+            self._fetch, "SELECT COUNT(*) FROM jobs WHERE status = ? AND id < ?", (QUEUED, job_id)
+        )
+        return rows[0][0]
+
+    def _claim(self):
+        """Атомарно берет следующую готовую задачу (или задачу с истекшей арендой)"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM jobs "
+                    "WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (QUEUED, now, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                    (RUNNING, now + Config.TASK_QUEUE_LEASE, row[0])
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        job = Job(row)
+        job.status, job.attempts = RUNNING, job.attempts + 1
+        return job
+
+    def _finish(self, job, status, error=None, retry_delay=None):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_until = NULL WHERE id = ?",
+                (status, error, time.time() + (retry_delay or 0), job.id)
+            )
+
+    def _save_result(self, job, result):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET result = ? WHERE id = ?", (json.dumps(result, ensure_ascii=False), job.id)
+            )
+        job.result, job.has_result = result, True
+
+    def _mark_delivered(self, job, parts):
+        with self._lock:
+            self.conn.execute("UPDATE jobs SET delivered = ? WHERE id = ?", (parts, job.id))
+        job.delivered = parts
+
+    async def mark_delivered(self, job, parts):
+        """Запоминает, что первые parts частей результата уже в чате (вызывается из deliver)"""
+        await asyncio.to_thread(self._mark_delivered, job, parts)
+
+    def _renew_lease(self, job):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                (time.time() + Config.TASK_QUEUE_LEASE, job.id, RUNNING)
+            )
+
+    async def _keep_lease(self, job):
+        """Продлевает аренду, пока задача выполняется: долгую задачу не возьмет другой воркер"""
+        while True:
+            await asyncio.sleep(Config.TASK_QUEUE_LEASE / 3)
+            try:
+                await asyncio.to_thread(self._renew_lease, job)
+            except sqlite3.Error as e:
+                logging.warning(f"Задача {job.id}: не удалось продлить аренду: {e}")
+
+    async def _execute(self, job):
+        run, deliver, fail = self._kinds[job.kind]
+        started = time.monotonic()
+        stage = "delivery" if job.has_result else "run"
+        keeper = asyncio.create_task(self._keep_lease(job))
+        try:
+            if not job.has_result:
+                try:
+                    result = await run(job)
+                finally:
+                    TASK_SECONDS.observe(time.monotonic() - started, kind=job.kind)
+                await asyncio.to_thread(self._save_result, job, result)
+                stage = "delivery"
+            # Задача завершена, только когда результат дошел до чата; ошибка отправки - повтор доставки
+            await deliver(self._bot, job, job.result)
+        except Exception as e:
+            if job.attempts < Config.TASK_QUEUE_MAX_ATTEMPTS:
+                delay = Config.TASK_QUEUE_RETRY_DELAY * (2 ** (job.attempts - 1))
+                logging.warning("Задача %d (%s), попытка %d (%s): %s; повтор через %.0fс",
+                                job.id, job.kind, job.attempts, stage, e, delay)
+                await asyncio.to_thread(self._finish, job, QUEUED, str(e), delay)
+                TASK_JOBS.inc(kind=job.kind, outcome="retry")
+                return
+            logging.error(f"Задача {job.id} ({job.kind}) не выполнена ({stage}): {e}")
+            await asyncio.to_thread(self._finish, job, FAILED, str(e))
+            TASK_JOBS.inc(kind=job.kind, outcome="failed")
+            if fail is not None:
+                await fail(self._bot, job, e)
+            return
+        finally:
+            keeper.cancel()
+
+        await asyncio.to_thread(self._finish, job, DONE)
+        TASK_JOBS.inc(kind=job.kind, outcome="done")
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logging.error(f"Очередь задач: ошибка SQLite: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # Задачи других процессов и отложенные повторы забираем опросом
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=Config.TASK_QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job.kind not in self._kinds:
+                await asyncio.to_thread(self._finish, job, FAILED, f"Неизвестный тип задачи: {job.kind}")
+                continue
+            self._running.add(job.id)
+            try:
+                await self._execute(job)
+            except Exception as e:
+                # Ошибка сообщения о неудаче (fail) или SQLite не должна останавливать воркер
+                logging.error(f"Задача {job.id}: {e}")
+            # При отмене воркера (остановка бота) id остается в _running - stop() вернет задачу в очередь
+            self._running.discard(job.id)
+
+    def start(self, bot):
+        """Запускает воркеры в текущем event loop (при старте Application)"""
+        if self._workers:
+            return
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+        logging.info("Очередь задач запущена: воркеров %d", self.workers_count)
+
+    async def stop(self):
+        """Останавливает воркеры; прерванные задачи снова попадут в очередь"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await asyncio.to_thread(self._close)
+
+    def _close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            # Свои прерванные задачи возвращаем в очередь сразу, не дожидаясь конца аренды
+            if self._running:
+                self._conn.executemany(
+                    "UPDATE jobs SET status = ?, lease_until = NULL WHERE id = ? AND status = ?",
+                    [(QUEUED, job_id, RUNNING) for job_id in self._running]
+                )
+                self._running.clear()
+            self._conn.close()
+            self._conn = None
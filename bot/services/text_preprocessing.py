@@ -0,0 +1,148 @@
+import re
+import numpy as np
+from bot.services.budget import parse_amounts, parse_budget
+
+# Один проход по тексту в нижнем регистре: кириллические и латинские серии букв,
+# прочие символы слов (цифры, другие алфавиты, "_") - отдельной серией
+_SCRIPT_RUN_RE = re.compile(r"([а-яё]+)|([a-z]+)|[^\Wа-яёa-z]+")
+
+# Русские и сокращенные написания марок и моделей
+BRAND_ALIASES = {
+    "бентли": "bentley",
+    "роллс": "rolls", "ролс": "rolls", "ройс": "royce", "rr": "rolls",
+}
+MODEL_ALIASES = {
+    "континенталь": "continental", "континентал": "continental", "континенталя": "continental",
+    "бентайга": "bentayga", "бентайгу": "bentayga", "бентайги": "bentayga",
+    "флаинг": "flying", "спур": "spur",
+    "фантом": "phantom", "фантома": "phantom",
+    "куллинан": "cullinan", "каллинан": "cullinan", "куллинана": "cullinan",
+}
+
+# Коды символов для пакетного определения языка
+_CYR_RANGES = ((0x410, 0x44F), (0x401, 0x401), (0x451, 0x451))
+_LAT_RANGES = ((0x41, 0x5A), (0x61, 0x7A))
+
+
+class PreprocessedText:
+    """Результат предобработки сообщения: язык, нормализованные токены и сущности"""
+
+    __slots__ = ("text", "language", "tokens", "normalized", "brands", "models", "amounts", "budget")
+
+    def __init__(self, text, language, tokens, brands=(), models=(), amounts=(), budget=None):
+        self.text = text
+        self.language = language
+        self.tokens = tokens
+        # Совпадает с response_cache.normalize_query
+        self.normalized = " ".join(tokens)
+        self.brands = brands
+        self.models = models
+        self.amounts = amounts
+        # Бюджет, названный в сообщении: (min, max) или None
+        self.budget = budget
+
+    def __repr__(self):
+        return (f"PreprocessedText(language={self.language!r}, tokens={self.tokens!r}, "
+                f"brands={self.brands!r}, models={self.models!r}, amounts={self.amounts!r}, budget={self.budget!r})")
+
+
+def scan(lower):
+    """Токены и число кириллических/латинских букв за один проход по тексту в нижнем регистре"""
+    tokens = []
+    cyrillic = latin = 0
+    last_end = -1
+    for match in _SCRIPT_RUN_RE.finditer(lower):
+        start, end = match.span()
+        if match.group(1):
+            cyrillic += end - start
+        elif match.group(2):
+            latin += end - start
+        # Соседние серии без разделителя - одно слово ("bentley2", "gt-3" -> "gt", "3")
+        if start == last_end:
+            tokens[-1] += match.group()
+        else:
+            tokens.append(match.group())
+        last_end = end
+    return tokens, cyrillic, latin
+
+
+def detect_languages(texts):
+    """Пакетное определение языка ('ru'/'en') по кодам символов всех текстов сразу"""
+    if not texts:
+        return []
+    codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    cyrillic = np.zeros(codes.shape, dtype=bool)
+    for low, high in _CYR_RANGES:
+        cyrillic |= (codes >= low) & (codes <= high)
+    latin = np.zeros(codes.shape, dtype=bool)
+    for low, high in _LAT_RANGES:
+        latin |= (codes >= low) & (codes <= high)
+    # Сумма по отрезкам каждого текста; пустые тексты дают 0
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    score = np.cumsum(np.concatenate(([0], cyrillic.astype(np.int64) - latin.astype(np.int64))))
+    diff = score[bounds[1:]] - score[bounds[:-1]]
+    return ["ru" if d > 0 else "en" for d in diff]
+
+
+class TextPreprocessor:
+    """Предобработка сообщений: один проход по тексту на сообщение.
+
+    Марки и модели распознаются по названиям из базы знаний (первое слово - марка,
+    первое слово остатка - модель) и русским написаниям из BRAND_ALIASES/MODEL_ALIASES.
+    """
+
+    def __init__(self, products=()):
+        self._brands = {}   # токен -> марка
+        self._models = {}   # токен -> полное название автомобиля
+        self._model_brands = {}
+        # Все слова названий автомобилей и их русские написания
+        self.vocabulary = set(BRAND_ALIASES) | set(MODEL_ALIASES)
+        for product in products:
+            name_tokens, _, _ = scan(product["name"].lower())
+            self.vocabulary.update(name_tokens)
+            brand = product["name"].split(" ", 1)[0]
+            brand_tokens, _, _ = scan(brand.lower())
+            for token in brand_tokens:
+                self._brands.setdefault(token, brand)
+            model_tokens = name_tokens[len(brand_tokens):]
+            if model_tokens:
+                self._models.setdefault(model_tokens[0], product["name"])
+                self._model_brands[product["name"]] = brand
+        for alias, token in BRAND_ALIASES.items():
+            if token in self._brands:
+                self._brands[alias] = self._brands[token]
+        for alias, token in MODEL_ALIASES.items():
+            if token in self._models:
+                self._models[alias] = self._models[token]
+
+    def _entities(self, tokens):
+        brands, models = [], []
+        for token in tokens:
+            brand = self._brands.get(token)
+            if brand is not None and brand not in brands:
+                brands.append(brand)
+            model = self._models.get(token)
+            if model is not None and model not in models:
+                models.append(model)
+                # Модель без марки ("хочу фантом") - марку подставляем по модели
+                if self._model_brands[model] not in brands:
+                    brands.append(self._model_brands[model])
+        return tuple(brands), tuple(models)
+
+    def preprocess(self, text, language=None):
+        """language - язык, если он уже известен (например, из настроек Telegram)"""
+        lower = text.lower()
+        tokens, cyrillic, latin = scan(lower)
+        if language is None:
+            language = "ru" if cyrillic > latin else "en"
+        brands, models = self._entities(tokens)
+        return PreprocessedText(
+            text, language, tokens, brands, models,
+            tuple(parse_amounts(lower)), parse_budget(lower, strict=True)
+        )
+
+    def preprocess_many(self, texts):
+        """Пакетная версия для офлайн-обработки: язык определяется векторно по всем текстам"""
+        texts = list(texts)
+        return [self.preprocess(text, language) for text, language in zip(texts, detect_languages(texts))]
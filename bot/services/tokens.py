@@ -0,0 +1,8 @@
+from config import Config
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов (без токенизатора конкретной модели)"""
+    if not text:
+        return 0
+    return len(text) // Config.CHARS_PER_TOKEN + 1
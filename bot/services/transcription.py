@@ -0,0 +1,201 @@
+import asyncio
+import collections
+import importlib.util
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from config import Config
+
+SAMPLE_RATE = 16000
+# Окно анализа громкости при поиске пауз
+_FRAME_SECONDS = 0.03
+
+
+async def decode_audio(data, sample_rate=SAMPLE_RATE):
+    """Декодирует файл любого формата (ogg/opus, mp3, m4a, wav) через ffmpeg в моно float32"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            Config.FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise RuntimeError(f"ffmpeg не найден: {Config.FFMPEG_BINARY}")
+    stdout, stderr = await process.communicate(bytes(data))
+    if process.returncode != 0:
+        raise ValueError(f"Не удалось декодировать аудио: {stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def split_on_silence(samples, sample_rate=SAMPLE_RATE, min_silence=None, max_segment=None):
+    """Границы сегментов речи [(start, end)] в отсчетах.
+
+    Громкость считается по окнам 30 мс; порог тишины - относительно громкости записи.
+    Разрез - в середине паузы не короче min_silence секунд; соседние куски склеиваются,
+    пока сегмент не длиннее max_segment секунд. Участки без пауз режутся по max_segment.
+    """
+    min_silence = min_silence or Config.AUDIO_MIN_SILENCE
+    max_segment = int((max_segment or Config.AUDIO_MAX_SEGMENT) * sample_rate)
+    frame = int(_FRAME_SECONDS * sample_rate)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    rms = np.sqrt(np.mean(samples[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    threshold = max(Config.AUDIO_SILENCE_THRESHOLD, np.percentile(rms, 95) * 0.1)
+    voiced = rms > threshold
+    if not voiced.any():
+        return []
+
+    # Серии тихих окон: начала и концы по разности маски
+    edges = np.diff(np.concatenate(([1], voiced.astype(np.int8), [1])))
+    silence_starts, silence_ends = np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
+    long_enough = (silence_ends - silence_starts) * _FRAME_SECONDS >= min_silence
+    cuts = ((silence_starts[long_enough] + silence_ends[long_enough]) // 2) * frame
+
+    bounds = np.unique(np.concatenate(([0], cuts, [len(samples)])))
+    segments = []
+    for left, right in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        # Куски без речи (тишина в начале и конце записи) пропускаем
+        if not voiced[left // frame:max(left // frame + 1, right // frame)].any():
+            continue
+        if segments and right - segments[-1][0] <= max_segment:
+            segments[-1] = (segments[-1][0], right)
+        else:
+            segments.append((left, right))
+
+    # Речь без пауз длиннее max_segment режем на равные части
+    result = []
+    for start, end in segments:
+        parts = -(-(end - start) // max_segment)
+        step = -(-(end - start) // parts)
+        result.extend((s, min(s + step, end)) for s in range(start, end, step))
+    return result
+
+
+class StubBackend:
+    """Заглушка распознавания для тестов и нагрузочных замеров: описывает сегмент вместо текста"""
+
+    def __init__(self, **options):
+        pass
+
+    def transcribe(self, samples, sample_rate, language=None):
+        return f"[речь {len(samples) / sample_rate:.1f} с]"
+
+
+class FasterWhisperBackend:
+    """Локальная модель faster-whisper на CPU (int8)"""
+
+    def __init__(self, model=None, compute_type="int8", **options):
+        from faster_whisper import WhisperModel
+        # Параллелизм - на уровне процессов пула, внутри процесса один поток
+        self.model = WhisperModel(model or Config.TRANSCRIBE_MODEL, device="cpu",
+                                  compute_type=compute_type, cpu_threads=1)
+
+    def transcribe(self, samples, sample_rate, language=None):
+        segments, _ = self.model.transcribe(samples, language=language, beam_size=1, vad_filter=False)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+BACKENDS = {
+    "stub": StubBackend,
+    "faster-whisper": FasterWhisperBackend,
+}
+# Пакет, без которого бэкенд не загрузится в процессах пула
+_BACKEND_PACKAGES = {"faster-whisper": "faster_whisper"}
+
+# Модель распознавания, загруженная в процессе пула
+_worker_backend = None
+
+
+def _init_worker(backend_name):
+    global _worker_backend
+    _worker_backend = BACKENDS[backend_name]()
+
+
+def _transcribe_segment(samples, sample_rate, language):
+    return _worker_backend.transcribe(samples, sample_rate, language)
+
+
+class Transcriber:
+    """Распознавание записи звонка: сегменты по паузам распознаются параллельно в пуле процессов.
+
+    Каждый процесс пула один раз загружает модель (TRANSCRIBE_BACKEND) и распознает сегменты
+    целиком на одном ядре, поэтому пропускная способность растет с числом ядер.
+    """
+
+    def __init__(self, backend=None, workers=None):
+        self.backend = backend or Config.TRANSCRIBE_BACKEND
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Неизвестный TRANSCRIBE_BACKEND: {self.backend}")
+        self.workers = workers or Config.TRANSCRIBE_WORKERS or os.cpu_count() or 1
+        self._pool = None
+
+    def start(self):
+        """Создает пул заранее - в on_startup, до запуска потоков бота (пул создается через fork),
+        чтобы модель не грузилась на первом сообщении"""
+        if self._pool is None:
+            package = _BACKEND_PACKAGES.get(self.backend)
+            if package and importlib.util.find_spec(package) is None:
+                raise RuntimeError(f"Для распознавания речи ({self.backend}) установите пакет {package}")
+            # fork - дочерние процессы не импортируют заново main и сервисы бота
+            context = multiprocessing.get_context(
+                "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+            )
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=_init_worker, initargs=(self.backend,)
+            )
+            # Первая задача запускает процессы пула, и они сразу загружают модель
+            self._pool.submit(os.getpid)
+            logging.info("Распознавание речи: %s, процессов %d", self.backend, self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def transcribe(self, samples, sample_rate=SAMPLE_RATE, language=None):
+        """Асинхронный генератор (номер, всего, начало в секундах, текст) - сегменты по порядку.
+
+        В работе одновременно не больше 2 сегментов на процесс: длинная запись
+        не копируется в очередь пула целиком.
+        """
+        pool = self.start()
+        loop = asyncio.get_running_loop()
+        # Короткую запись режем мельче, чтобы загрузить все процессы пула
+        duration = len(samples) / sample_rate
+        max_segment = min(Config.AUDIO_MAX_SEGMENT, max(Config.AUDIO_MIN_SEGMENT, duration / self.workers))
+        segments = await asyncio.to_thread(split_on_silence, samples, sample_rate, None, max_segment)
+        pending = collections.deque()
+        done = 0
+        try:
+            for start, end in segments:
+                pending.append(loop.run_in_executor(
+                    pool, _transcribe_segment, np.ascontiguousarray(samples[start:end]), sample_rate, language
+                ))
+                if len(pending) < self.workers * 2:
+                    continue
+                yield done, len(segments), segments[done][0] / sample_rate, await pending.popleft()
+                done += 1
+            while pending:
+                yield done, len(segments), segments[done][0] / sample_rate, await pending.popleft()
+                done += 1
+        except BrokenProcessPool:
+            # Процесс пула упал (например, не загрузилась модель) - следующий вызов создаст пул заново
+            self.close()
+            raise RuntimeError("Процессы распознавания речи завершились аварийно")
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,174 @@
+import bisect
+import logging
+import re
+import pandas as pd
+from config import Config
+
+_YEAR_RE = re.compile(r"\(.*?\)")
+_SPACE_RE = re.compile(r"\s+")
+
+# Типы кузова для правил вида "любой седан": слова из описания продукта в базе знаний
+BODY_TYPE_WORDS = {
+    "седан": ("седан", "sedan"),
+    "внедорожник": ("внедорожник", "suv", "кроссовер"),
+    "купе": ("купе", "coupe", "grand tourer", "gran turismo"),
+}
+# Вес источников кандидата при ранжировании
+RULE_WEIGHT = 2.0
+CO_PURCHASE_WEIGHT = 1.0
+
+
+def body_type(product):
+    """Тип кузова продукта по названию и описанию (ключ BODY_TYPE_WORDS) или None"""
+    text = f"{product.get('name', '')} {product.get('description', '')}".lower()
+    for body_type, words in BODY_TYPE_WORDS.items():
+        if any(word in text for word in words):
+            return body_type
+    return None
+
+
+def normalize_car(name):
+    """Ключ автомобиля: без года в скобках, нижний регистр, одиночные пробелы"""
+    return _SPACE_RE.sub(" ", _YEAR_RE.sub(" ", name or "")).strip().lower()
+
+
+def purchase_history(clients):
+    """Покупки всех клиентов таблицей (client, car, name, price) для матрицы совместных покупок.
+
+    Требует полного прохода по CRM, поэтому считается в фоне и переиспользуется,
+    пока не изменится выгрузка клиентов.
+    """
+    rows = []
+    for index, client in enumerate(clients):
+        cars = [(item.get("car"), item.get("price")) for item in client.get("purchase_history") or ()]
+        if client.get("previous_purchase"):
+            cars.append((client["previous_purchase"], None))
+        for name, price in cars:
+            rows.append((index, normalize_car(name), _YEAR_RE.sub("", name or "").strip(), price))
+    history = pd.DataFrame(rows, columns=["client", "car", "name", "price"])
+    return history[history["car"] != ""]
+
+
+class UpsellEngine:
+    """Рекомендации апсейла по заранее посчитанной таблице "автомобиль -> top-N кандидатов".
+
+    Кандидаты берутся из правил базы знаний (upsell_options), матрицы совместных покупок
+    по purchase_history() всех клиентов и следующих ступеней цены каталога (с наименьшим весом).
+    Без истории покупок таблица строится только по правилам и ступеням цены.
+    В запросе остается только поиск по словарю.
+    """
+
+    def __init__(self, products, upsell_options=(), history=None, top_n=None):
+        self.top_n = top_n or Config.UPSELL_TOP_N
+        self.catalog = {normalize_car(p["name"]): p for p in products}
+        self._names = {key: p["name"] for key, p in self.catalog.items()}
+        self._body_types = {key: body_type(p) for key, p in self.catalog.items()}
+        if history is None:
+            history = purchase_history(())
+        for key, name in zip(history["car"], history["name"]):
+            self._names.setdefault(key, name)
+        self.prices = self._prices(history)
+        candidates = {}
+        self._add_rules(candidates, upsell_options)
+        self._add_co_purchases(candidates, history)
+        self._add_price_steps(candidates)
+        self.table = self._rank(candidates)
+        logging.info("Апсейл: таблица рекомендаций для %d автомобилей", len(self.table))
+
+    def _prices(self, history):
+        """Цена автомобиля: из каталога, иначе медиана цен покупок"""
+        prices = history.dropna(subset=["price"]).groupby("car")["price"].median().to_dict()
+        prices.update({key: float(p["price_usd"]) for key, p in self.catalog.items() if p.get("price_usd")})
+        return prices
+
+    def _is_upsell(self, source, target):
+        if target == source or target not in self.catalog:
+            return False
+        source_price, target_price = self.prices.get(source), self.prices.get(target)
+        # Апсейл - не дешевле того, что у клиента уже есть
+        return source_price is None or target_price is None or target_price >= source_price
+
+    def _targets(self, text):
+        """Продукты каталога, упомянутые в поле to правила ("A или B")"""
+        return [
+            key for part in re.split(r"\s+или\s+|\s+or\s+|,", text or "")
+            if (key := normalize_car(part)) in self.catalog
+        ]
+
+    def _sources(self, text):
+        """Автомобили, к которым относится поле from правила (конкретная модель или "любой <тип кузова>")"""
+        key = normalize_car(text)
+        for body_type in BODY_TYPE_WORDS:
+            if body_type in key and ("любой" in key or "any" in key):
+                return [car for car, car_type in self._body_types.items() if car_type == body_type]
+        return [key]
+
+    def _add_rules(self, candidates, upsell_options):
+        for option in upsell_options:
+            for source in self._sources(option.get("from")):
+                for target in self._targets(option.get("to")):
+                    if self._is_upsell(source, target):
+                        entry = candidates.setdefault(source, {}).setdefault(target, [0.0, option.get("reason")])
+                        entry[0] += RULE_WEIGHT
+
+    def _add_co_purchases(self, candidates, history):
+        """Уверенность "купил source -> купил и target" по разреженной матрице совместных покупок"""
+        owned = history[["client", "car"]].drop_duplicates()
+        if owned.empty:
+            return
+        # Пары автомобилей одного клиента: истории короткие, поэтому self-join дешевле плотной матрицы
+        pairs = owned.merge(owned, on="client")
+        pairs = pairs[pairs["car_x"] != pairs["car_y"]]
+        co_purchases = pairs.groupby(["car_x", "car_y"]).size()
+        buyers = owned.groupby("car").size()
+        confidence = co_purchases.to_numpy() / buyers.reindex(
+            co_purchases.index.get_level_values(0)).to_numpy()
+        for (source, target), value in zip(co_purchases.index, confidence):
+            if self._is_upsell(source, target):
+                reason = f"Клиенты с {self._names[source]} также выбирают {self._names[target]}"
+                entry = candidates.setdefault(source, {}).setdefault(target, [0.0, reason])
+                entry[0] += CO_PURCHASE_WEIGHT * float(value)
+
+    def _add_price_steps(self, candidates):
+        """Следующие ступени цены каталога - с малым весом, добирают список до top-N.
+
+        Цены каталога сортируются один раз; ступени для каждого автомобиля - бинарный поиск.
+        """
+        ladder = sorted((self.prices[key], key) for key in self.catalog if self.prices.get(key, 0) > 0)
+        ladder_prices = [price for price, _ in ladder]
+        for source, price in self.prices.items():
+            start = bisect.bisect_right(ladder_prices, price)
+            for rank, (_, target) in enumerate(ladder[start:start + self.top_n]):
+                reason = f"Следующий уровень после {self._names[source]}"
+                candidates.setdefault(source, {}).setdefault(target, [0.1 / (rank + 1), reason])
+
+    def _rank(self, candidates):
+        table = {}
+        for source, targets in candidates.items():
+            ranked = sorted(targets.items(), key=lambda item: -item[1][0])[:self.top_n]
+            table[source] = tuple(
+                {"product": self.catalog[target]["name"], "reason": reason} for target, (_, reason) in ranked
+            )
+        return table
+
+    def recommend(self, client_info):
+        """Апсейл для клиента по его предыдущей покупке и истории покупок"""
+        if not client_info:
+            return []
+        owned = []
+        if client_info.get("previous_purchase"):
+            owned.append(normalize_car(client_info["previous_purchase"]))
+        owned.extend(normalize_car(item.get("car")) for item in client_info.get("purchase_history") or ())
+        owned_set = set(owned)
+
+        recommendations, seen = [], set()
+        for car in owned:
+            for rec in self.table.get(car, ()):
+                key = normalize_car(rec["product"])
+                if key in seen or key in owned_set:
+                    continue
+                seen.add(key)
+                recommendations.append(rec)
+                if len(recommendations) >= self.top_n:
+                    return recommendations
+        return recommendations
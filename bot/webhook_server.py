@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+from aiohttp import web
+from telegram import Bot, Update
+from config import Config
+from bot.services.metrics import registry, start_metrics_server
+
+# Ключи обновления Telegram, в которых может быть чат/пользователь
+_UPDATE_OBJECTS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "callback_query", "inline_query", "chosen_inline_result", "my_chat_member", "chat_member",
+)
+
+
+def chat_affinity_key(update_data):
+    """ID чата (или пользователя), по которому обновление закрепляется за воркером"""
+    for key in _UPDATE_OBJECTS:
+        obj = update_data.get(key)
+        if not obj:
+            continue
+        if key == "callback_query" and obj.get("message"):
+            obj = obj["message"]
+        chat = obj.get("chat") or obj.get("from") or {}
+        if "id" in chat:
+            return chat["id"]
+    return update_data.get("update_id", 0)
+
+
+def has_audio(update_data):
+    """Голосовое сообщение или аудиофайл - их распознает воркер 0 с пулом распознавания"""
+    message = update_data.get("message") or update_data.get("channel_post") or {}
+    return "voice" in message or "audio" in message
+
+
+def _worker_main(index, updates):
+    """Точка входа процесса-воркера"""
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(_worker_loop(index, updates))
+
+
+async def _worker_loop(index, updates):
+    from main import build_application
+
+    if Config.METRICS_PORT:
+        # Свой порт метрик у каждого воркера (процесс spawn - настройка меняется только в нем)
+        Config.METRICS_PORT += 1 + index
+    # Пул распознавания речи (по процессу с моделью на ядро) - только в одном воркере
+    Config.TRANSCRIBE_POOL = index == 0
+    application = build_application(with_updater=False)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logging.info("Воркер %d запущен", index)
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        # Дожидаемся обработки уже принятых обновлений перед остановкой
+        await application.update_queue.join()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+        logging.info("Воркер %d остановлен", index)
+
+
+WEBHOOK_UPDATES = registry.counter(
+    "webhook_updates_total", "Обновления, принятые webhook-сервером (accepted/forbidden/bad_request/queue_full)",
+    ["result"])
+
+
+class WebhookServer:
+    """Принимает обновления Telegram по webhook и раскладывает их по процессам-воркерам.
+
+    Все обновления одного чата попадают в один и тот же воркер, поэтому состояние
+    пользователя (режим, очередь сообщений) остается согласованным. Исключение -
+    голосовые сообщения и аудио: их обрабатывает воркер 0, единственный с пулом
+    распознавания (результат уходит в общую очередь задач и не зависит от режима).
+    """
+
+    def __init__(self, workers=None):
+        self.workers_count = workers or Config.WEBHOOK_WORKERS
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(maxsize=Config.WEBHOOK_QUEUE_SIZE) for _ in range(self.workers_count)]
+        self.processes = [None] * self.workers_count
+        self._monitor_task = None
+        self._metrics_runner = None
+
+    def _spawn(self, index):
+        process = self._ctx.Process(
+            target=_worker_main, args=(index, self.queues[index]), name=f"bot-worker-{index}", daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def _monitor(self):
+        # Перезапускаем упавшие воркеры
+        while True:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logging.error("Воркер %d завершился (код %s), перезапуск", index, process.exitcode)
+                    self._spawn(index)
+
+    async def handle_update(self, request):
+        if Config.WEBHOOK_SECRET and \
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token") != Config.WEBHOOK_SECRET:
+            WEBHOOK_UPDATES.inc(result="forbidden")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            WEBHOOK_UPDATES.inc(result="bad_request")
+            return web.Response(status=400)
+
+        index = 0 if has_audio(data) else chat_affinity_key(data) % self.workers_count
+        try:
+            self.queues[index].put_nowait(data)
+        except queue.Full:
+            # Telegram повторит доставку позже
+            logging.warning("Очередь воркера %d переполнена", index)
+            WEBHOOK_UPDATES.inc(result="queue_full")
+            return web.Response(status=503)
+        WEBHOOK_UPDATES.inc(result="accepted")
+        return web.Response()
+
+    async def on_startup(self, app):
+        for index in range(self.workers_count):
+            self._spawn(index)
+        self._monitor_task = asyncio.create_task(self._monitor())
+        if Config.METRICS_PORT:
+            self._metrics_runner = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+        if Config.WEBHOOK_URL:
+            bot = Bot(Config.TELEGRAM_TOKEN, base_url=Config.TELEGRAM_API_BASE_URL)
+            async with bot:
+                await bot.set_webhook(
+                    url=Config.WEBHOOK_URL + Config.WEBHOOK_PATH,
+                    secret_token=Config.WEBHOOK_SECRET or None,
+                    max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                )
+            logging.info("Webhook установлен: %s%s", Config.WEBHOOK_URL, Config.WEBHOOK_PATH)
+
+    async def on_shutdown(self, app):
+        if self._monitor_task:
+            self._monitor_task.cancel()
+        # Сигнал остановки каждому воркеру, они дообработают свои очереди
+        for updates in self.queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, Config.WEBHOOK_SHUTDOWN_TIMEOUT)
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(Config.WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/healthz", lambda request: web.Response(text="ok"))
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        return app
+
+
+def run_webhook_server():
+    server = WebhookServer()
+    print(f"Webhook-сервер запущен на {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}, воркеров: {server.workers_count}")
+    web.run_app(server.make_app(), host=Config.WEBHOOK_HOST, port=Config.WEBHOOK_PORT, print=None)
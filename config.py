@@ -11,6 +11,8 @@ BASE_DIR = Path(__file__).resolve().parent
 class Config:
     """Основные конфигурации проекта."""
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+    # Можно направить на локальный (в т.ч. фейковый) Bot API сервер
+    TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
     
     # Заголовки, необходимые для OpenRouter API
@@ -24,10 +26,197 @@ class Config:
     FREE_MODEL = "mistralai/mistral-7b-instruct:free"
     # Более мощная модель для сложных задач анализа
     ADVANCED_MODEL = "microsoft/wizardlm-2-8x22b" 
+
+    # Пул соединений к OpenRouter
+    OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    OPENROUTER_HTTP2 = os.getenv("OPENROUTER_HTTP2", "1") == "1"
+    OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "50"))
+    OPENROUTER_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20"))
+    OPENROUTER_KEEPALIVE_EXPIRY = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "60"))
+    OPENROUTER_CONNECT_TIMEOUT = 10
+    # Таймауты чтения (секунды) для каждого сценария
+    OPENROUTER_TIMEOUTS = {
+        "default": 30,
+        "sales": 30,
+        "analysis": 60,
+        "script": 90,
+    }
+
+    # Потоковые ответы в режиме продаж
+    SALES_STREAMING = os.getenv("SALES_STREAMING", "1") == "1"
+    # Минимальный интервал между правками сообщения (лимиты Telegram на edit)
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+    # Не редактировать сообщение, если добавилось меньше символов
+    STREAM_MIN_DELTA_CHARS = 20
+
+    # Режим запуска: "polling" или "webhook"
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+    # Webhook-сервер: публичный URL, адрес прослушивания и пул процессов-воркеров
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 2)))
+    WEBHOOK_QUEUE_SIZE = 1000
+    WEBHOOK_MAX_CONNECTIONS = 40
+    WEBHOOK_SHUTDOWN_TIMEOUT = 30
+
+    # Оценка токенов: символов на токен для смеси русского и английского текста
+    CHARS_PER_TOKEN = 3
+
+    # Анализ длинных звонков (map-reduce по частям транскрипта)
+    ANALYSIS_CHUNK_TOKENS = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "3000"))
+    ANALYSIS_MAX_PARALLEL = int(os.getenv("ANALYSIS_MAX_PARALLEL", "4"))
+
+    # Ограничения нагрузки
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "20"))
+    # Окно склейки быстрых сообщений одного чата (секунды)
+    CHAT_DEBOUNCE_SECONDS = float(os.getenv("CHAT_DEBOUNCE_SECONDS", "0.8"))
+    USER_STATE_MAX_SIZE = 10000
+    USER_STATE_TTL = 7 * 24 * 3600
     
     # Пути к данным
     DATA_DIR = BASE_DIR / "data"
     CRM_FILE = DATA_DIR / "crm" / "clients.json"
+    # Хранилище CRM: "sqlite" (по умолчанию) или "memory" (целиком из CRM_FILE)
+    CRM_BACKEND = os.getenv("CRM_BACKEND", "sqlite")
+    CRM_DB_FILE = Path(os.getenv("CRM_DB_FILE", DATA_DIR / "crm" / "clients.sqlite3"))
+    CRM_WRITE_BATCH_SIZE = 100
+    CRM_FLUSH_INTERVAL = 5.0
     KB_FILE = DATA_DIR / "knowledge_base" / "products.json"
     CALLS_DIR = DATA_DIR / "calls"
 
+    # Векторный поиск по каталогу
+    PRODUCT_INDEX_DIR = DATA_DIR / "index" / "products"
+    # Локальная модель sentence-transformers (пусто - хеширующий TF-IDF на NumPy)
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+    EMBEDDING_DIM = 1024
+    RETRIEVAL_TOP_K = 3
+    RETRIEVAL_MIN_SCORE = 0.05
+    # Допуск по бюджету при подборе автомобилей: цена в пределах бюджета ±20%
+    BUDGET_TOLERANCE = float(os.getenv("BUDGET_TOLERANCE", "0.2"))
+    # Сколько рекомендаций апсейла добавлять в промпт
+    UPSELL_TOP_N = 2
+
+    # Кэш ответов ИИ-продавца
+    RESPONSE_CACHE_DB = DATA_DIR / "cache" / "responses.sqlite3"
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+    RESPONSE_CACHE_MAX_ENTRIES = 5000
+    RESPONSE_CACHE_DISK_MAX_ENTRIES = 100000
+    # Порог косинусной близости для "похожего" запроса
+    RESPONSE_CACHE_SIMILARITY = 0.82
+
+    # Пакетный анализ звонков (python -m bot.services.batch_analyzer)
+    BATCH_ANALYSIS_WORKERS = int(os.getenv("BATCH_ANALYSIS_WORKERS", "8"))
+    ANALYSIS_RESULTS_DB = DATA_DIR / "analysis" / "results.sqlite3"
+    REPORTS_DIR = DATA_DIR / "reports"
+    REPORT_TOP_FAILURES = 20
+
+    # Скрипты продаж: успешные звонки-источники и хранилище готовых скриптов
+    SUCCESSFUL_CALLS_GLOB = os.getenv("SUCCESSFUL_CALLS_GLOB", "*good*.txt")
+    SCRIPTS_DIR = DATA_DIR / "scripts"
+    # Как часто (сек) заново сканировать звонки-источники при запросах скрипта
+    SCRIPT_SOURCES_TTL = float(os.getenv("SCRIPT_SOURCES_TTL", "30"))
+    # Пауза (сек) перед повторным фоновым дополнением скрипта после ошибки; удваивается до максимума
+    SCRIPT_UPDATE_BACKOFF = 60
+    SCRIPT_UPDATE_BACKOFF_MAX = 3600
+    # Больше этого объема звонки не передаются в промпт целиком, а сводятся к фразам по этапам
+    SCRIPT_DIRECT_MAX_TOKENS = int(os.getenv("SCRIPT_DIRECT_MAX_TOKENS", "6000"))
+    SCRIPT_EXTRACT_PARALLEL = int(os.getenv("SCRIPT_EXTRACT_PARALLEL", "4"))
+    SCRIPT_PHRASE_SIMILARITY = 0.6
+    SCRIPT_TOP_PHRASES = 8
+
+    # Шлюз OpenRouter: резервные модели по задачам, повторы, размыкатель, дублирующие запросы
+    MODEL_FALLBACKS = {
+        "default": [FREE_MODEL],
+        "sales": [FREE_MODEL] + [m for m in os.getenv(
+            "SALES_FALLBACK_MODELS", "meta-llama/llama-3-8b-instruct:free,openai/gpt-4o-mini").split(",") if m],
+        "analysis": [ADVANCED_MODEL] + [m for m in os.getenv(
+            "ANALYSIS_FALLBACK_MODELS", "openai/gpt-4o-mini").split(",") if m],
+        "script": [ADVANCED_MODEL] + [m for m in os.getenv(
+            "SCRIPT_FALLBACK_MODELS", "openai/gpt-4o-mini").split(",") if m],
+    }
+    RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+    RETRY_BASE_DELAY = 0.5
+    RETRY_MAX_DELAY = 10.0
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_RESET_TIMEOUT = 30.0
+    # Задачи, для которых включены дублирующие запросы после p95 задержки
+    HEDGED_TASKS = {t for t in os.getenv("HEDGED_TASKS", "sales").split(",") if t}
+    HEDGE_MIN_SAMPLES = 20
+
+    # Клиентский лимит запросов к LLM: корзины на модель (запросов/мин и токенов/мин)
+    MODEL_RATE_LIMITS = {
+        "default": {"rpm": 60, "tpm": 200000},
+        FREE_MODEL: {"rpm": 20, "tpm": 40000},
+    }
+    # Классы приоритета (меньше - важнее)
+    TASK_PRIORITIES = {"sales": 0, "analysis": 1, "script": 2, "summary": 3}
+    # Оценка длины ответа, если max_tokens не задан
+    DEFAULT_COMPLETION_TOKENS = 1000
+
+    # Метрики Prometheus: отдельный порт с /metrics (0 - выключено).
+    # В webhook-режиме METRICS_PORT - у приемника обновлений, воркер i слушает METRICS_PORT + 1 + i
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    # Цены моделей, USD за 1M токенов (prompt, completion) - если OpenRouter не вернул cost в usage
+    MODEL_PRICES = {
+        "openai/gpt-4o-mini": (0.15, 0.6),
+        "microsoft/wizardlm-2-8x22b": (0.5, 0.5),
+    }
+
+    # Бюджеты токенов переменных разделов промпта ИИ-продавца
+    PROMPT_SECTION_BUDGETS = {
+        "client": 200, "products": 500, "upsell": 150, "query": 500, "summary": 200, "history": 600,
+    }
+
+    # Очередь фоновых задач (анализ звонков, генерация скриптов)
+    TASK_QUEUE_DB = DATA_DIR / "queue" / "jobs.sqlite3"
+    TASK_QUEUE_WORKERS = int(os.getenv("TASK_QUEUE_WORKERS", "4"))
+    TASK_QUEUE_MAX_ATTEMPTS = 3
+    TASK_QUEUE_RETRY_DELAY = 10.0
+    # Период опроса базы (задачи других процессов, отложенные повторы), секунды
+    TASK_QUEUE_POLL_INTERVAL = 2.0
+    # Аренда задачи: если процесс упал, задача снова станет доступной через это время
+    TASK_QUEUE_LEASE = 600
+
+    # Горячая перезагрузка базы знаний и выгрузки CRM: период опроса файлов, секунды (0 - выключено)
+    HOT_RELOAD_INTERVAL = float(os.getenv("HOT_RELOAD_INTERVAL", "5"))
+
+    # Голосовые сообщения и записи звонков: распознавание речи в пуле процессов
+    # TRANSCRIBE_BACKEND: "faster-whisper" (локальная модель TRANSCRIBE_MODEL) или "stub" (для тестов)
+    TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "faster-whisper")
+    TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "small")
+    # Процессов распознавания (0 - по числу ядер)
+    TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "0"))
+    # Создавать ли пул распознавания в этом процессе. В webhook-режиме пул есть только у воркера 0:
+    # голосовые сообщения всех чатов направляются к нему, модель не загружается в каждом воркере
+    TRANSCRIBE_POOL = True
+    FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+    # Лимит Bot API на скачивание файла - 20 МБ
+    AUDIO_MAX_BYTES = 20 * 1024 * 1024
+    # Пауза, по которой режется запись, и максимальная длина сегмента, секунды
+    AUDIO_MIN_SILENCE = 0.5
+    AUDIO_MAX_SEGMENT = 30.0
+    # Короткие записи делятся на сегменты не короче этого, чтобы распознавание шло во всех процессах
+    AUDIO_MIN_SEGMENT = 5.0
+    # Минимальный порог тишины (RMS, сигнал в [-1, 1])
+    AUDIO_SILENCE_THRESHOLD = 0.01
+
+    # Локальный роутер намерений: ответы на вопросы о цене и каталоге без LLM
+    INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") == "1"
+    INTENT_TRAIN_FILE = DATA_DIR / "intents" / "train.jsonl"
+    # Минимальная уверенность классификатора для ответа из каталога
+    INTENT_MIN_CONFIDENCE = 0.85
+    # Более длинные сообщения считаются открытыми вопросами и идут в LLM
+    INTENT_FAST_PATH_MAX_TOKENS = 12
+
+    # Память диалога: последние реплики дословно, более старые - в резюме (бюджеты в токенах)
+    MEMORY_DB = DATA_DIR / "memory" / "conversations.sqlite3"
+    MEMORY_HISTORY_TOKENS = PROMPT_SECTION_BUDGETS["history"]
+    MEMORY_SUMMARY_TOKENS = PROMPT_SECTION_BUDGETS["summary"]
+    # Диалог без новых реплик дольше TTL забывается
+    MEMORY_TTL = int(os.getenv("MEMORY_TTL", str(7 * 24 * 3600)))
+    MEMORY_MAX_USERS = 10000
+    MEMORY_DISK_MAX_USERS = 100000
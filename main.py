@@ -1,7 +1,11 @@
 import logging
+import sys
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from config import Config
 from bot.handlers import main_handler
+from bot.services.openrouter_client import openrouter_client
+from bot.services.metrics import start_metrics_server
+from bot.services.file_watcher import FileWatcher
 
 # Настройка логирования
 logging.basicConfig(
@@ -9,18 +13,89 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+async def on_startup(application):
+    # Пул распознавания речи создается через fork - первым, пока в процессе нет других потоков
+    # (fork после запуска потоков может унаследовать захваченные блокировки); модель загружается сразу
+    if Config.TRANSCRIBE_POOL:
+        try:
+            main_handler.transcriber.start()
+        except RuntimeError as e:
+            logging.warning(f"Распознавание голосовых сообщений недоступно: {e}")
+    main_handler.rag_service.start()
+    # Один пул соединений к OpenRouter на все время работы бота
+    openrouter_client.start()
+    # Воркеры фоновой очереди; задачи, прерванные прошлым запуском, выполнятся снова
+    main_handler.task_queue.start(application.bot)
+    if Config.HOT_RELOAD_INTERVAL:
+        # Изменения каталога и выгрузки CRM подхватываются без перезапуска
+        watcher = FileWatcher([Config.KB_FILE, Config.CRM_FILE], main_handler.rag_service.reload)
+        watcher.start()
+        application.bot_data["file_watcher"] = watcher
+    if Config.METRICS_PORT:
+        application.bot_data["metrics_runner"] = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+
+async def on_stop(application):
+    # Дообрабатываем сообщения, уже принятые планировщиком чатов
+    await main_handler.chat_scheduler.drain()
+    # Дожидаемся фоновых обновлений резюме диалогов, пока клиент OpenRouter открыт
+    await main_handler.rag_service.memory.drain()
+    await main_handler.task_queue.stop()
+
+async def on_shutdown(application):
+    watcher = application.bot_data.pop("file_watcher", None)
+    if watcher is not None:
+        await watcher.stop()
+    await openrouter_client.close()
+    main_handler.transcriber.close()
+    # Дописываем накопленные изменения CRM
+    main_handler.rag_service.crm.close()
+    main_handler.rag_service.memory.close()
+    main_handler.rag_service.response_cache.log_stats()
+    metrics_runner = application.bot_data.pop("metrics_runner", None)
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+def register_handlers(application):
+    application.add_handler(CommandHandler("start", main_handler.start))
+    application.add_handler(CommandHandler("status", main_handler.status))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, main_handler.handle_message))
+    application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, main_handler.handle_audio))
+
+def build_application(with_updater=True):
+    """Собирает Application с обработчиками; без updater - для воркеров webhook-режима"""
+    builder = (
+        Application.builder()
+        .token(Config.TELEGRAM_TOKEN)
+        .base_url(Config.TELEGRAM_API_BASE_URL)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        # Обновления разных чатов обрабатываются параллельно, порядок внутри чата - ChatScheduler
+        .concurrent_updates(True)
+    )
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Добавляем обработчики
+    register_handlers(application)
+    return application
+
 def main():
     if not Config.TELEGRAM_TOKEN:
         raise ValueError("Необходимо указать TELEGRAM_TOKEN в .env файле")
     if not Config.OPENROUTER_API_KEY:
         raise ValueError("Необходимо указать OPENROUTER_API_KEY в .env файле")
 
-    application = Application.builder().token(Config.TELEGRAM_TOKEN).build()
+    # python main.py webhook - webhook-сервер с пулом воркеров вместо polling
+    mode = sys.argv[1] if len(sys.argv) > 1 else Config.BOT_MODE
+    if mode == "webhook":
+        from bot.webhook_server import run_webhook_server
+        run_webhook_server()
+        return
+
+    application = build_application()
 
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", main_handler.start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, main_handler.handle_message))
-    
     print("Бот запущен...")
     application.run_polling()
 